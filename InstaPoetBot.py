@@ -3,21 +3,26 @@ import json
 import random
 import shutil
 import requests
+import threading
 import time
 from datetime import datetime, timedelta
 import openai
 import cloudinary
 import cloudinary.uploader
-from PIL import Image
-import piexif
+
+from web import exif_reader, optimizer, strategies
+from web.config_manager import ConfigFile
 
 def get_root_dir():
     return os.path.abspath(os.sep)
 
+CONFIG_FILE = ConfigFile(get_root_dir()+"root/config.json")
+post_now_event = threading.Event()
+last_posted = {}  # 分類 -> 本程序內最後一次成功發文的時間
+
 def load_config():
     try:
-        with open(get_root_dir()+"root/config.json", "r", encoding="utf-8") as f:
-            return json.load(f)
+        return CONFIG_FILE.load()
     except FileNotFoundError:
         print("❌ Error: config.json not found!")
         exit(1)
@@ -27,6 +32,14 @@ def load_config():
 
 config = load_config()
 
+def on_config_change(new, old):
+    global config
+    config = new
+    if new.get("POST_NOW") == "YES":
+        post_now_event.set()
+
+CONFIG_FILE.subscribe(on_config_change)
+
 ACCESS_TOKEN = config["ACCESS_TOKEN"]
 INSTAGRAM_BUSINESS_ID = config["INSTAGRAM_BUSINESS_ID"]
 LOG_FILE = get_root_dir()+config["LOG_FILE"]
@@ -41,6 +54,8 @@ cloudinary.config(
 
 openai.api_key = config["OPENAI_API_KEY"]
 
+rng = random.Random(config.get("SELECTION_SEED"))
+
 def get_random_image():
     available_folders = {}
 
@@ -54,25 +69,37 @@ def get_random_image():
         log_message("❌ 所有資料夾都沒有圖片，無法發文！")
         return None, None
 
-    selected_category = random.choice(list(available_folders.keys()))
+    order = strategies.order_categories(config.get("SELECTION_STRATEGY", "random"), list(available_folders),
+                                        config.get("CATEGORY_WEIGHTS"), last_posted, rng)
+    if not order:
+        log_message("❌ 所有有圖片的分類權重皆為 0，無法發文！")
+        return None, None
+
+    selected_category = order[0]
     folder_path, images = available_folders[selected_category]
-    selected_image = random.choice(images)
+    selected_image = rng.choice(images)
 
     return os.path.join(folder_path, selected_image), selected_category
 
 def get_exif_info(image_path):
-    try:
-        img = Image.open(image_path)
-        exif_dict = piexif.load(img.info.get("exif", b""))
-        json_data = exif_dict["0th"].get(piexif.ImageIFD.ImageDescription, b"").decode("utf-8")
-        metadata = json.loads(json_data)
-        return metadata
-    except Exception as e:
-        print(f"EXIF 讀取失敗或不存在: {e}")
-        return None
+    metadata = exif_reader.read_json(image_path)
+    if metadata is None:
+        print(f"EXIF 讀取失敗或不存在: {image_path}")
+    return metadata
 
 def upload_image_to_cloudinary(image_path):
-    response = cloudinary.uploader.upload(image_path)
+    upload_path = image_path
+    if optimizer.enabled(config):
+        try:
+            upload_path = optimizer.optimize_file(
+                image_path,
+                max_edge=int(config.get("UPLOAD_MAX_EDGE", optimizer.MAX_EDGE)),
+                quality=int(config.get("UPLOAD_QUALITY", optimizer.QUALITY)),
+                crop=bool(config.get("UPLOAD_CROP_ASPECT", False)),
+            )
+        except Exception as e:
+            log_message(f"⚠️ 圖片最佳化失敗，改上傳原檔：{e}")
+    response = cloudinary.uploader.upload(upload_path)
     return response.get("secure_url")
 
 def generate_caption(image_url, category, metadata):
@@ -130,16 +157,15 @@ def log_message(message):
 
 def wait_next_post(wait_days, post_time):
     wait_days = max(wait_days, 1)  # 強制至少等一天
-    global config
     now = datetime.now()
     post_hour, post_minute = map(int, post_time.split(':'))
     next_post_time = now + timedelta(days=wait_days)
     next_post_time = next_post_time.replace(hour=post_hour, minute=post_minute, second=0, microsecond=0)
     log_message(f'下一次發文時間設定為 {next_post_time}')
+    # 設定檔由監看執行緒負責重新載入，POST_NOW 改為 YES 時會立刻喚醒
     while True:
-        config = load_config()
         now = datetime.now()
-        
+
         if now >= next_post_time:
             log_message(f"⏰ 到達 {next_post_time}，開始發文...")
 
@@ -148,14 +174,15 @@ def wait_next_post(wait_days, post_time):
 
             log_message("📢 POST_NOW is YES, returning immediately.")
             config["POST_NOW"] = "NO"
-            with open(get_root_dir() + "root/config.json", "w", encoding="utf-8") as f:
-                json.dump(config, f, ensure_ascii=False, indent=4)
+            CONFIG_FILE.save(config)
+            post_now_event.clear()
             return
 
-        # print(f'wait_next_post wait 30 sec config["POST_NOW"] = {config["POST_NOW"]}')
-        time.sleep(30)
+        post_now_event.wait((next_post_time - now).total_seconds())
+        post_now_event.clear()
 
 def main():
+    CONFIG_FILE.start_watcher()
     while True:
         wait_next_post(config["WAIT_DAYS"], config["POST_TIME"])
         
@@ -193,6 +220,7 @@ def main():
 
         if "id" in result:
             shutil.move(image_path, os.path.join(PUBLISHED_FOLDER, os.path.basename(image_path)))
+            last_posted[category] = datetime.now()
             log_message(f"✅ Instagram 發文成功！圖片已移動至已發佈資料夾: {result['id']}")
         else:
             log_message(f"❌ Instagram 發文失敗: {result}")
@@ -1,11 +1,26 @@
 import os
 import json
+import queue
+import threading
 import piexif
 import tkinter as tk
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from tkinter import filedialog, messagebox, ttk
-from PIL import Image, ImageTk
+from PIL import Image, ImageOps, ImageTk
 import pyheif
 
+from web import exif_reader
+
+IMAGE_EXTS = ('.jpg', '.jpeg', '.heic')
+SCAN_WORKERS = 4
+UI_BATCH = 300  # 每次 after 回呼最多處理的訊息數，避免一次塞太多列卡住畫面
+POLL_MS = 30
+STATUS_TEXT = {True: "✅ 已設定", False: "❌ 未設定", None: "⏳ 檢查中"}
+PREVIEW_SIZE = (300, 300)
+PREVIEW_CACHE = 32  # 最多保留幾張已轉好的 PhotoImage
+PREFETCH_ROWS = 2  # 選取時預先解碼上下各幾列
+
 def convert_heic_to_jpeg(heic_path):
     heif_file = pyheif.read(heic_path)
     image = Image.frombytes(
@@ -18,6 +33,19 @@ def convert_heic_to_jpeg(heic_path):
     )
     return image
 
+def load_preview(path):
+    """在背景執行緒解碼縮小後的預覽圖；JPEG 以 draft 模式直接用 1/2～1/8 解析度解碼"""
+    if path.lower().endswith('.heic'):
+        img = convert_heic_to_jpeg(path)
+    else:
+        img = Image.open(path)
+        img.draft("RGB", PREVIEW_SIZE)
+    img = ImageOps.exif_transpose(img)
+    img.thumbnail(PREVIEW_SIZE)
+    if img.mode not in ("RGB", "RGBA", "L"):
+        img = img.convert("RGB")
+    return img
+
 class ExifEditorApp:
     def __init__(self, root):
         self.root = root
@@ -27,6 +55,19 @@ class ExifEditorApp:
         self.image_path = None
         self.folder_path = None
         self.images_info = []
+
+        # 背景掃描：worker 只把結果放進 queue，Treeview 一律在主執行緒以 root.after 更新
+        self._pool = ThreadPoolExecutor(max_workers=SCAN_WORKERS)
+        self._results = queue.Queue()
+        self._scan_gen = 0  # 切換資料夾時遞增，舊掃描的結果直接丟棄
+        self._status_cache = {}  # 路徑 -> (mtime_ns, size, 是否有 metadata)
+        # 預覽：解碼在獨立的 pool 進行，PhotoImage 只能在主執行緒建立，依 (路徑, mtime, size) 做 LRU
+        self._preview_pool = ThreadPoolExecutor(max_workers=2)
+        self._previews = OrderedDict()
+        self._decoding = {}  # key -> Future
+        self._wanted = None  # 目前要顯示的預覽
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.root.after(POLL_MS, self._drain)
         
         # 左側面板 - 圖片列表
         left_panel = ttk.Frame(root)
@@ -80,38 +121,120 @@ class ExifEditorApp:
             self.scan_folder()
     
     def scan_folder(self):
-        """掃描資料夾中的所有圖片並檢查metadata狀態"""
-        # 清空現有列表
-        for item in self.tree.get_children():
-            self.tree.delete(item)
-        
-        # 掃描資料夾
-        for filename in os.listdir(self.folder_path):
-            if filename.lower().endswith(('.jpg', '.jpeg', '.heic', '.HEIC')):
-                file_path = os.path.join(self.folder_path, filename)
-                has_metadata = self.check_metadata(file_path)
-                status = "✅ 已設定" if has_metadata else "❌ 未設定"
-                self.tree.insert("", tk.END, values=(filename, status))
-    
+        """在背景掃描資料夾：先列出所有檔案，狀態未快取（或 mtime 有變）的檔案再交給 worker 檢查"""
+        self._scan_gen += 1
+        self.tree.delete(*self.tree.get_children())
+        threading.Thread(target=self._list_folder, args=(self._scan_gen, self.folder_path),
+                         daemon=True).start()
+
+    def _list_folder(self, gen, folder):
+        """worker 執行緒：不碰任何 Tk 元件"""
+        try:
+            with os.scandir(folder) as it:
+                entries = sorted((e for e in it if e.name.lower().endswith(IMAGE_EXTS) and e.is_file()),
+                                 key=lambda e: e.name)
+        except OSError:
+            return
+        rows, todo = [], []
+        for entry in entries:
+            st = entry.stat()
+            cached = self._status_cache.get(entry.path)
+            if cached and cached[:2] == (st.st_mtime_ns, st.st_size):
+                rows.append((entry.name, cached[2]))
+            else:
+                rows.append((entry.name, None))
+                todo.append((entry.name, entry.path, st))
+        for i in range(0, len(rows), UI_BATCH):
+            self._results.put((gen, "rows", rows[i:i + UI_BATCH]))
+        for name, path, st in todo:
+            if gen != self._scan_gen:
+                return
+            self._pool.submit(self._check_one, gen, name, path, st)
+
+    def _check_one(self, gen, name, path, st):
+        if gen != self._scan_gen:
+            return
+        has_metadata = self.check_metadata(path)
+        self._status_cache[path] = (st.st_mtime_ns, st.st_size, has_metadata)
+        self._results.put((gen, "status", (name, has_metadata)))
+
+    def _drain(self):
+        """主執行緒：把 worker 的結果分批寫進 Treeview"""
+        try:
+            handled = 0
+            while handled < UI_BATCH:
+                try:
+                    gen, kind, payload = self._results.get_nowait()
+                except queue.Empty:
+                    break
+                if kind == "preview":
+                    self._preview_ready(*payload)
+                    handled += 1
+                    continue
+                if gen != self._scan_gen:
+                    continue
+                if kind == "rows":
+                    for name, has_metadata in payload:
+                        # 掃描途中寫入 metadata 的檔案可能已由 _update_row 先加上
+                        if not self.tree.exists(name):
+                            self.tree.insert("", tk.END, iid=name, values=(name, STATUS_TEXT[has_metadata]))
+                    handled += len(payload)
+                elif self.tree.exists(payload[0]):
+                    self.tree.set(payload[0], "status", STATUS_TEXT[payload[1]])
+                    handled += 1
+        finally:
+            # 處理結果時出錯也要繼續輪詢，否則之後的掃描結果都不會再顯示
+            self.root.after(POLL_MS, self._drain)
+
+    def _update_row(self, path, metadata):
+        """寫入後只更新該檔案的那一列（HEIC 另存的 JPEG 是新檔案，補上一列）"""
+        if not self.folder_path or os.path.dirname(os.path.abspath(path)) != os.path.abspath(self.folder_path):
+            return
+        has_metadata = bool(metadata.get("store_name") or metadata.get("description") or metadata.get("location"))
+        st = os.stat(path)
+        self._status_cache[path] = (st.st_mtime_ns, st.st_size, has_metadata)
+        name = os.path.basename(path)
+        if self.tree.exists(name):
+            self.tree.set(name, "status", STATUS_TEXT[has_metadata])
+        else:
+            self.tree.insert("", tk.END, iid=name, values=(name, STATUS_TEXT[has_metadata]))
+
+    def on_close(self):
+        self._scan_gen += 1
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        self._preview_pool.shutdown(wait=False, cancel_futures=True)
+        self.root.destroy()
+
     def check_metadata(self, image_path):
-        """檢查圖片是否有metadata"""
+        """檢查圖片是否有metadata（只讀檔頭，不解碼圖片）"""
         try:
-            img = Image.open(image_path)
-            exif_dict = piexif.load(img.info.get("exif", b""))
-            json_data = exif_dict["0th"].get(piexif.ImageIFD.ImageDescription, b"").decode("utf-8")
-            metadata = json.loads(json_data)
+            metadata = exif_reader.read_json(image_path, fallback=self._read_metadata_pil)
             return bool(metadata.get("store_name") or metadata.get("description") or metadata.get("location"))
         except:
             return False
+
+    def _read_metadata_pil(self, image_path):
+        """HEIC 等非 JPEG 格式仍以 PIL 讀取；HEIC 只讀 metadata 區塊，不解碼影像"""
+        if image_path.lower().endswith('.heic'):
+            heif = pyheif.open(image_path)
+            exif = next((m["data"] for m in heif.metadata or () if m["type"] == "Exif"), b"")
+            start = exif.find(b"Exif\x00\x00")  # libheif 的 Exif 區塊前面有 4 bytes 位移
+            exif = exif[start:] if start >= 0 else exif
+        else:
+            exif = Image.open(image_path).info.get("exif", b"")
+        exif_dict = piexif.load(exif)
+        json_data = exif_dict["0th"].get(piexif.ImageIFD.ImageDescription, b"").decode("utf-8")
+        return json.loads(json_data)
     
     def on_select_image(self, event):
         """當在列表中選擇圖片時"""
         selection = self.tree.selection()
         if selection:
-            filename = self.tree.item(selection[0])["values"][0]
+            filename = selection[0]
             self.image_path = os.path.join(self.folder_path, filename)
             self.show_image_preview()
             self.read_exif()
+            self._prefetch_neighbours(filename)
     
     def select_image(self):
         """選擇單一圖片檔案並預覽"""
@@ -122,15 +245,57 @@ class ExifEditorApp:
             self.read_exif()
     
     def show_image_preview(self):
-        """顯示圖片預覽"""
-        if self.image_path.lower().endswith('.heic'):
-            img = convert_heic_to_jpeg(self.image_path)
-        else:
-            img = Image.open(self.image_path)
-        img.thumbnail((300, 300))  # 讓圖片維持比例縮放到適合大小
-        img_tk = ImageTk.PhotoImage(img)
-        self.image_label.config(image=img_tk)
-        self.image_label.image = img_tk
+        """顯示圖片預覽；快取中沒有時在背景解碼，完成後由 _drain 顯示"""
+        self._wanted = self._request_preview(self.image_path)
+        photo = self._previews.get(self._wanted)
+        if photo is not None:
+            self._previews.move_to_end(self._wanted)
+            self._show_preview(photo)
+
+    def _request_preview(self, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        key = (path, st.st_mtime_ns, st.st_size)
+        if key not in self._previews and key not in self._decoding:
+            self._decoding[key] = self._preview_pool.submit(self._decode_preview, key)
+        return key
+
+    def _decode_preview(self, key):
+        try:
+            img = load_preview(key[0])
+        except Exception:
+            img = None
+        self._results.put((None, "preview", (key, img)))
+
+    def _preview_ready(self, key, img):
+        self._decoding.pop(key, None)
+        if img is not None:
+            self._previews[key] = ImageTk.PhotoImage(img)
+            self._previews.move_to_end(key)
+            while len(self._previews) > PREVIEW_CACHE:
+                self._previews.popitem(last=False)
+        if key == self._wanted:
+            self._show_preview(self._previews.get(key))
+
+    def _show_preview(self, photo):
+        self.image_label.config(image=photo or "")
+        self.image_label.image = photo
+
+    def _prefetch_neighbours(self, iid):
+        """預先解碼上下相鄰的列；已經離開附近、還在排隊的解碼直接取消"""
+        keep = {self._wanted}
+        for step in (self.tree.next, self.tree.prev):
+            item = iid
+            for _ in range(PREFETCH_ROWS):
+                item = step(item)
+                if not item:
+                    break
+                keep.add(self._request_preview(os.path.join(self.folder_path, item)))
+        for key, future in list(self._decoding.items()):
+            if key not in keep and future.cancel():
+                del self._decoding[key]
     
     def write_exif(self):
         """寫入 JSON 至 EXIF"""
@@ -158,9 +323,8 @@ class ExifEditorApp:
             img = Image.open(self.image_path)
             img.save(self.image_path, exif=exif_bytes)
         
-        # 更新列表中的狀態
-        if self.folder_path:
-            self.scan_folder()
+        # 只更新這張圖片在列表中的狀態
+        self._update_row(self.image_path, metadata)
     
     def read_exif(self):
         """讀取 EXIF JSON"""
@@ -168,13 +332,8 @@ class ExifEditorApp:
             return
 
         try:
-            if self.image_path.lower().endswith('.heic'):
-                img = convert_heic_to_jpeg(self.image_path)
-            else:
-                img = Image.open(self.image_path)
-            exif_dict = piexif.load(img.info.get("exif", b""))
-            json_data = exif_dict["0th"].get(piexif.ImageIFD.ImageDescription, b"").decode("utf-8")
-            metadata = json.loads(json_data)
+            # 只讀檔頭；HEIC 的影像已由預覽解碼，這裡不再解碼第二次
+            metadata = exif_reader.read_json(self.image_path, fallback=self._read_metadata_pil)
 
             self.store_name_entry.delete(0, tk.END)
             self.store_name_entry.insert(0, metadata.get("store_name", ""))
@@ -7,6 +7,8 @@ from PIL import Image
 from werkzeug.utils import secure_filename
 import io
 
+from web import exif_reader
+
 app = Flask(__name__)
 CORS(app)
 
@@ -129,30 +131,19 @@ def scan_folder():
     print(f"掃描完成，找到 {len(results)} 個圖片")
     return jsonify(results)
 
+def _read_metadata_pil(filepath):
+    """檔頭解析不支援的格式改用 PIL 讀取"""
+    exif = Image.open(filepath).info.get("exif", b"")
+    if not exif:
+        return None
+    raw = piexif.load(exif).get("0th", {}).get(piexif.ImageIFD.ImageDescription)
+    return json.loads(raw.decode("utf-8")) if raw else None
+
 def read_metadata(filepath):
     print(f"=== 讀取檔案 metadata：{filepath} ===")
     try:
-        img = Image.open(filepath)
-        print("成功打開圖片")
-        
-        exif = img.info.get("exif", b"")
-        print(f"EXIF 資料存在：{'是' if exif else '否'}")
-        
-        if not exif:
-            print("沒有 EXIF 資料")
-            return None
-            
-        exif_dict = piexif.load(exif)
-        print("成功載入 EXIF 字典")
-        
-        if "0th" not in exif_dict or piexif.ImageIFD.ImageDescription not in exif_dict["0th"]:
-            print("找不到 ImageDescription")
-            return None
-            
-        json_data = exif_dict["0th"][piexif.ImageIFD.ImageDescription].decode("utf-8")
-        print(f"JSON 資料：{json_data}")
-        
-        metadata = json.loads(json_data)
+        # 只解析檔頭的 EXIF 區塊，不開啟 / 解碼整張圖片
+        metadata = exif_reader.read_json(filepath, fallback=_read_metadata_pil)
         print(f"解析後的 metadata：{metadata}")
         return metadata
     except Exception as e:
@@ -0,0 +1,55 @@
+"""比較 metadata 讀取速度：PIL + piexif（舊路徑） vs 只讀檔頭的 exif_reader
+
+用法：python benchmarks/bench_metadata_read.py [張數] [寬] [高]
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+
+import piexif
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from web import exif_reader  # noqa: E402
+from web.metadata_handler import _read_metadata_pil  # noqa: E402
+
+
+def make_images(folder: str, count: int, size: tuple[int, int]) -> list[str]:
+    meta = {"description": "台北夜景", "tags": ["夜景", "城市", "台灣"], "location": "台北"}
+    exif = piexif.dump({"0th": {piexif.ImageIFD.ImageDescription: json.dumps(meta, ensure_ascii=False).encode()}})
+    base = Image.effect_noise(size, 64).convert("RGB")
+    paths = []
+    for i in range(count):
+        path = os.path.join(folder, f"img_{i:05d}.jpg")
+        base.save(path, quality=90, exif=exif)
+        paths.append(path)
+    return paths
+
+
+def bench(label: str, fn, paths: list[str]) -> float:
+    start = time.perf_counter()
+    results = fn(paths)
+    elapsed = time.perf_counter() - start
+    ok = sum(1 for r in results if r)
+    print(f"{label:<28} {elapsed * 1000:9.1f} ms  {elapsed / len(paths) * 1e6:8.1f} µs/張  ({ok}/{len(paths)} 有 metadata)")
+    return elapsed
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    size = (int(sys.argv[2]), int(sys.argv[3])) if len(sys.argv) > 3 else (4000, 3000)
+    with tempfile.TemporaryDirectory() as folder:
+        print(f"產生 {count} 張 {size[0]}x{size[1]} JPEG...")
+        paths = make_images(folder, count, size)
+        print(f"平均檔案大小：{sum(os.path.getsize(p) for p in paths) / count / 1e6:.2f} MB\n")
+
+        pil = bench("PIL + piexif", lambda ps: [_read_metadata_pil(p) for p in ps], paths)
+        fast = bench("exif_reader", lambda ps: [exif_reader.read_json(p) for p in ps], paths)
+        print(f"\n加速：{pil / fast:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
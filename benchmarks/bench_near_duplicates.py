@@ -0,0 +1,49 @@
+"""近似重複索引在大量圖片下的速度：建立索引、單次查詢、整體分群
+
+用法：python benchmarks/bench_near_duplicates.py [張數] [距離]
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from web.similarity import HammingIndex  # noqa: E402
+
+
+def make_hashes(count: int, rng: random.Random) -> list[int]:
+    # 約 2% 為既有圖片翻轉 1~3 個位元的近似版本（連拍、重新輸出）
+    hashes = [rng.getrandbits(64) for _ in range(count)]
+    for i in range(count // 50):
+        h = hashes[i]
+        for _ in range(rng.randint(1, 3)):
+            h ^= 1 << rng.randrange(64)
+        hashes[count - 1 - i] = h
+    return hashes
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    radius = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    hashes = make_hashes(count, random.Random(1))
+
+    start = time.perf_counter()
+    index = HammingIndex(radius)
+    for i, h in enumerate(hashes):
+        index.add(f"img_{i:06d}.jpg", h)
+    print(f"建立索引（{count} 張，距離 {radius}）  {(time.perf_counter() - start) * 1000:9.1f} ms")
+
+    probes = hashes[:1000]
+    start = time.perf_counter()
+    found = sum(len(index.query(h)) for h in probes)
+    elapsed = time.perf_counter() - start
+    print(f"查詢 {len(probes)} 次                    {elapsed * 1000:9.1f} ms  {elapsed / len(probes) * 1e6:8.1f} µs/次  （{found} 筆結果）")
+
+    start = time.perf_counter()
+    groups = index.clusters()
+    print(f"分群                            {(time.perf_counter() - start) * 1000:9.1f} ms  （{len(groups)} 組）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""多帳號設定
+
+config.json 的 ACCOUNTS 為帳號清單，每個帳號至少要有 id，其餘欄位（INSTAGRAM_BUSINESS_ID、
+ACCESS_TOKEN、IMAGE_FOLDERS、PUBLISHED_FOLDER、POST_TIME、WAIT_DAYS、CATEGORY_PROMPTS…）
+會覆蓋最外層的同名設定。沒有設定 ACCOUNTS 時，整份設定即為唯一的 default 帳號。
+"""
+DEFAULT_ID = "default"
+
+
+def list_accounts(cfg: dict, include_disabled: bool = False) -> list[dict]:
+    base = {k: v for k, v in cfg.items() if k != "ACCOUNTS"}
+    entries = cfg.get("ACCOUNTS") or []
+    if not entries:
+        return [{**base, "ACCOUNT_ID": DEFAULT_ID, "ACCOUNT_NAME": base.get("ACCOUNT_NAME", "預設帳號")}]
+
+    result = []
+    for entry in entries:
+        if not include_disabled and entry.get("ENABLED", True) is False:
+            continue
+        account_id = str(entry["id"])
+        overrides = {k: v for k, v in entry.items() if k not in ("id", "name")}
+        result.append({**base, **overrides, "ACCOUNT_ID": account_id,
+                       "ACCOUNT_NAME": entry.get("name") or account_id})
+    return result
+
+
+def account_config(cfg: dict, account_id: str | None = None) -> dict:
+    """取得合併後的帳號設定；未指定時回傳第一個帳號"""
+    accounts = list_accounts(cfg)
+    if not accounts:
+        raise KeyError("沒有啟用中的帳號")
+    if account_id is None:
+        return accounts[0]
+    for acc in accounts:
+        if acc["ACCOUNT_ID"] == account_id:
+            return acc
+    raise KeyError(f"找不到帳號：{account_id}")
+
+
+def summary(acc: dict) -> dict:
+    return {
+        "id":        acc["ACCOUNT_ID"],
+        "name":      acc["ACCOUNT_NAME"],
+        "post_time": acc.get("POST_TIME", "17:00"),
+        "wait_days": acc.get("WAIT_DAYS", 1),
+        "folders":   acc.get("IMAGE_FOLDERS", {}),
+    }
@@ -0,0 +1,115 @@
+"""批次修改圖片 metadata：先檢查所有檔案，全部通過才開始寫入
+
+- merge：以 JSON Merge Patch（RFC 7386）合併，值為 null 的欄位會被刪除
+- replace：整份 metadata 換成 patch
+每個檔案只替換 EXIF 區段並以暫存檔 + os.replace 原子性更新，不重新編碼影像；
+最多 METADATA_WRITE_WORKERS 個檔案同時寫入，全部完成後以一次交易更新 image_catalog。
+"""
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from . import accounts, catalog, exif_writer, heic
+from .metadata_handler import update_metadata
+
+MODES = ("merge", "replace")
+MAX_FILES = 10000
+WRITE_WORKERS = 8
+
+
+class Invalid(ValueError):
+    """檢查未通過；results 為各檔案的檢查結果，沒有任何檔案被寫入"""
+
+    def __init__(self, message: str, results: list[dict]):
+        super().__init__(message)
+        self.results = results
+
+
+def merge_patch(target, patch):
+    if not isinstance(patch, dict):
+        return patch
+    result = dict(target) if isinstance(target, dict) else {}
+    for key, value in patch.items():
+        if value is None:
+            result.pop(key, None)
+        else:
+            result[key] = merge_patch(result.get(key), value)
+    return result
+
+
+def _library(cfg: dict) -> set[str]:
+    # 所有帳號的圖庫與已發佈資料夾
+    folders = set()
+    for acc in accounts.list_accounts(cfg, include_disabled=True):
+        folders.update(catalog.scan_folders(acc))
+    return folders
+
+
+def _check(path: str, folders: set[str]) -> str | None:
+    if os.path.dirname(path) not in folders:
+        return "不在圖庫資料夾中"
+    if not os.path.isfile(path):
+        return "檔案不存在"
+    if heic.is_heic(path):
+        return "HEIC 檔案無法寫入 metadata"
+    try:
+        if not exif_writer.supported(path):
+            return "不支援的圖片格式"
+    except OSError as e:
+        return f"無法讀取：{e}"
+    return None
+
+
+def validate(cfg: dict, paths: list[str], patch, mode: str) -> list[str]:
+    """回傳去除重複後的路徑；任何一個檔案不合格就丟出 Invalid"""
+    if mode not in MODES:
+        raise ValueError(f"未知的模式：{mode}")
+    if not isinstance(patch, dict):
+        raise ValueError("patch 必須是 JSON 物件")
+    if len(json.dumps(patch, ensure_ascii=False).encode("utf-8")) > exif_writer.MAX_SEGMENT // 2:
+        raise ValueError("metadata 內容過大")
+    paths = list(dict.fromkeys(os.path.normpath(p) for p in paths if p))
+    if not paths:
+        raise ValueError("沒有指定任何圖片")
+    if len(paths) > MAX_FILES:
+        raise ValueError(f"一次最多 {MAX_FILES} 個檔案")
+
+    folders = _library(cfg)
+    results = []
+    for path in paths:
+        error = _check(path, folders)
+        if error:
+            results.append({"path": path, "status": "invalid", "message": error})
+    if results:
+        raise Invalid(f"{len(results)} 個檔案無法寫入，未做任何修改", results)
+    return paths
+
+
+def _write(path: str, update) -> tuple[dict, dict | None, str | None]:
+    try:
+        meta, digest = update_metadata(path, update)
+    except Exception as e:
+        return {"path": path, "status": "error", "message": str(e)}, None, None
+    return {"path": path, "status": "updated" if digest else "unchanged"}, meta, digest
+
+
+def apply(cfg: dict, paths: list[str], patch: dict, mode: str = "merge") -> dict:
+    targets = validate(cfg, paths, patch, mode)
+    if mode == "merge":
+        def update(old):
+            return merge_patch(old, patch)
+    else:
+        def update(old):
+            return patch
+
+    workers = max(1, int(cfg.get("METADATA_WRITE_WORKERS", WRITE_WORKERS)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="metadata") as pool:
+        written = list(pool.map(lambda p: _write(p, update), targets))
+
+    catalog.record_rewrites([(r["path"], meta, digest) for r, meta, digest in written if digest])
+
+    results = [r for r, _, _ in written]
+    summary = {"updated": 0, "unchanged": 0, "error": 0}
+    for r in results:
+        summary[r["status"]] += 1
+    return {"results": results, "summary": summary}
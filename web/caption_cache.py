@@ -0,0 +1,63 @@
+import hashlib
+from datetime import datetime, timedelta
+
+from .database import SessionLocal, CaptionCache
+
+TTL_DAYS = 30
+MAX_ENTRIES = 2000
+
+
+def prompt_hash(*parts: str) -> str:
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+def make_key(content_hash: str, category: str, p_hash: str) -> str:
+    return hashlib.sha256(f"{content_hash}|{category}|{p_hash}".encode("utf-8")).hexdigest()
+
+
+def get(cfg: dict, key: str) -> str | None:
+    ttl = timedelta(days=int(cfg.get("CAPTION_CACHE_TTL_DAYS", TTL_DAYS)))
+    db = SessionLocal()
+    try:
+        entry = db.get(CaptionCache, key)
+        if entry is None:
+            return None
+        if datetime.now() - entry.created_at > ttl:
+            db.delete(entry)
+            db.commit()
+            return None
+        entry.last_used_at = datetime.now()
+        entry.hits = (entry.hits or 0) + 1
+        db.commit()
+        return entry.caption
+    finally:
+        db.close()
+
+
+def put(cfg: dict, key: str, content_hash: str, category: str, p_hash: str, model: str, caption: str):
+    max_entries = int(cfg.get("CAPTION_CACHE_MAX", MAX_ENTRIES))
+    db = SessionLocal()
+    try:
+        entry = db.get(CaptionCache, key) or CaptionCache(key=key)
+        entry.content_hash = content_hash
+        entry.category = category
+        entry.prompt_hash = p_hash
+        entry.model = model
+        entry.caption = caption
+        entry.created_at = entry.last_used_at = datetime.now()
+        db.add(entry)
+        db.commit()
+
+        # 超過上限時淘汰最久未使用的項目
+        overflow = db.query(CaptionCache).count() - max_entries
+        if overflow > 0:
+            stale = (
+                db.query(CaptionCache.key)
+                .order_by(CaptionCache.last_used_at)
+                .limit(overflow)
+                .subquery()
+            )
+            db.query(CaptionCache).filter(CaptionCache.key.in_(stale.select())).delete(synchronize_session=False)
+            db.commit()
+    finally:
+        db.close()
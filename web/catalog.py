@@ -0,0 +1,376 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from . import heic, logstream, thumbnails
+from .database import SessionLocal, ImageCatalog
+from .metadata_handler import read_metadata
+from .phash import dhash_file
+
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png') + (heic.EXTS if heic.available() else ())
+RESCAN_SECONDS = 30
+SCAN_WORKERS = 8
+PUBLISHED = "published"
+NO_DHASH = ""  # 無法計算感知雜湊的檔案；與尚未計算的 NULL 區分，檔案沒變動就不再重算
+
+_last_scan: dict[tuple, float] = {}
+_scanning: set[tuple] = set()
+_scan_lock = threading.Lock()
+# 所有掃描依序執行：不同帳號共用的資料夾（例如已發佈資料夾）同時掃描會重複新增同一路徑
+_scan_mutex = threading.Lock()
+_listeners = []
+
+
+def subscribe(callback):
+    """callback(path, content_hash, dhash) 在索引新增或更新檔案時呼叫；檔案移除時 content_hash 為 None"""
+    _listeners.append(callback)
+
+
+def _notify(changes: list[tuple[str, str | None, str | None]]):
+    for callback in _listeners:
+        for path, digest, dhash in changes:
+            callback(path, digest, dhash)
+
+
+def file_hash(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _folders(cfg: dict) -> dict[str, str]:
+    # folder -> category
+    return {os.path.normpath(folder): category
+            for category, folder in cfg.get("IMAGE_FOLDERS", {}).items() if folder}
+
+
+def category_folders(cfg: dict) -> dict[str, str]:
+    # category -> folder，保留 IMAGE_FOLDERS 的順序
+    return {category: os.path.normpath(folder)
+            for category, folder in cfg.get("IMAGE_FOLDERS", {}).items() if folder}
+
+
+def scan_folders(cfg: dict) -> dict[str, str]:
+    # 已發佈資料夾也建立索引，讓已發文圖庫能直接分頁查詢
+    folders = _folders(cfg)
+    pub = cfg.get("PUBLISHED_FOLDER", "")
+    if pub:
+        folders.setdefault(os.path.normpath(pub), PUBLISHED)
+    return folders
+
+
+def _source(path: str, digest: str | None) -> str | None:
+    # HEIC 改讀轉好的 JPEG；無法解碼時回傳 None
+    try:
+        return heic.readable(path, digest)
+    except Exception:
+        return None
+
+
+def _probe(path: str, digest: str | None = None) -> tuple[dict | None, str, str | None]:
+    digest = digest or file_hash(path)
+    src = _source(path, digest)
+    if src is None:
+        return None, digest, None
+    return read_metadata(src), digest, dhash_file(src)
+
+
+def _dhash(row: ImageCatalog) -> str | None:
+    src = _source(row.path, row.content_hash)
+    return dhash_file(src) if src else None
+
+
+def _fill(row: ImageCatalog, path: str, st: os.stat_result, category: str,
+          probed: tuple[dict | None, str, str | None] | None = None):
+    meta, digest, dhash = probed or _probe(path)
+    row.folder = os.path.dirname(path)
+    row.filename = os.path.basename(path)
+    row.category = category
+    row.size = st.st_size
+    row.mtime = st.st_mtime_ns
+    row.content_hash = digest
+    row.dhash = dhash or NO_DHASH
+    row.metadata_json = json.dumps(meta, ensure_ascii=False) if meta is not None else None
+    row.scanned_at = datetime.now()
+
+
+def _due(cfg: dict, key: tuple) -> bool:
+    interval = int(cfg.get("CATALOG_RESCAN_SECONDS", RESCAN_SECONDS))
+    return time.monotonic() - _last_scan.get(key, float('-inf')) >= interval
+
+
+def scan(cfg: dict, force: bool = False) -> dict:
+    """增量掃描：只重新讀取 (size, mtime) 有變動的檔案；已有掃描在跑時等它結束，不重複掃描"""
+    folders = scan_folders(cfg)
+    key = tuple(sorted(folders.items()))
+    if not force and not _due(cfg, key):
+        return {"skipped": True}
+    with _scan_mutex:
+        if not force and not _due(cfg, key):
+            return {"skipped": True}
+        return _scan(folders, key)
+
+
+def _scan(folders: dict[str, str], key: tuple) -> dict:
+    stats = {"added": 0, "updated": 0, "removed": 0}
+    db = SessionLocal()
+    try:
+        # 只比對本次掃描的資料夾，其他帳號的資料夾不受影響
+        existing = {row.path: row for row in
+                    db.query(ImageCatalog).filter(ImageCatalog.folder.in_(list(folders))).all()}
+        seen = set()
+        pending = []
+        unhashed = []  # 感知雜湊上線前建立的索引，只補算 dhash
+        for folder, category in folders.items():
+            if not os.path.isdir(folder):
+                continue
+            with os.scandir(folder) as it:
+                for entry in it:
+                    if not entry.name.lower().endswith(IMAGE_EXTS) or not entry.is_file():
+                        continue
+                    path = os.path.join(folder, entry.name)
+                    seen.add(path)
+                    st = entry.stat()
+                    row = existing.get(path)
+                    if row is None:
+                        row = ImageCatalog(path=path)
+                        db.add(row)
+                        pending.append((row, path, st, category))
+                        stats["added"] += 1
+                    elif row.size != st.st_size or row.mtime != st.st_mtime_ns:
+                        pending.append((row, path, st, category))
+                        stats["updated"] += 1
+                    else:
+                        if row.category != category:
+                            row.category = category
+                        if row.dhash is None:
+                            unhashed.append(row)
+
+        if pending:
+            # HEIC 先在 process pool 中批次轉檔，之後的讀取都命中快取
+            digests = heic.convert_many([p[1] for p in pending if heic.is_heic(p[1])])
+            with ThreadPoolExecutor(max_workers=SCAN_WORKERS) as pool:
+                probed = pool.map(lambda p: _probe(p, digests.get(p)), [p[1] for p in pending])
+                for (row, path, st, category), result in zip(pending, probed):
+                    _fill(row, path, st, category, result)
+            thumbnails.pregenerate([p[1] for p in pending])
+        if unhashed:
+            with ThreadPoolExecutor(max_workers=SCAN_WORKERS) as pool:
+                for row, dhash in zip(unhashed, pool.map(_dhash, unhashed)):
+                    row.dhash = dhash or NO_DHASH
+
+        changes = [(row.path, row.content_hash, row.dhash) for row in [p[0] for p in pending] + unhashed]
+        for path, row in existing.items():
+            if path not in seen:
+                db.delete(row)
+                changes.append((path, None, None))
+                stats["removed"] += 1
+        db.commit()
+    finally:
+        db.close()
+    _notify(changes)
+
+    _last_scan[key] = time.monotonic()
+    return stats
+
+
+def scan_in_background(cfg: dict) -> bool:
+    """到了重新掃描的時間就在背景執行緒掃描，不等待結果；同一組資料夾同時只會有一個掃描"""
+    key = tuple(sorted(scan_folders(cfg).items()))
+    if not _due(cfg, key):
+        return False
+    with _scan_lock:
+        if key in _scanning:
+            return False
+        _scanning.add(key)
+
+    def run():
+        try:
+            scan(cfg)
+        except Exception as e:
+            logstream.log(f"⚠️ 圖庫掃描失敗：{e}")
+        finally:
+            with _scan_lock:
+                _scanning.discard(key)
+
+    threading.Thread(target=run, name="catalog-scan", daemon=True).start()
+    return True
+
+
+def refresh_path(path: str, category: str, probed: tuple[dict | None, str, str | None] | None = None):
+    """單一檔案變動後（上傳、修改 metadata）立即更新索引；呼叫端已讀過檔案時可直接帶入 probed"""
+    path = os.path.normpath(path)
+    db = SessionLocal()
+    try:
+        row = db.get(ImageCatalog, path)
+        if not os.path.isfile(path):
+            if row:
+                db.delete(row)
+                db.commit()
+            _notify([(path, None, None)])
+            return
+        if row is None:
+            row = ImageCatalog(path=path)
+            db.add(row)
+        _fill(row, path, os.stat(path), category, probed)
+        db.commit()
+        _notify([(path, row.content_hash, row.dhash)])
+        thumbnails.pregenerate([path])
+    finally:
+        db.close()
+
+
+def record_rewrites(changes: list[tuple[str, dict | None, str]]):
+    """只改寫 EXIF 的檔案（path, metadata, 新雜湊）：像素沒變，沿用原本的感知雜湊，一次交易更新
+
+    不在索引中的檔案略過，下次掃描時才會收錄。
+    """
+    db = SessionLocal()
+    notify = []
+    try:
+        paths = [os.path.normpath(path) for path, _, _ in changes]
+        rows = {}
+        for i in range(0, len(paths), 500):
+            rows.update((row.path, row) for row in
+                        db.query(ImageCatalog).filter(ImageCatalog.path.in_(paths[i:i + 500])))
+        for path, (_, meta, digest) in zip(paths, changes):
+            row = rows.get(path)
+            if row is None:
+                continue
+            st = os.stat(path)
+            row.size = st.st_size
+            row.mtime = st.st_mtime_ns
+            row.content_hash = digest
+            row.metadata_json = json.dumps(meta, ensure_ascii=False) if meta is not None else None
+            row.scanned_at = datetime.now()
+            notify.append((path, digest, row.dhash))
+        db.commit()
+    finally:
+        db.close()
+    _notify(notify)
+
+
+def remove_path(path: str):
+    path = os.path.normpath(path)
+    db = SessionLocal()
+    try:
+        row = db.get(ImageCatalog, path)
+        if row:
+            db.delete(row)
+            db.commit()
+    finally:
+        db.close()
+    _notify([(path, None, None)])
+
+
+def relocate(src: str, dest: str, category: str):
+    """檔案搬移後沿用原本的雜湊與 metadata，不必重新讀取整個檔案"""
+    src, dest = os.path.normpath(src), os.path.normpath(dest)
+    db = SessionLocal()
+    try:
+        old = db.get(ImageCatalog, src)
+        row = db.get(ImageCatalog, dest)
+        if old is None or not os.path.isfile(dest):
+            if old:
+                db.delete(old)
+            db.commit()
+            _notify([(src, None, None)])
+            if os.path.isfile(dest):
+                refresh_path(dest, category)
+            return
+        if row is None:
+            row = ImageCatalog(path=dest)
+            db.add(row)
+        st = os.stat(dest)
+        row.folder = os.path.dirname(dest)
+        row.filename = os.path.basename(dest)
+        row.category = category
+        row.size = st.st_size
+        row.mtime = st.st_mtime_ns
+        row.content_hash = old.content_hash
+        row.dhash = old.dhash
+        row.metadata_json = old.metadata_json
+        row.scanned_at = datetime.now()
+        db.delete(old)
+        db.commit()
+        _notify([(src, None, None), (dest, row.content_hash, row.dhash)])
+    finally:
+        db.close()
+
+
+def content_hash(path: str) -> str:
+    """優先使用索引中的雜湊；檔案有變動（或不在索引中）時才重新計算"""
+    path = os.path.normpath(path)
+    st = os.stat(path)
+    db = SessionLocal()
+    try:
+        row = db.get(ImageCatalog, path)
+        if row and row.content_hash and row.size == st.st_size and row.mtime == st.st_mtime_ns:
+            return row.content_hash
+    finally:
+        db.close()
+    return file_hash(path)
+
+
+def category_of(cfg: dict, path: str) -> str | None:
+    return _folders(cfg).get(os.path.dirname(os.path.normpath(path)))
+
+
+def _to_dict(row: ImageCatalog, category: str) -> dict:
+    meta = json.loads(row.metadata_json) if row.metadata_json else None
+    return {
+        "path": row.path,
+        "filename": row.filename,
+        "category": category,
+        "has_metadata": meta is not None,
+        "metadata": meta or {},
+        "mtime": row.mtime,
+    }
+
+
+def list_images(cfg: dict) -> list[dict]:
+    scan(cfg)
+    result = []
+    db = SessionLocal()
+    try:
+        for folder, category in _folders(cfg).items():
+            rows = (
+                db.query(ImageCatalog)
+                .filter(ImageCatalog.folder == folder)
+                .order_by(ImageCatalog.filename)
+                .all()
+            )
+            result.extend(_to_dict(row, category) for row in rows)
+    finally:
+        db.close()
+    return result
+
+
+def list_published(cfg: dict, cursor: str | None = None, limit: int = 30) -> tuple[list[ImageCatalog], str | None]:
+    """依檔名倒序分頁；cursor 為上一頁最後一個檔名
+
+    直接讀索引：封存時已由 relocate 更新，其他外部變動交給背景掃描，翻頁不會等整個資料夾掃完。
+    """
+    pub = cfg.get("PUBLISHED_FOLDER", "")
+    if not pub:
+        return [], None
+    scan_in_background(cfg)
+    db = SessionLocal()
+    try:
+        q = db.query(ImageCatalog).filter(ImageCatalog.folder == os.path.normpath(pub))
+        if cursor:
+            q = q.filter(ImageCatalog.filename < cursor)
+        rows = q.order_by(ImageCatalog.filename.desc()).limit(limit + 1).all()
+        for row in rows:
+            db.expunge(row)
+    finally:
+        db.close()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return rows, (rows[-1].filename if has_more else None)
@@ -0,0 +1,87 @@
+import asyncio
+import os
+import time
+
+import httpx
+import openai
+from cloudinary.utils import api_sign_request
+
+CLOUDINARY_API = "https://api.cloudinary.com/v1_1"
+
+# 每個外部呼叫各自的逾時設定（秒）
+CLOUDINARY_TIMEOUT = httpx.Timeout(120.0, connect=10.0)
+OPENAI_TIMEOUT = httpx.Timeout(90.0, connect=10.0)
+GRAPH_TIMEOUT = httpx.Timeout(30.0, connect=10.0)
+
+_http: httpx.AsyncClient | None = None
+_openai: dict[str, openai.AsyncOpenAI] = {}
+
+
+def http() -> httpx.AsyncClient:
+    """全程共用的連線池，避免每次發文都重新握手"""
+    global _http
+    if _http is None or _http.is_closed:
+        _http = httpx.AsyncClient(
+            timeout=GRAPH_TIMEOUT,
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+        )
+    return _http
+
+
+def openai_client(api_key: str) -> openai.AsyncOpenAI:
+    client = _openai.get(api_key)
+    if client is None:
+        client = openai.AsyncOpenAI(api_key=api_key, http_client=http(), timeout=OPENAI_TIMEOUT)
+        _openai[api_key] = client
+    return client
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+async def cloudinary_upload(cfg: dict, path: str) -> dict:
+    params = {"timestamp": int(time.time())}
+    signature = api_sign_request(params, cfg["CLOUDINARY_API_SECRET"])
+    content = await asyncio.to_thread(_read_file, path)
+    r = await http().post(
+        f"{CLOUDINARY_API}/{cfg['CLOUDINARY_CLOUD_NAME']}/image/upload",
+        data={**params, "api_key": cfg["CLOUDINARY_API_KEY"], "signature": signature},
+        files={"file": (os.path.basename(path), content)},
+        timeout=CLOUDINARY_TIMEOUT,
+    )
+    body = r.json()
+    if "error" in body or "secure_url" not in body:
+        raise RuntimeError(f"Cloudinary 上傳失敗：{body.get('error', body)}")
+    return body
+
+
+async def cloudinary_delete(cfg: dict, public_ids: list[str]) -> dict:
+    """Admin API 批次刪除（每次最多 100 筆）"""
+    r = await http().delete(
+        f"{CLOUDINARY_API}/{cfg['CLOUDINARY_CLOUD_NAME']}/resources/image/upload",
+        params=[("public_ids[]", pid) for pid in public_ids],
+        auth=(cfg["CLOUDINARY_API_KEY"], cfg["CLOUDINARY_API_SECRET"]),
+        timeout=CLOUDINARY_TIMEOUT,
+    )
+    body = r.json()
+    if "error" in body:
+        raise RuntimeError(f"Cloudinary 刪除失敗：{body['error']}")
+    return body.get("deleted", {})
+
+
+async def url_exists(url: str) -> bool:
+    try:
+        r = await http().head(url, timeout=GRAPH_TIMEOUT, follow_redirects=True)
+    except httpx.HTTPError:
+        return False
+    return r.status_code == 200
+
+
+async def aclose():
+    global _http
+    _openai.clear()
+    if _http is not None:
+        await _http.aclose()
+        _http = None
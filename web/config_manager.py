@@ -1,16 +1,140 @@
+from __future__ import annotations
+
+import copy
 import json
 import os
+import tempfile
+import threading
 
 CONFIG_PATH = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', 'config.json'))
 EXAMPLE_PATH = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', 'config.json.example'))
+WATCH_INTERVAL = 1.0
+
+
+class ConfigFile:
+    """設定檔快取：只在檔案 (mtime, size) 變動時才重新解析
+
+    背景執行緒監看檔案，外部修改（手動編輯、其他程序寫入）時通知訂閱者；
+    save() 以暫存檔 + os.replace 原子性寫入，同樣會通知訂閱者。
+    """
+
+    def __init__(self, path: str, fallback: str | None = None):
+        self.path = path
+        self.fallback = fallback
+        self._lock = threading.RLock()
+        self._data: dict | None = None
+        self._stamp = None
+        self._subscribers = []
+        self._stop = threading.Event()
+        self._watcher: threading.Thread | None = None
+
+    def _source(self) -> str:
+        if self.fallback and not os.path.exists(self.path):
+            return self.fallback
+        return self.path
+
+    def _current_stamp(self):
+        src = self._source()
+        st = os.stat(src)
+        return src, st.st_mtime_ns, st.st_size
+
+    def _reload(self) -> tuple[dict | None, dict | None]:
+        """檔案有變動就重新讀取；回傳 (舊設定, 新設定)，沒變動時新設定為 None"""
+        with self._lock:
+            stamp = self._current_stamp()
+            if stamp == self._stamp and self._data is not None:
+                return self._data, None
+            with open(stamp[0], 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            old, self._data, self._stamp = self._data, data, stamp
+            return old, data
+
+    def load(self) -> dict:
+        with self._lock:
+            if self._data is None or not self.watching:
+                self._reload()
+            return copy.deepcopy(self._data)
+
+    def save(self, config: dict):
+        folder, name = os.path.split(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(prefix=f".{name}.", suffix=".tmp", dir=folder)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(config, f, ensure_ascii=False, indent=4)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        with self._lock:
+            old = self._data
+            self._data = copy.deepcopy(config)
+            self._stamp = self._current_stamp()
+        self._notify(old, config)
+
+    def subscribe(self, callback):
+        """callback(new, old) 會在設定變動後被呼叫（可能在監看執行緒中）"""
+        self._subscribers.append(callback)
+
+    def _notify(self, old: dict | None, new: dict):
+        if old == new:
+            return
+        for callback in list(self._subscribers):
+            try:
+                callback(copy.deepcopy(new), copy.deepcopy(old) if old is not None else {})
+            except Exception as e:
+                print(f"⚠️ 設定變更通知失敗：{e}")
+
+    @property
+    def watching(self) -> bool:
+        return self._watcher is not None and self._watcher.is_alive()
+
+    def _watch(self, interval: float):
+        while not self._stop.wait(interval):
+            try:
+                old, new = self._reload()
+            except (OSError, ValueError):
+                # 檔案正在被外部改寫或暫時格式錯誤，保留舊設定
+                continue
+            if new is not None:
+                self._notify(old, new)
+
+    def start_watcher(self, interval: float = WATCH_INTERVAL):
+        if self.watching:
+            return
+        self._reload()
+        self._stop.clear()
+        self._watcher = threading.Thread(target=self._watch, args=(interval,),
+                                         name="config-watcher", daemon=True)
+        self._watcher.start()
+
+    def stop_watcher(self):
+        self._stop.set()
+        if self._watcher is not None:
+            self._watcher.join(timeout=2)
+            self._watcher = None
+
+
+_config = ConfigFile(CONFIG_PATH, EXAMPLE_PATH)
 
 
 def load_config() -> dict:
-    path = CONFIG_PATH if os.path.exists(CONFIG_PATH) else EXAMPLE_PATH
-    with open(path, 'r', encoding='utf-8') as f:
-        return json.load(f)
+    return _config.load()
 
 
 def save_config(config: dict):
-    with open(CONFIG_PATH, 'w', encoding='utf-8') as f:
-        json.dump(config, f, ensure_ascii=False, indent=4)
+    _config.save(config)
+
+
+def subscribe(callback):
+    _config.subscribe(callback)
+
+
+def start_watcher(interval: float = WATCH_INTERVAL):
+    _config.start_watcher(interval)
+
+
+def stop_watcher():
+    _config.stop_watcher()
@@ -1,4 +1,5 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Text
+from sqlalchemy import create_engine, inspect, text, BigInteger, Column, Index, Integer, String, DateTime, Text
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import declarative_base, sessionmaker
 from datetime import datetime
 import os
@@ -13,15 +14,249 @@ class PostHistory(Base):
     __tablename__ = 'post_history'
 
     id = Column(Integer, primary_key=True)
+    account_id = Column(String(100), default='default')
     created_at = Column(DateTime, default=datetime.now)
-    image_filename = Column(String(500), default='')
+    image_filename = Column(String(500), default='', index=True)
     category = Column(String(100), default='')
     image_url = Column(String(1000), default='')
     caption = Column(Text, default='')
     instagram_post_id = Column(String(200), default='')
-    status = Column(String(50))
+    status = Column(String(50))  # pending / success / failed
+    error_message = Column(Text, nullable=True)
+    # 分階段流程：selected → uploaded → captioned → container_created → published → archived
+    stage = Column(String(50), nullable=True)
+    post_type = Column(String(20), default='feed')
+    image_path = Column(String(1000), default='')
+    content_hash = Column(String(64), default='')
+    container_id = Column(String(200), default='')
+    prepared_id = Column(Integer, nullable=True)
+    attempts = Column(Integer, default=0)
+    next_attempt_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+    __table_args__ = (
+        Index('ix_post_history_status_created', 'status', 'created_at'),
+        Index('ix_post_history_created_id', 'created_at', 'id'),
+        Index('ix_post_history_account_status_created', 'account_id', 'status', 'created_at'),
+    )
+
+
+class PostStats(Base):
+    """各狀態的貼文數，由 post_history 上的 trigger 即時維護"""
+    __tablename__ = 'post_stats'
+
+    status = Column(String(50), primary_key=True)
+    count = Column(Integer, default=0, nullable=False)
+
+
+POST_STATS_TRIGGERS = {
+    "post_stats_insert": """
+        CREATE TRIGGER post_stats_insert AFTER INSERT ON post_history BEGIN
+            INSERT INTO post_stats (status, count) VALUES (COALESCE(NEW.status, ''), 1)
+            ON CONFLICT(status) DO UPDATE SET count = count + 1;
+        END""",
+    "post_stats_delete": """
+        CREATE TRIGGER post_stats_delete AFTER DELETE ON post_history BEGIN
+            UPDATE post_stats SET count = count - 1 WHERE status = COALESCE(OLD.status, '');
+        END""",
+    "post_stats_update": """
+        CREATE TRIGGER post_stats_update AFTER UPDATE OF status ON post_history
+        WHEN OLD.status IS NOT NEW.status BEGIN
+            UPDATE post_stats SET count = count - 1 WHERE status = COALESCE(OLD.status, '');
+            INSERT INTO post_stats (status, count) VALUES (COALESCE(NEW.status, ''), 1)
+            ON CONFLICT(status) DO UPDATE SET count = count + 1;
+        END""",
+}
+
+
+CAPTION_FTS_TRIGGERS = {
+    "post_history_fts_insert": """
+        CREATE TRIGGER post_history_fts_insert AFTER INSERT ON post_history BEGIN
+            INSERT INTO post_history_fts (rowid, caption) VALUES (NEW.id, NEW.caption);
+        END""",
+    "post_history_fts_delete": """
+        CREATE TRIGGER post_history_fts_delete AFTER DELETE ON post_history BEGIN
+            INSERT INTO post_history_fts (post_history_fts, rowid, caption) VALUES ('delete', OLD.id, OLD.caption);
+        END""",
+    "post_history_fts_update": """
+        CREATE TRIGGER post_history_fts_update AFTER UPDATE OF caption ON post_history BEGIN
+            INSERT INTO post_history_fts (post_history_fts, rowid, caption) VALUES ('delete', OLD.id, OLD.caption);
+            INSERT INTO post_history_fts (rowid, caption) VALUES (NEW.id, NEW.caption);
+        END""",
+}
+
+
+class ImageCatalog(Base):
+    __tablename__ = 'image_catalog'
+
+    path = Column(String(1000), primary_key=True)
+    folder = Column(String(1000), index=True)
+    filename = Column(String(500), default='')
+    category = Column(String(100), default='')
+    size = Column(BigInteger, default=0)
+    mtime = Column(BigInteger, default=0)  # st_mtime_ns
+    content_hash = Column(String(64), index=True)
+    dhash = Column(String(16), nullable=True)  # 感知雜湊，用於找近似重複的圖片
+    metadata_json = Column(Text, nullable=True)
+    scanned_at = Column(DateTime, default=datetime.now)
+
+    __table_args__ = (
+        Index('ix_image_catalog_folder_filename', 'folder', 'filename'),
+    )
+
+
+class PreparedPost(Base):
+    __tablename__ = 'prepared_posts'
+
+    id = Column(Integer, primary_key=True)
+    account_id = Column(String(100), default='default', index=True)
+    created_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+    image_path = Column(String(1000), default='')
+    image_filename = Column(String(500), default='')
+    category = Column(String(100), default='')
+    image_url = Column(String(1000), default='')
+    caption = Column(Text, default='')
+    status = Column(String(50), default='ready', index=True)  # preparing / ready / publishing / published / discarded
+    attempts = Column(Integer, default=0)
     error_message = Column(Text, nullable=True)
 
 
+class CaptionCache(Base):
+    __tablename__ = 'caption_cache'
+
+    key = Column(String(64), primary_key=True)
+    content_hash = Column(String(64), index=True)
+    category = Column(String(100), default='')
+    prompt_hash = Column(String(64), default='')
+    model = Column(String(100), default='')
+    caption = Column(Text, default='')
+    created_at = Column(DateTime, default=datetime.now)
+    last_used_at = Column(DateTime, default=datetime.now, index=True)
+    hits = Column(Integer, default=0)
+
+
+class UploadedAsset(Base):
+    __tablename__ = 'uploaded_assets'
+
+    content_hash = Column(String(64), primary_key=True)
+    secure_url = Column(String(1000), default='', index=True)
+    public_id = Column(String(500), default='')
+    bytes = Column(BigInteger, default=0)
+    status = Column(String(50), default='active', index=True)  # active / published / deleted
+    created_at = Column(DateTime, default=datetime.now)
+    verified_at = Column(DateTime, default=datetime.now)
+    published_at = Column(DateTime, nullable=True)
+
+
+class Job(Base):
+    """發文任務佇列：worker 以租約（lease）取得任務，執行中定期延長，程序當掉時租約到期後由其他 worker 接手"""
+    __tablename__ = 'jobs'
+
+    id = Column(Integer, primary_key=True)
+    kind = Column(String(50))  # post / resume
+    account_id = Column(String(100), default='default')
+    payload = Column(Text, default='{}')
+    source = Column(String(50), default='')  # schedule / manual / post_now / resume
+    status = Column(String(50), default='queued')  # queued / running / done / dead
+    attempts = Column(Integer, default=0)
+    max_attempts = Column(Integer, default=3)
+    run_at = Column(DateTime, default=datetime.now)
+    lease_owner = Column(String(200), nullable=True)
+    lease_until = Column(DateTime, nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+    finished_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index('ix_jobs_status_run_at', 'status', 'run_at'),
+        Index('ix_jobs_account_status', 'account_id', 'status'),
+    )
+
+
+def _add_missing_columns(conn):
+    """舊版資料庫缺少的欄位以 ALTER TABLE 補上（SQLite 只支援新增欄位）"""
+    insp = inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        existing = {c["name"] for c in insp.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                coltype = column.type.compile(dialect=conn.dialect)
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {coltype}"))
+
+
+def _add_missing_indexes(conn):
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+
+def _install_stats_triggers(conn):
+    existing = {r[0] for r in conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'trigger'"))}
+    missing = [name for name in POST_STATS_TRIGGERS if name not in existing]
+    if not missing:
+        return
+    # 與建立 trigger 在同一個交易中重新統計，之後的異動都由 trigger 累加
+    for name in existing & set(POST_STATS_TRIGGERS):
+        conn.execute(text(f"DROP TRIGGER {name}"))
+    conn.execute(text("DELETE FROM post_stats"))
+    conn.execute(text(
+        "INSERT INTO post_stats (status, count) "
+        "SELECT COALESCE(status, ''), COUNT(*) FROM post_history GROUP BY COALESCE(status, '')"
+    ))
+    for ddl in POST_STATS_TRIGGERS.values():
+        conn.execute(text(ddl))
+
+
+def _drop_caption_fts(conn):
+    for name in CAPTION_FTS_TRIGGERS:
+        conn.execute(text(f"DROP TRIGGER IF EXISTS {name}"))
+    conn.execute(text("DROP TABLE IF EXISTS post_history_fts"))
+
+
+def _install_caption_fts(conn):
+    """文案全文檢索（FTS5 external content）；trigram 斷詞讓中文也能做子字串搜尋
+
+    沒有 trigram 斷詞器（SQLite < 3.34 或未編譯 FTS5）時不建立索引，搜尋改用 LIKE；
+    unicode61 會把整段中文當成一個詞，子字串搜尋找不到結果，因此不拿來替代。
+    """
+    row = conn.execute(text(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'post_history_fts'")).first()
+    if row and "trigram" in (row[0] or ""):
+        return
+    if row:  # 舊版以 unicode61 建立的索引
+        _drop_caption_fts(conn)
+    try:
+        conn.execute(text(
+            "CREATE VIRTUAL TABLE post_history_fts USING fts5("
+            "caption, content='post_history', content_rowid='id', tokenize='trigram')"
+        ))
+    except OperationalError:
+        return
+    for ddl in CAPTION_FTS_TRIGGERS.values():
+        conn.execute(text(ddl))
+    conn.execute(text("INSERT INTO post_history_fts (post_history_fts) VALUES ('rebuild')"))
+
+
+def _migrate(conn):
+    _add_missing_columns(conn)
+    _add_missing_indexes(conn)
+    _install_stats_triggers(conn)
+    _install_caption_fts(conn)
+    # 多帳號上線前的紀錄都屬於 default 帳號
+    for table in ("post_history", "prepared_posts"):
+        conn.execute(text(f"UPDATE {table} SET account_id = 'default' WHERE account_id IS NULL"))
+    # 分階段流程上線前的紀錄視為已結束
+    conn.execute(text("UPDATE post_history SET stage = 'archived' WHERE stage IS NULL AND status = 'success'"))
+
+
+def post_counts(db) -> dict[str, int]:
+    return {status: count for status, count in db.query(PostStats.status, PostStats.count).all()}
+
+
 def init_db():
     Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        _migrate(conn)
@@ -0,0 +1,153 @@
+"""只讀取檔頭的 EXIF ImageDescription 解析器
+
+不解碼影像、不依賴 PIL / piexif：只走訪 JPEG marker（或 PNG / WebP chunk）
+找到 EXIF 區塊，再解析 0th IFD 裡的 ImageDescription。一般情況下只會讀取檔案前 4 KB，
+描述內容落在更後面時才會再 seek 讀取那一小段。
+"""
+from __future__ import annotations
+
+import json
+import struct
+
+HEAD_SIZE = 4096
+IMAGE_DESCRIPTION = 0x010E
+MAX_JPEG_SEGMENTS = 32
+
+
+class UnsupportedFormat(Exception):
+    pass
+
+
+class _Window:
+    """檔案前 HEAD_SIZE bytes 常駐記憶體，超出範圍才 seek"""
+
+    def __init__(self, f):
+        self.f = f
+        self.head = f.read(HEAD_SIZE)
+
+    def read(self, offset: int, size: int) -> bytes:
+        end = offset + size
+        if end <= len(self.head):
+            return self.head[offset:end]
+        self.f.seek(offset)
+        data = self.f.read(size)
+        if len(data) != size:
+            raise ValueError("unexpected end of file")
+        return data
+
+
+def _find_tiff_jpeg(w: _Window) -> int | None:
+    pos = 2
+    for _ in range(MAX_JPEG_SEGMENTS):
+        marker = w.read(pos, 2)
+        if marker[0] != 0xFF:
+            return None
+        code = marker[1]
+        if code == 0xFF:  # fill byte
+            pos += 1
+            continue
+        if code in (0xD8, 0x01) or 0xD0 <= code <= 0xD7:
+            pos += 2
+            continue
+        if code in (0xDA, 0xD9):  # SOS / EOI：之後不會再有 APP1
+            return None
+        (length,) = struct.unpack(">H", w.read(pos + 2, 2))
+        if code == 0xE1 and length >= 16 and w.read(pos + 4, 6) == b"Exif\x00\x00":
+            return pos + 10
+        pos += 2 + length
+    return None
+
+
+def _find_tiff_png(w: _Window) -> int | None:
+    pos = 8
+    while True:
+        length, ctype = struct.unpack(">I4s", w.read(pos, 8))
+        if ctype == b"eXIf":
+            return pos + 8
+        if ctype in (b"IDAT", b"IEND"):
+            return None
+        pos += 12 + length
+
+
+def _find_tiff_webp(w: _Window) -> int | None:
+    (riff_size,) = struct.unpack("<I", w.read(4, 4))
+    pos, end = 12, 8 + riff_size
+    while pos + 8 <= end:
+        ctype, length = struct.unpack("<4sI", w.read(pos, 8))
+        if ctype == b"EXIF":
+            if w.read(pos + 8, 6) == b"Exif\x00\x00":
+                return pos + 14
+            return pos + 8
+        pos += 8 + length + (length & 1)
+    return None
+
+
+def _find_tiff(w: _Window) -> int | None:
+    head = w.head
+    if head[:2] == b"\xff\xd8":
+        return _find_tiff_jpeg(w)
+    if head[:8] == b"\x89PNG\r\n\x1a\n":
+        return _find_tiff_png(w)
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return _find_tiff_webp(w)
+    raise UnsupportedFormat
+
+
+def _read_description(w: _Window, base: int) -> bytes | None:
+    order = w.read(base, 2)
+    if order == b"II":
+        e = "<"
+    elif order == b"MM":
+        e = ">"
+    else:
+        return None
+    magic, ifd0 = struct.unpack(e + "HI", w.read(base + 2, 6))
+    if magic != 42:
+        return None
+    (count,) = struct.unpack(e + "H", w.read(base + ifd0, 2))
+    entries = w.read(base + ifd0 + 2, 12 * count)
+    for i in range(count):
+        tag, typ, n = struct.unpack_from(e + "HHI", entries, 12 * i)
+        if tag != IMAGE_DESCRIPTION:
+            continue
+        if typ not in (1, 2, 7):  # BYTE / ASCII / UNDEFINED
+            return None
+        if n <= 4:
+            raw = entries[12 * i + 8:12 * i + 8 + n]
+        else:
+            (offset,) = struct.unpack_from(e + "I", entries, 12 * i + 8)
+            raw = w.read(base + offset, n)
+        return raw.rstrip(b"\x00")
+    return None
+
+
+def read_description(filepath: str) -> bytes | None:
+    """回傳 0th IFD 的 ImageDescription 原始 bytes；沒有 EXIF 時回傳 None
+
+    無法辨識的格式（例如 HEIC）會丟出 UnsupportedFormat，由呼叫端決定是否改走 PIL。
+    """
+    with open(filepath, "rb") as f:
+        w = _Window(f)
+        try:
+            base = _find_tiff(w)
+            if base is None:
+                return None
+            return _read_description(w, base)
+        except (struct.error, ValueError, IndexError):
+            return None
+
+
+def read_json(filepath: str, fallback=None) -> dict | None:
+    """解析 ImageDescription 中的 JSON；格式不支援時交給 fallback（若有）處理"""
+    try:
+        raw = read_description(filepath)
+    except UnsupportedFormat:
+        return fallback(filepath) if fallback else None
+    except OSError:
+        return None
+    if not raw:
+        return None
+    try:
+        return json.loads(raw.decode("utf-8"))
+    except (UnicodeDecodeError, ValueError):
+        return None
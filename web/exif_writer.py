@@ -0,0 +1,153 @@
+"""無損替換 EXIF：只改寫 APP1（PNG 為 eXIf chunk），其餘位元組原封不動串流複製
+
+寫入暫存檔後以 os.replace 原子性地覆蓋原檔，中途失敗不會留下半個檔案。
+寫入時同步計算新檔案的 SHA-256，呼叫端不必再重讀一次檔案。
+"""
+import hashlib
+import io
+import os
+import shutil
+import struct
+import tempfile
+import zlib
+
+import piexif
+
+EXIF_HEADER = b"Exif\x00\x00"
+MAX_SEGMENT = 0xFFFF - 2
+COPY_CHUNK = 1 << 20
+
+
+def _read_exact(f, size: int) -> bytes:
+    data = f.read(size)
+    if len(data) != size:
+        raise ValueError("檔案結構不完整")
+    return data
+
+
+def _splice_jpeg(src, dst, build):
+    if _read_exact(src, 2) != b"\xff\xd8":
+        raise ValueError("不是 JPEG 檔案")
+    app0, segments, old_exif = None, [], None
+    while True:
+        marker = _read_exact(src, 2)
+        if marker[0] != 0xFF:
+            raise ValueError("JPEG marker 損毀")
+        if marker[1] == 0xFF:  # fill byte
+            src.seek(-1, os.SEEK_CUR)
+            continue
+        if marker[1] in (0xDA, 0xD9):  # SOS / EOI 之後是影像資料，直接串流
+            src.seek(-2, os.SEEK_CUR)
+            break
+        if 0xD0 <= marker[1] <= 0xD7 or marker[1] == 0x01:
+            segments.append(marker)
+            continue
+        length_bytes = _read_exact(src, 2)
+        (length,) = struct.unpack(">H", length_bytes)
+        payload = _read_exact(src, length - 2)
+        if marker[1] == 0xE1 and payload.startswith(EXIF_HEADER):
+            old_exif = payload
+            continue
+        segment = marker + length_bytes + payload
+        if marker[1] == 0xE0 and app0 is None and not segments:
+            app0 = segment
+        else:
+            segments.append(segment)
+
+    exif = build(old_exif)
+    if len(exif) > MAX_SEGMENT:
+        raise ValueError("EXIF 資料超過 64KB")
+    dst.write(b"\xff\xd8")
+    if app0:
+        dst.write(app0)
+    dst.write(b"\xff\xe1" + struct.pack(">H", len(exif) + 2) + exif)
+    for segment in segments:
+        dst.write(segment)
+    shutil.copyfileobj(src, dst, COPY_CHUNK)
+
+
+def _png_chunk(ctype: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + ctype + data + struct.pack(">I", zlib.crc32(ctype + data))
+
+
+def _splice_png(src, dst, build):
+    signature = _read_exact(src, 8)
+    chunks, old_exif = [], None
+    while True:
+        header = _read_exact(src, 8)
+        length, ctype = struct.unpack(">I4s", header)
+        if ctype in (b"IDAT", b"IEND"):
+            src.seek(-8, os.SEEK_CUR)
+            break
+        body = _read_exact(src, length + 4)
+        if ctype == b"eXIf":
+            old_exif = EXIF_HEADER + body[:-4]
+            continue
+        chunks.append(header + body)
+
+    exif = build(old_exif)
+    dst.write(signature)
+    for chunk in chunks:
+        dst.write(chunk)
+    dst.write(_png_chunk(b"eXIf", exif[len(EXIF_HEADER):]))
+    shutil.copyfileobj(src, dst, COPY_CHUNK)
+
+
+def _splice_webp(src, dst, build):
+    # WebP 的 EXIF 位於 RIFF 尾端且需同步 VP8X 旗標，交給 piexif 處理（不解碼影像）
+    # piexif.load 可直接解析整個 WebP 檔案，因此把原始 bytes 當作舊 EXIF 傳入
+    data = src.read()
+    buf = io.BytesIO()
+    piexif.insert(build(data), data, buf)
+    dst.write(buf.getvalue())
+
+
+class _HashingWriter:
+    def __init__(self, f):
+        self.f = f
+        self.sha = hashlib.sha256()
+
+    def write(self, data) -> int:
+        self.sha.update(data)
+        return self.f.write(data)
+
+
+def _splicer(head: bytes):
+    if head[:2] == b"\xff\xd8":
+        return _splice_jpeg
+    if head[:8] == b"\x89PNG\r\n\x1a\n":
+        return _splice_png
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return _splice_webp
+    return None
+
+
+def supported(filepath: str) -> bool:
+    """依檔頭判斷是否能無損替換 EXIF"""
+    with open(filepath, "rb") as f:
+        return _splicer(f.read(12)) is not None
+
+
+def replace_exif(filepath: str, build) -> str:
+    """以 build(舊 EXIF bytes 或 None) 的回傳值取代檔案中的 EXIF，回傳新檔案的 SHA-256"""
+    with open(filepath, "rb") as src:
+        splice = _splicer(src.read(12))
+        src.seek(0)
+        if splice is None:
+            raise ValueError("不支援的圖片格式")
+
+        folder, name = os.path.split(os.path.abspath(filepath))
+        fd, tmp_path = tempfile.mkstemp(prefix=f".{name}.", suffix=".tmp", dir=folder)
+        try:
+            with os.fdopen(fd, "wb") as dst:
+                writer = _HashingWriter(dst)
+                splice(src, writer, build)
+                dst.flush()
+                os.fsync(dst.fileno())
+            shutil.copymode(filepath, tmp_path)
+            os.replace(tmp_path, filepath)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+    return writer.sha.hexdigest()
@@ -0,0 +1,184 @@
+"""Instagram Graph API 呼叫層：每個帳號一個 token bucket，並依回應的用量標頭自動放慢或暫停
+
+- X-App-Usage / X-Business-Use-Case-Usage 回報的用量（百分比）超過 SLOWDOWN_AT 時拉長呼叫間隔，
+  達到上限或被 Graph API 限流時暫停該帳號，直到 estimated_time_to_regain_access 之後。
+- 需要等待的時間不長時會排隊等候；太久則丟出 RateLimited，由發文流程排定稍後重試。
+- GRAPH_API_BASE 可改成本機的 stub server 以便測試。
+"""
+import asyncio
+import json
+import time
+from datetime import datetime, timedelta
+
+from . import clients
+
+DEFAULT_BASE = "https://graph.facebook.com/v18.0"
+CALLS_PER_HOUR = 200
+BURST = 10
+SLOWDOWN_AT = 80
+MAX_SPACING_SECONDS = 60
+MAX_QUEUE_SECONDS = 60
+BLOCK_SECONDS = 300
+PUBLISH_LIMIT = 25
+# 4: app 限流、17: 使用者限流、32: 頁面限流、613: 呼叫次數過多、80002: Instagram 限流
+RATE_LIMIT_CODES = {4, 17, 32, 613, 80002}
+
+
+class RateLimited(Exception):
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    def __init__(self, capacity: int, per_hour: int):
+        self.capacity = capacity
+        self.rate = per_hour / 3600
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        self._refill()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self._refill()
+        self.tokens -= 1
+
+
+class _Account:
+    def __init__(self, cfg: dict):
+        self.bucket = TokenBucket(int(cfg.get("GRAPH_BURST", BURST)),
+                                  int(cfg.get("GRAPH_CALLS_PER_HOUR", CALLS_PER_HOUR)))
+        self.lock = asyncio.Lock()
+        self.app_usage = 0
+        self.business_usage = 0
+        self.blocked_until = 0.0
+        self.last_call = 0.0
+        self.calls = 0
+        self.throttled = 0
+
+    @property
+    def usage(self) -> int:
+        return max(self.app_usage, self.business_usage)
+
+    def spacing(self) -> float:
+        if self.usage < SLOWDOWN_AT:
+            return 0.0
+        ratio = min(1.0, (self.usage - SLOWDOWN_AT) / (100 - SLOWDOWN_AT))
+        return ratio * MAX_SPACING_SECONDS
+
+    def wait_time(self) -> float:
+        now = time.monotonic()
+        return max(self.blocked_until - now, self.last_call + self.spacing() - now, self.bucket.delay(), 0.0)
+
+    def block(self, seconds: float):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.throttled += 1
+
+
+_accounts: dict[str, _Account] = {}
+
+
+def _state(cfg: dict) -> _Account:
+    key = cfg.get("ACCOUNT_ID") or cfg.get("INSTAGRAM_BUSINESS_ID", "")
+    state = _accounts.get(key)
+    if state is None:
+        state = _accounts[key] = _Account(cfg)
+    return state
+
+
+def base_url(cfg: dict) -> str:
+    return cfg.get("GRAPH_API_BASE", DEFAULT_BASE).rstrip("/")
+
+
+def _percent(usage: dict) -> int:
+    return max((int(v) for k, v in usage.items()
+                if k in ("call_count", "total_time", "total_cputime") and isinstance(v, (int, float))), default=0)
+
+
+def _parse_usage(state: _Account, headers):
+    app = headers.get("x-app-usage")
+    if app:
+        try:
+            state.app_usage = _percent(json.loads(app))
+        except (ValueError, TypeError):
+            pass
+    buc = headers.get("x-business-use-case-usage")
+    if buc:
+        try:
+            entries = [e for items in json.loads(buc).values() for e in items]
+        except (ValueError, TypeError, AttributeError):
+            entries = []
+        if entries:
+            state.business_usage = max(_percent(e) for e in entries)
+            regain = max(int(e.get("estimated_time_to_regain_access") or 0) for e in entries)
+            if regain:
+                state.block(regain * 60)
+
+
+async def _acquire(state: _Account):
+    async with state.lock:
+        while True:
+            wait = state.wait_time()
+            if wait <= 0:
+                state.bucket.take()
+                state.last_call = time.monotonic()
+                state.calls += 1
+                return
+            if wait > MAX_QUEUE_SECONDS:
+                raise RateLimited(f"Graph API 額度不足，約 {int(wait)} 秒後可再呼叫", wait)
+            await asyncio.sleep(wait)
+
+
+async def request(cfg: dict, method: str, endpoint: str, **kwargs) -> dict:
+    state = _state(cfg)
+    await _acquire(state)
+    r = await clients.http().request(method, f"{base_url(cfg)}/{endpoint}",
+                                     timeout=clients.GRAPH_TIMEOUT, **kwargs)
+    _parse_usage(state, r.headers)
+    try:
+        body = r.json()
+    except ValueError:
+        body = {"error": {"message": r.text, "code": r.status_code}}
+
+    error = body.get("error") if isinstance(body, dict) else None
+    if r.status_code == 429 or (error and error.get("code") in RATE_LIMIT_CODES):
+        if state.blocked_until <= time.monotonic():
+            state.block(BLOCK_SECONDS)
+        retry = state.blocked_until - time.monotonic()
+        message = error.get("message") if error else "Too Many Requests"
+        raise RateLimited(f"Graph API 限流：{message}", retry)
+    return body
+
+
+async def post(cfg: dict, endpoint: str, data: dict) -> dict:
+    return await request(cfg, "POST", endpoint, data=data)
+
+
+async def get(cfg: dict, endpoint: str, params: dict) -> dict:
+    return await request(cfg, "GET", endpoint, params=params)
+
+
+def budget(cfg: dict, published_24h: int = 0) -> dict:
+    """目前的呼叫額度，供儀表板顯示"""
+    state = _state(cfg)
+    state.bucket.delay()  # 先補充 token 再讀取
+    blocked = state.blocked_until - time.monotonic()
+    return {
+        "tokens":         max(0, int(state.bucket.tokens)),
+        "capacity":       state.bucket.capacity,
+        "calls_per_hour": int(state.bucket.rate * 3600),
+        "app_usage":      state.app_usage,
+        "business_usage": state.business_usage,
+        "blocked_until":  (datetime.now() + timedelta(seconds=blocked)).strftime("%H:%M:%S") if blocked > 0 else None,
+        "calls":          state.calls,
+        "throttled":      state.throttled,
+        "published_24h":  published_24h,
+        "publish_limit":  int(cfg.get("PUBLISH_LIMIT_PER_DAY", PUBLISH_LIMIT)),
+    }
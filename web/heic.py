@@ -0,0 +1,187 @@
+"""HEIC/HEIF（iPhone 原圖）支援：解碼一次轉成 JPEG，之後讀取 metadata、縮圖、上傳都改用轉好的檔案
+
+解碼依序使用 pillow-heif 或 pyheif（兩者皆為選用套件，都沒有安裝時不會收錄 HEIC）。
+HEIF 的旋轉資訊在解碼時就已套用，輸出的 EXIF Orientation 一律改為 1，避免再被轉一次；
+其他 EXIF（包含 ImageDescription 中的 metadata JSON）與 ICC profile 原樣保留。
+結果以原檔的內容雜湊快取在 heic_cache/，同樣內容不會再解碼第二次；大量轉檔在 process pool 執行。
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import piexif
+from PIL import Image
+
+from . import logstream
+
+try:
+    import pillow_heif
+    pillow_heif.register_heif_opener()
+except ImportError:
+    pillow_heif = None
+try:
+    import pyheif
+except ImportError:
+    pyheif = None
+
+EXTS = ('.heic', '.heif')
+CACHE_DIR = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', 'heic_cache'))
+QUALITY = 92
+POOL_WORKERS = 2
+
+_pool: ProcessPoolExecutor | None = None
+_lock = threading.Lock()
+_digests: dict[str, tuple[int, int, str]] = {}  # 路徑 -> (size, mtime_ns, 雜湊)，避免每次讀取都重算
+
+
+def available() -> bool:
+    return pillow_heif is not None or pyheif is not None
+
+
+def is_heic(path: str) -> bool:
+    return path.lower().endswith(EXTS)
+
+
+def cache_path(digest: str) -> str:
+    return os.path.join(CACHE_DIR, digest[:2], f"{digest}.jpg")
+
+
+def _sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _tiff_start(exif: bytes) -> bytes:
+    # libheif 的 Exif 區塊前面可能還有 4 bytes 位移或 "Exif\0\0"，從 TIFF 檔頭開始取
+    for marker in (b"MM\x00*", b"II*\x00"):
+        i = exif.find(marker)
+        if 0 <= i <= 10:
+            return exif[i:]
+    return exif
+
+
+def _decode(path: str) -> tuple[Image.Image, bytes | None, bytes | None]:
+    """回傳 (已套用旋轉的影像, EXIF, ICC profile)"""
+    if pillow_heif is not None:
+        img = Image.open(path)
+        img.load()
+        return img, img.info.get("exif"), img.info.get("icc_profile")
+    if pyheif is None:
+        raise OSError("未安裝 pillow-heif 或 pyheif，無法讀取 HEIC")
+    heif = pyheif.read(path)
+    img = Image.frombytes(heif.mode, heif.size, heif.data, "raw", heif.mode, heif.stride)
+    exif = next((m["data"] for m in heif.metadata or () if m["type"] == "Exif"), None)
+    icc = heif.color_profile["data"] if heif.color_profile and heif.color_profile["type"] in ("prof", "rICC") else None
+    return img, exif, icc
+
+
+def _upright_exif(exif: bytes | None) -> bytes | None:
+    if not exif:
+        return None
+    try:
+        exif_dict = piexif.load(_tiff_start(exif))
+        exif_dict["0th"][piexif.ImageIFD.Orientation] = 1
+        exif_dict.pop("thumbnail", None)
+        exif_dict["1st"] = {}
+        return piexif.dump(exif_dict)
+    except Exception:
+        # 解析不了的 EXIF 寧可捨棄，也不要讓舊的 Orientation 造成重複旋轉
+        return None
+
+
+def convert_file(path: str, digest: str | None = None) -> tuple[str, str]:
+    """轉成 JPEG 並回傳 (原檔雜湊, 快取檔路徑)；快取已存在時直接回傳"""
+    digest = digest or _sha256(path)
+    dest = cache_path(digest)
+    if os.path.exists(dest):
+        return digest, dest
+    img, exif, icc = _decode(path)
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    save_kwargs = {"quality": QUALITY, "optimize": True}
+    exif = _upright_exif(exif)
+    if exif:
+        save_kwargs["exif"] = exif
+    if icc:
+        save_kwargs["icc_profile"] = icc
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    tmp = f"{dest}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        img.save(tmp, "JPEG", **save_kwargs)
+        os.replace(tmp, dest)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+    return digest, dest
+
+
+def _remember(path: str, digest: str):
+    st = os.stat(path)
+    with _lock:
+        _digests[path] = (st.st_size, st.st_mtime_ns, digest)
+
+
+def _known_digest(path: str) -> str | None:
+    st = os.stat(path)
+    with _lock:
+        entry = _digests.get(path)
+    if entry and entry[:2] == (st.st_size, st.st_mtime_ns):
+        return entry[2]
+    return None
+
+
+def readable(path: str, digest: str | None = None) -> str:
+    """PIL 可直接開啟的路徑：HEIC 回傳轉好的 JPEG（必要時當場轉檔），其他格式原樣回傳"""
+    if not is_heic(path):
+        return path
+    path = os.path.normpath(path)
+    digest = digest or _known_digest(path)
+    digest, dest = convert_file(path, digest)
+    _remember(path, digest)
+    return dest
+
+
+def _executor() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=POOL_WORKERS)
+    return _pool
+
+
+def convert_many(paths: list[str]) -> dict[str, str]:
+    """在 process pool 中批次轉檔，回傳 路徑 -> 原檔雜湊；失敗的檔案略過"""
+    result = {}
+    futures = [(path, _executor().submit(convert_file, path, _known_digest(path))) for path in paths]
+    for path, future in futures:
+        try:
+            digest, _ = future.result()
+        except Exception as e:
+            logstream.log(f"⚠️ HEIC 轉檔失敗 {os.path.basename(path)}：{e}")
+            continue
+        _remember(path, digest)
+        result[path] = digest
+    return result
+
+
+async def convert(path: str, digest: str | None = None) -> str:
+    """非同步版本的 readable，轉檔在 process pool 執行"""
+    if digest and os.path.exists(cache_path(digest)):
+        return cache_path(digest)
+    loop = asyncio.get_running_loop()
+    _, dest = await loop.run_in_executor(_executor(), convert_file, path, digest)
+    return dest
+
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
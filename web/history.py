@@ -0,0 +1,137 @@
+"""發文記錄查詢：以 (created_at, id) 做 keyset 分頁，支援篩選、文案全文檢索與欄位投影"""
+import base64
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, or_, text
+from sqlalchemy.orm import load_only
+
+from .database import PostHistory, post_counts
+
+MAX_LIMIT = 100
+# trigram 斷詞至少需要 3 個字元，更短的關鍵字改用 LIKE
+FTS_MIN_CHARS = 3
+
+FIELDS = {
+    "id":                lambda p: p.id,
+    "account_id":        lambda p: p.account_id,
+    "created_at":        lambda p: p.created_at.strftime("%Y-%m-%d %H:%M") if p.created_at else None,
+    "category":          lambda p: p.category,
+    "image_filename":    lambda p: p.image_filename,
+    "image_url":         lambda p: p.image_url,
+    "caption":           lambda p: p.caption,
+    "instagram_post_id": lambda p: p.instagram_post_id,
+    "status":            lambda p: p.status,
+    "stage":             lambda p: p.stage,
+    "post_type":         lambda p: p.post_type,
+    "attempts":          lambda p: p.attempts,
+    "next_attempt_at":   lambda p: p.next_attempt_at.strftime("%Y-%m-%d %H:%M") if p.next_attempt_at else None,
+    "error_message":     lambda p: p.error_message,
+}
+_ALWAYS = ("id", "created_at")
+
+_fts: bool | None = None
+
+
+def parse_fields(fields: str | None) -> list[str]:
+    if not fields:
+        return list(FIELDS)
+    wanted = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in wanted if f not in FIELDS]
+    if unknown:
+        raise ValueError(f"未知欄位：{', '.join(unknown)}")
+    return list(dict.fromkeys([*_ALWAYS, *wanted]))
+
+
+def encode_cursor(p: PostHistory) -> str:
+    raw = f"{p.created_at.isoformat()}|{p.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created, post_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(created), int(post_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("cursor 格式錯誤")
+
+
+def _has_fts(db) -> bool:
+    global _fts
+    if _fts is None:
+        _fts = db.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'post_history_fts'")).first() is not None
+    return _fts
+
+
+def _search(db, q, keyword: str):
+    if len(keyword) >= FTS_MIN_CHARS and _has_fts(db):
+        phrase = '"' + keyword.replace('"', '""') + '"'
+        ids = text("SELECT rowid FROM post_history_fts WHERE post_history_fts MATCH :phrase").bindparams(phrase=phrase)
+        return q.filter(PostHistory.id.in_(ids))
+    escaped = keyword.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return q.filter(PostHistory.caption.like(f"%{escaped}%", escape="\\"))
+
+
+def _parse_date(value: str) -> datetime:
+    try:
+        return datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        raise ValueError(f"日期格式錯誤：{value}（應為 YYYY-MM-DD）")
+
+
+def query(db, cursor: str | None = None, limit: int = 20, status: str | None = None,
+          category: str | None = None, date_from: str | None = None, date_to: str | None = None,
+          q: str | None = None, fields: str | None = None, account_id: str | None = None) -> dict:
+    names = parse_fields(fields)
+    limit = max(1, min(limit, MAX_LIMIT))
+    columns = [getattr(PostHistory, n) for n in names]
+
+    stmt = db.query(PostHistory).options(load_only(*columns))
+    filtered = False
+    if account_id:
+        stmt = stmt.filter(PostHistory.account_id == account_id)
+        filtered = True
+    if status:
+        stmt = stmt.filter(PostHistory.status == status)
+        filtered = True
+    if category:
+        stmt = stmt.filter(PostHistory.category == category)
+        filtered = True
+    if date_from:
+        stmt = stmt.filter(PostHistory.created_at >= _parse_date(date_from))
+        filtered = True
+    if date_to:
+        stmt = stmt.filter(PostHistory.created_at < _parse_date(date_to) + timedelta(days=1))
+        filtered = True
+    if q and q.strip():
+        stmt = _search(db, stmt, q.strip())
+        filtered = True
+    if cursor:
+        created, post_id = decode_cursor(cursor)
+        stmt = stmt.filter(or_(
+            PostHistory.created_at < created,
+            and_(PostHistory.created_at == created, PostHistory.id < post_id),
+        ))
+
+    rows = (
+        stmt.order_by(PostHistory.created_at.desc(), PostHistory.id.desc())
+        .limit(limit + 1)
+        .all()
+    )
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    counts = None if filtered else post_counts(db)
+    return {
+        # 有篩選條件時不計算總數，避免每頁都掃描整張表
+        "total":       sum(counts.values()) if counts is not None else None,
+        "next_cursor": encode_cursor(rows[-1]) if has_more else None,
+        "posts":       [{n: FIELDS[n](p) for n in names} for p in rows],
+    }
+
+
+def get(db, post_id: int) -> dict | None:
+    p = db.get(PostHistory, post_id)
+    if p is None:
+        return None
+    return {n: fn(p) for n, fn in FIELDS.items()}
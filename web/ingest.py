@@ -0,0 +1,353 @@
+"""批次上傳：邊接收邊寫入暫存檔並計算 SHA-256，不必等整個請求上傳完
+
+- 暫存檔建立在目的資料夾內（.upload-*.part），最後以 os.link 原子性地改成正式檔名，
+  同名檔案存在時自動加上 -1、-2…，不會覆蓋既有圖片。
+- 與圖庫或已發佈資料夾內容完全相同的檔案直接略過；同一批次內重複的檔案也只保留一份。
+- 檢查圖片檔頭、讀取 metadata、計算感知雜湊在 worker pool 中進行，結果以 NDJSON 逐檔回傳。
+- HEIC 原檔照樣存入圖庫，同時在 process pool 中轉成 JPEG 快取，之後掃描與發文都不必再解碼。
+"""
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from multipart.multipart import MultipartParser, parse_options_header
+from PIL import Image
+from werkzeug.utils import secure_filename
+
+from . import catalog, heic, logstream
+from .database import SessionLocal, ImageCatalog
+from .metadata_handler import read_metadata
+from .phash import dhash_file
+
+MAX_FILE_MB = 50
+INGEST_WORKERS = 4
+COPY_CHUNK = 1 << 20
+FORMATS = {"JPEG", "PNG"}
+
+_executor: ThreadPoolExecutor | None = None
+
+
+def _pool() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=INGEST_WORKERS, thread_name_prefix="ingest")
+    return _executor
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+class _Incoming:
+    """上傳中的單一檔案：寫入暫存檔的同時累計雜湊與大小"""
+
+    def __init__(self, folder: str, filename: str, max_bytes: int):
+        self.filename = filename
+        self.max_bytes = max_bytes
+        self.sha = hashlib.sha256()
+        self.size = 0
+        self.error: tuple[str, str] | None = None
+        self.tmp_path: str | None = None
+        self._fh = None
+        if not filename.lower().endswith(catalog.IMAGE_EXTS):
+            self.error = ("invalid", "不支援的檔案類型")
+            return
+        fd, self.tmp_path = tempfile.mkstemp(prefix=".upload-", suffix=".part", dir=folder)
+        self._fh = os.fdopen(fd, "wb")
+
+    def write(self, data: bytes):
+        if self.error:
+            return
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            self.error = ("too_large", f"檔案超過 {self.max_bytes // (1 << 20)} MB")
+            self.discard()
+            return
+        self.sha.update(data)
+        self._fh.write(data)
+
+    def close(self):
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+    def discard(self):
+        self.close()
+        if self.tmp_path and os.path.exists(self.tmp_path):
+            os.unlink(self.tmp_path)
+        self.tmp_path = None
+
+
+def _validate(path: str) -> tuple[dict | None, str | None]:
+    """確認是完整可解析的 JPEG/PNG，回傳 (metadata, dhash)"""
+    try:
+        with Image.open(path) as img:
+            fmt = img.format
+            img.verify()
+    except Exception as e:
+        raise ValueError(f"無法辨識的圖片（{type(e).__name__}）")
+    if fmt not in FORMATS:
+        raise ValueError(f"不支援的圖片格式：{fmt}")
+    return read_metadata(path), dhash_file(path)
+
+
+async def _decoded(path: str, digest: str) -> str:
+    try:
+        return await heic.convert(path, digest)
+    except Exception as e:
+        raise ValueError(f"無法解碼 HEIC（{type(e).__name__}）")
+
+
+def _target_name(filename: str, digest: str) -> str:
+    name = secure_filename(filename)
+    stem, ext = os.path.splitext(name)
+    # secure_filename 會去掉中文等非 ASCII 字元，檔名或副檔名不見時改用雜湊命名
+    if not stem or not ext:
+        ext = os.path.splitext(filename)[1].lower()
+        stem = digest[:16]
+    return stem + ext
+
+
+def _commit(tmp_path: str, folder: str, name: str) -> str:
+    """原子性地把暫存檔改為正式檔名；目的檔已存在時改用下一個編號，不覆蓋"""
+    stem, ext = os.path.splitext(name)
+    n = 0
+    while True:
+        dest = os.path.join(folder, name if n == 0 else f"{stem}-{n}{ext}")
+        try:
+            os.link(tmp_path, dest)
+        except FileExistsError:
+            n += 1
+            continue
+        except OSError:  # 檔案系統不支援硬連結
+            if os.path.exists(dest):
+                n += 1
+                continue
+            os.replace(tmp_path, dest)
+            return dest
+        os.unlink(tmp_path)
+        return dest
+
+
+def _existing(folders: list[str], digest: str) -> str | None:
+    db = SessionLocal()
+    try:
+        row = (
+            db.query(ImageCatalog.path)
+            .filter(ImageCatalog.content_hash == digest, ImageCatalog.folder.in_(folders))
+            .first()
+        )
+        return row[0] if row else None
+    finally:
+        db.close()
+
+
+def _duplicate(dup: str) -> dict:
+    return {"status": "duplicate", "message": "內容與既有圖片相同", "duplicate_of": dup}
+
+
+class Ingest:
+    """一次上傳請求的狀態：分類、目的資料夾、本批次已出現的雜湊"""
+
+    def __init__(self, cfg: dict, category: str):
+        self.cfg = cfg
+        self.category = category
+        self.folder = os.path.normpath(cfg["IMAGE_FOLDERS"][category])
+        self.max_bytes = int(cfg.get("UPLOAD_MAX_FILE_MB", MAX_FILE_MB)) * (1 << 20)
+        pub = cfg.get("PUBLISHED_FOLDER", "")
+        self.dedupe_folders = list(catalog.category_folders(cfg).values()) + ([os.path.normpath(pub)] if pub else [])
+        self.seen: dict[str, asyncio.Future] = {}  # 內容雜湊 -> 存入圖庫的路徑（處理中尚未決定）
+        self.counts = {"saved": 0, "duplicate": 0, "invalid": 0, "too_large": 0, "error": 0}
+        os.makedirs(self.folder, exist_ok=True)
+
+    def incoming(self, filename: str) -> _Incoming:
+        return _Incoming(self.folder, filename, self.max_bytes)
+
+    async def process(self, item: _Incoming) -> dict:
+        try:
+            result = await self._process(item)
+        except Exception as e:
+            result = {"status": "error", "message": str(e)}
+        finally:
+            item.discard()  # 已改名存檔的項目 tmp_path 為 None，不會被刪除
+        result = {"filename": item.filename, **result}
+        self.counts[result["status"]] += 1
+        return result
+
+    async def _process(self, item: _Incoming) -> dict:
+        item.close()
+        if item.error:
+            status, message = item.error
+            return {"status": status, "message": message}
+
+        digest = item.sha.hexdigest()
+        # 同批次內同樣內容的檔案等前一個處理完，再以它存入的路徑回報重複；前一個沒存成功就自己處理
+        while (first := self.seen.get(digest)) is not None:
+            dup = await asyncio.shield(first)
+            if dup:
+                return _duplicate(dup)
+        loop = asyncio.get_running_loop()
+        found = self.seen[digest] = loop.create_future()
+        stored = None  # 這份內容在圖庫中的路徑
+        try:
+            stored = await asyncio.to_thread(_existing, self.dedupe_folders, digest)
+            if stored:
+                return _duplicate(stored)
+            try:
+                src = await _decoded(item.tmp_path, digest) if heic.is_heic(item.filename) else item.tmp_path
+                meta, dhash = await loop.run_in_executor(_pool(), _validate, src)
+            except ValueError as e:
+                return {"status": "invalid", "message": str(e)}
+            dest = stored = await asyncio.to_thread(_commit, item.tmp_path, self.folder,
+                                                    _target_name(item.filename, digest))
+            item.tmp_path = None
+        finally:
+            if stored is None:  # 沒有存檔就釋放佔位，之後同內容的檔案仍可上傳
+                del self.seen[digest]
+            found.set_result(stored)
+
+        try:
+            await asyncio.to_thread(catalog.refresh_path, dest, self.category, (meta, digest, dhash))
+        except Exception as e:
+            # 檔案已經存好，索引留給下次掃描補上
+            logstream.log(f"⚠️ 更新圖庫索引失敗 {os.path.basename(dest)}：{e}")
+        return {"status": "saved", "path": dest, "stored_as": os.path.basename(dest),
+                "size": item.size, "has_metadata": meta is not None}
+
+    def summary(self) -> dict:
+        return {"summary": self.counts}
+
+
+async def ingest_file(cfg: dict, category: str, filename: str, fileobj) -> dict:
+    """單一檔案上傳（舊版 API）走同樣的檢查流程"""
+    job = Ingest(cfg, category)
+    item = job.incoming(filename)
+
+    def copy():
+        for chunk in iter(lambda: fileobj.read(COPY_CHUNK), b""):
+            item.write(chunk)
+
+    await asyncio.to_thread(copy)
+    return await job.process(item)
+
+
+class _StreamParser:
+    """以 python-multipart 的底層 parser 逐塊解析，每個檔案欄位直接寫入暫存檔"""
+
+    def __init__(self, job: Ingest, content_type: str):
+        _, params = parse_options_header(content_type)
+        boundary = params.get(b"boundary")
+        if not boundary:
+            raise ValueError("缺少 multipart boundary")
+        self.job = job
+        self.finished: list[_Incoming] = []
+        self.current: _Incoming | None = None
+        self.open: list[_Incoming] = []
+        self._field = b""
+        self._value = b""
+        self._disposition = b""
+        self.parser = MultipartParser(boundary, {
+            "on_part_begin":       self._part_begin,
+            "on_part_data":        self._part_data,
+            "on_part_end":         self._part_end,
+            "on_header_field":     self._header_field,
+            "on_header_value":     self._header_value,
+            "on_header_end":       self._header_end,
+            "on_headers_finished": self._headers_finished,
+        })
+
+    def _part_begin(self):
+        self.current = None
+        self._disposition = b""
+
+    def _header_field(self, data, start, end):
+        self._field += data[start:end]
+
+    def _header_value(self, data, start, end):
+        self._value += data[start:end]
+
+    def _header_end(self):
+        if self._field.lower() == b"content-disposition":
+            self._disposition = self._value
+        self._field = b""
+        self._value = b""
+
+    def _headers_finished(self):
+        _, options = parse_options_header(self._disposition)
+        filename = options.get(b"filename")
+        if filename is not None:  # 非檔案欄位直接忽略
+            self.current = self.job.incoming(os.path.basename(filename.decode("utf-8", "replace")))
+            self.open.append(self.current)
+
+    def _part_data(self, data, start, end):
+        if self.current is not None:
+            self.current.write(data[start:end])
+
+    def _part_end(self):
+        if self.current is not None:
+            self.current.close()
+            self.open.remove(self.current)
+            self.finished.append(self.current)
+            self.current = None
+
+    def write(self, chunk: bytes):
+        self.parser.write(chunk)
+
+    def take(self) -> list[_Incoming]:
+        done, self.finished = self.finished, []
+        return done
+
+    def abort(self):
+        for item in self.open + self.finished:
+            item.discard()
+
+
+def stream(job: Ingest, content_type: str, body):
+    """回傳 NDJSON 產生器：body 為請求內容的 async iterator，每個檔案處理完就送出一行結果
+
+    Content-Type 不是合法的 multipart 時立即丟出 ValueError，不會開始回應。
+    """
+    return _results(job, _StreamParser(job, content_type), body)
+
+
+async def _results(job: Ingest, parser: _StreamParser, body):
+    results: asyncio.Queue[dict] = asyncio.Queue()
+    tasks: set[asyncio.Task] = set()
+    pending = 0
+
+    def start(items: list[_Incoming]):
+        nonlocal pending
+        pending += len(items)
+        for item in items:
+            task = asyncio.create_task(job.process(item))
+            task.add_done_callback(lambda t: results.put_nowait(t.result()) if not t.cancelled() else None)
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+    def line(obj: dict) -> str:
+        return json.dumps(obj, ensure_ascii=False) + "\n"
+
+    try:
+        async for chunk in body:
+            if chunk:
+                await asyncio.to_thread(parser.write, chunk)
+                start(parser.take())
+            while not results.empty():
+                pending -= 1
+                yield line(results.get_nowait())
+        parser.parser.finalize()
+        start(parser.take())
+        while pending:
+            pending -= 1
+            yield line(await results.get())
+        yield line(job.summary())
+    finally:
+        for task in tasks:
+            task.cancel()
+        parser.abort()
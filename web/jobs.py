@@ -0,0 +1,327 @@
+"""SQLite 任務佇列：排程與手動發文都先寫入 jobs 表，再由 worker 取出執行
+
+- worker 以租約取得任務，執行期間每 HEARTBEAT_SECONDS 延長一次；程序當掉時租約到期，
+  任務會回到佇列由下一個 worker 接手，發文流程本身會從 post_history 記錄的階段繼續。
+- 同一帳號同時只會有一個任務在執行，手動與排程發文不會撞在同一張圖片上。
+- 任務失敗依次數退避重試，超過 max_attempts 進入 dead，可從 API 手動重新排入。
+"""
+import asyncio
+import json
+import os
+import socket
+from datetime import datetime, timedelta
+
+from sqlalchemy import exists, func
+from sqlalchemy.orm import aliased
+
+from .database import SessionLocal, Job
+
+LEASE_SECONDS = 90
+HEARTBEAT_SECONDS = 30
+POLL_SECONDS = 5
+RETRY_SECONDS = 60
+MAX_ATTEMPTS = 3
+KEEP_DAYS = 7
+ACTIVE = ("queued", "running")
+
+
+class PermanentError(Exception):
+    """不需重試的錯誤，任務直接進入 dead"""
+
+
+_handlers: dict = {}
+_workers: list[asyncio.Task] = []
+_wake: asyncio.Event | None = None
+_log = print
+
+
+def to_dict(job: Job) -> dict:
+    fmt = lambda t: t.strftime("%Y-%m-%d %H:%M:%S") if t else None
+    return {
+        "id":           job.id,
+        "kind":         job.kind,
+        "account_id":   job.account_id,
+        "payload":      json.loads(job.payload or "{}"),
+        "source":       job.source,
+        "status":       job.status,
+        "attempts":     job.attempts,
+        "max_attempts": job.max_attempts,
+        "run_at":       fmt(job.run_at),
+        "lease_owner":  job.lease_owner,
+        "lease_until":  fmt(job.lease_until),
+        "heartbeat_at": fmt(job.heartbeat_at),
+        "last_error":   job.last_error,
+        "created_at":   fmt(job.created_at),
+        "finished_at":  fmt(job.finished_at),
+    }
+
+
+def enqueue(kind: str, account_id: str, payload: dict | None = None, source: str = "",
+            max_attempts: int = MAX_ATTEMPTS) -> tuple[dict, bool]:
+    """排入任務；同帳號已有相同內容的任務在佇列中或執行中時不重複排入，回傳 (任務, 是否新建)"""
+    body = json.dumps(payload or {}, ensure_ascii=False, sort_keys=True)
+    db = SessionLocal()
+    try:
+        existing = (
+            db.query(Job)
+            .filter(Job.kind == kind, Job.account_id == account_id, Job.payload == body,
+                    Job.status.in_(ACTIVE))
+            .order_by(Job.id)
+            .first()
+        )
+        if existing is not None:
+            return to_dict(existing), False
+        job = Job(kind=kind, account_id=account_id, payload=body, source=source, status="queued",
+                  attempts=0, max_attempts=max_attempts, run_at=datetime.now())
+        db.add(job)
+        db.commit()
+        result = to_dict(job)
+    finally:
+        db.close()
+    if _wake is not None:
+        _wake.set()
+    return result, True
+
+
+def claim(db, owner: str) -> Job | None:
+    """取出一個到期的任務並設定租約；同帳號已有執行中的任務時跳過該帳號"""
+    now = datetime.now()
+    running = aliased(Job)
+    busy = exists().where(running.account_id == Job.account_id, running.status == "running")
+    candidates = (
+        db.query(Job.id)
+        .filter(Job.status == "queued", Job.run_at <= now, ~busy)
+        .order_by(Job.run_at, Job.id)
+        .limit(10)
+        .all()
+    )
+    for (job_id,) in candidates:
+        # 條件式 UPDATE 在 SQLite 寫入鎖內完成，多個程序同時搶同一筆時只有一個會成功
+        claimed = (
+            db.query(Job)
+            .filter(Job.id == job_id, Job.status == "queued", ~busy)
+            .update({
+                Job.status: "running",
+                Job.lease_owner: owner,
+                Job.lease_until: now + timedelta(seconds=LEASE_SECONDS),
+                Job.heartbeat_at: now,
+                Job.attempts: Job.attempts + 1,
+                Job.updated_at: now,
+            }, synchronize_session=False)
+        )
+        db.commit()
+        if claimed:
+            return db.get(Job, job_id)
+    return None
+
+
+def _owned(db, job_id: int, owner: str):
+    return db.query(Job).filter(Job.id == job_id, Job.status == "running", Job.lease_owner == owner)
+
+
+def heartbeat(job_id: int, owner: str) -> bool:
+    db = SessionLocal()
+    try:
+        now = datetime.now()
+        ok = _owned(db, job_id, owner).update({
+            Job.lease_until: now + timedelta(seconds=LEASE_SECONDS),
+            Job.heartbeat_at: now,
+        }, synchronize_session=False)
+        db.commit()
+        return bool(ok)
+    finally:
+        db.close()
+
+
+def complete(job_id: int, owner: str):
+    db = SessionLocal()
+    try:
+        now = datetime.now()
+        _owned(db, job_id, owner).update({
+            Job.status: "done", Job.lease_owner: None, Job.lease_until: None,
+            Job.last_error: None, Job.finished_at: now, Job.updated_at: now,
+        }, synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+
+def fail(job_id: int, owner: str, error: str, permanent: bool = False) -> Job | None:
+    """任務失敗：還有次數就退避後重排，否則進入 dead"""
+    db = SessionLocal()
+    try:
+        job = _owned(db, job_id, owner).first()
+        if job is None:  # 租約已被接手
+            return None
+        _release(job, error, permanent)
+        db.commit()
+        db.refresh(job)
+        db.expunge(job)
+        return job
+    finally:
+        db.close()
+
+
+def _release(job: Job, error: str, permanent: bool = False):
+    now = datetime.now()
+    job.last_error = error
+    job.lease_owner = None
+    job.lease_until = None
+    if permanent or job.attempts >= job.max_attempts:
+        job.status = "dead"
+        job.finished_at = now
+    else:
+        job.status = "queued"
+        job.run_at = now + timedelta(seconds=RETRY_SECONDS * 2 ** max(job.attempts - 1, 0))
+
+
+def requeue_expired(db) -> int:
+    """租約過期（worker 當掉或程序被強制結束）的任務重新排入或進入 dead"""
+    expired = db.query(Job).filter(Job.status == "running", Job.lease_until < datetime.now()).all()
+    for job in expired:
+        _release(job, f"租約逾時（{job.lease_owner}）")
+    if expired:
+        db.commit()
+    return len(expired)
+
+
+def release_owned(prefix: str) -> int:
+    """正常關閉時交還本程序執行中的任務，不計入失敗次數"""
+    db = SessionLocal()
+    try:
+        rows = db.query(Job).filter(Job.status == "running", Job.lease_owner.like(f"{prefix}:%")).update({
+            Job.status: "queued", Job.lease_owner: None, Job.lease_until: None,
+            Job.attempts: Job.attempts - 1, Job.run_at: datetime.now(),
+        }, synchronize_session=False)
+        db.commit()
+        return rows
+    finally:
+        db.close()
+
+
+def retry(job_id: int) -> dict | None:
+    """把 dead 任務重新排入佇列"""
+    db = SessionLocal()
+    try:
+        job = db.get(Job, job_id)
+        if job is None or job.status != "dead":
+            return None
+        job.status = "queued"
+        job.attempts = 0
+        job.run_at = datetime.now()
+        job.finished_at = None
+        db.commit()
+        result = to_dict(job)
+    finally:
+        db.close()
+    if _wake is not None:
+        _wake.set()
+    return result
+
+
+def list_jobs(status: str | None = None, account_id: str | None = None, limit: int = 50) -> list[dict]:
+    db = SessionLocal()
+    try:
+        q = db.query(Job)
+        if status:
+            q = q.filter(Job.status == status)
+        if account_id:
+            q = q.filter(Job.account_id == account_id)
+        return [to_dict(j) for j in q.order_by(Job.id.desc()).limit(max(1, min(limit, 200))).all()]
+    finally:
+        db.close()
+
+
+def counts(db) -> dict[str, int]:
+    return dict(db.query(Job.status, func.count(Job.id)).group_by(Job.status).all())
+
+
+def purge(days: int = KEEP_DAYS) -> int:
+    db = SessionLocal()
+    try:
+        rows = db.query(Job).filter(Job.status == "done",
+                                    Job.finished_at < datetime.now() - timedelta(days=days)).delete()
+        db.commit()
+        return rows
+    finally:
+        db.close()
+
+
+# ── Worker ──────────────────────────────────────────────────────────────────
+
+async def _keep_alive(job_id: int, owner: str):
+    while True:
+        await asyncio.sleep(HEARTBEAT_SECONDS)
+        if not heartbeat(job_id, owner):
+            _log(f"⚠️ 任務 #{job_id} 的租約已失效")
+            return
+
+
+async def _run(job: dict, owner: str):
+    handler = _handlers.get(job["kind"])
+    beat = asyncio.create_task(_keep_alive(job["id"], owner))
+    try:
+        if handler is None:
+            raise PermanentError(f"未知的任務類型：{job['kind']}")
+        await handler(job)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        failed = fail(job["id"], owner, str(e), permanent=isinstance(e, PermanentError))
+        if failed is not None and failed.status == "dead":
+            _log(f"☠️ 任務 #{job['id']}（{job['kind']}）失敗 {failed.attempts} 次，已移至 dead：{e}")
+        elif failed is not None:
+            _log(f"⚠️ 任務 #{job['id']}（{job['kind']}）失敗：{e}，{failed.run_at:%H:%M} 重試")
+    else:
+        complete(job["id"], owner)
+    finally:
+        beat.cancel()
+
+
+async def _worker(owner: str):
+    while True:
+        db = SessionLocal()
+        try:
+            requeue_expired(db)
+            job = claim(db, owner)
+            job = to_dict(job) if job else None
+        except Exception as e:
+            _log(f"⚠️ 讀取任務佇列失敗：{e}")
+            job = None
+        finally:
+            db.close()
+
+        if job is not None:
+            await _run(job, owner)
+            continue
+        try:
+            await asyncio.wait_for(_wake.wait(), POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        _wake.clear()
+
+
+def _owner_prefix() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def start(handlers: dict, concurrency: int = 1, log=None):
+    global _wake, _log
+    if _workers:
+        return
+    _handlers.update(handlers)
+    _log = log or print
+    _wake = asyncio.Event()
+    prefix = _owner_prefix()
+    for n in range(max(1, concurrency)):
+        _workers.append(asyncio.create_task(_worker(f"{prefix}:{n}"), name=f"job-worker-{n}"))
+
+
+async def stop():
+    for task in _workers:
+        task.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
+    released = release_owned(_owner_prefix())
+    if released:
+        _log(f"⏸️ 已交還 {released} 個執行中的任務，下次啟動時繼續")
@@ -0,0 +1,123 @@
+"""日誌廣播：每筆日誌有遞增的序號，SSE 訂閱者以佇列接收推播而非輪詢
+
+斷線重連時依 Last-Event-ID 從環狀緩衝區補送漏掉的日誌；訂閱者處理太慢導致佇列滿了，
+就清空佇列改由緩衝區補送，不會拖慢發文流程。
+"""
+import asyncio
+import json
+import threading
+from collections import deque
+from datetime import datetime
+
+BUFFER_SIZE = 300
+QUEUE_SIZE = 100
+HEARTBEAT_SECONDS = 15
+RETRY_MS = 3000
+
+_lock = threading.Lock()
+_entries: deque[tuple[int, str]] = deque(maxlen=BUFFER_SIZE)
+_seq = 0
+_subscribers: set["Subscriber"] = set()
+
+
+class Subscriber:
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.queue: asyncio.Queue[tuple[int, str]] = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self.lagged = False
+
+    def _push(self, entry: tuple[int, str]):
+        if self.lagged:
+            return
+        try:
+            self.queue.put_nowait(entry)
+        except asyncio.QueueFull:
+            self.lagged = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+
+
+def publish(text: str) -> int:
+    global _seq
+    with _lock:
+        _seq += 1
+        entry = (_seq, text)
+        _entries.append(entry)
+        subscribers = list(_subscribers)
+    for sub in subscribers:
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is sub.loop:
+            sub._push(entry)
+        else:
+            try:
+                sub.loop.call_soon_threadsafe(sub._push, entry)
+            except RuntimeError:  # loop 已關閉
+                pass
+    return entry[0]
+
+
+def log(msg: str) -> int:
+    """加上時間戳記後發佈；給沒有帳號日誌可用的背景工作使用"""
+    return publish(f"[{datetime.now().strftime('%H:%M:%S')}] {msg}")
+
+
+def recent(limit: int = BUFFER_SIZE) -> list[str]:
+    with _lock:
+        return [text for _, text in list(_entries)[-limit:]]
+
+
+def last_id() -> int:
+    return _seq
+
+
+def since(seq: int) -> list[tuple[int, str]]:
+    with _lock:
+        return [e for e in _entries if e[0] > seq]
+
+
+def subscribe() -> Subscriber:
+    sub = Subscriber(asyncio.get_running_loop())
+    with _lock:
+        _subscribers.add(sub)
+    return sub
+
+
+def unsubscribe(sub: Subscriber):
+    with _lock:
+        _subscribers.discard(sub)
+
+
+def _event(seq: int, text: str) -> str:
+    return f"id: {seq}\ndata: {json.dumps({'log': text}, ensure_ascii=False)}\n\n"
+
+
+async def stream(after: int = 0):
+    """SSE 產生器：先補送 after 之後的緩衝日誌，之後等待推播；閒置時送出心跳"""
+    sub = subscribe()
+    try:
+        yield f"retry: {RETRY_MS}\n\n"
+        # 訂閱後才讀緩衝區，兩者重疊的部分以序號去重；序號比目前還大代表伺服器重啟過
+        last = after if after <= _seq else 0
+        for seq, text in since(last):
+            yield _event(seq, text)
+            last = seq
+        while True:
+            if sub.lagged:
+                sub.lagged = False
+                for seq, text in since(last):
+                    yield _event(seq, text)
+                    last = seq
+                continue
+            try:
+                seq, text = await asyncio.wait_for(sub.queue.get(), HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": ping\n\n"
+                continue
+            if seq > last:
+                yield _event(seq, text)
+                last = seq
+    finally:
+        unsubscribe(sub)
@@ -1,32 +1,51 @@
-import asyncio
-import json
 import os
-import shutil
 from contextlib import asynccontextmanager
 from pathlib import Path
+from urllib.parse import quote
 
-from fastapi import BackgroundTasks, FastAPI, File, Form, HTTPException, Query, UploadFile
+from fastapi import FastAPI, File, Form, Header, HTTPException, Query, Request, UploadFile
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, HTMLResponse, StreamingResponse
+from fastapi.responses import FileResponse, HTMLResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
-from werkzeug.utils import secure_filename
 
+from . import accounts, bulk_metadata, catalog, clients, config_manager, graph, heic, history, ingest, jobs, logstream, optimizer, prepared, similarity, thumbnails, uploads
 from .config_manager import load_config, save_config
-from .database import PostHistory, SessionLocal, init_db
+from .database import PostHistory, SessionLocal, init_db, post_counts
 from .metadata_handler import read_metadata, write_metadata
-from .poster import do_post, get_all_images
+from .poster import get_all_images, recent_publishes, refill_in_background, regenerate_prepared
 from . import scheduler as sched
 
 STATIC_DIR = Path(__file__).parent / "static"
-ALLOWED_EXTS = {'.jpg', '.jpeg', '.png', '.webp'}
+ALLOWED_EXTS = {'.jpg', '.jpeg', '.png', '.webp', *heic.EXTS}
+
+
+def account_cfg(account: str | None) -> dict:
+    try:
+        return accounts.account_config(load_config(), account)
+    except KeyError as e:
+        raise HTTPException(404, str(e.args[0]))
+
+
+def thumb_url(path: str, mtime: int | None = None) -> str:
+    url = f"/api/images/thumb?path={quote(path)}"
+    return f"{url}&v={mtime}" if mtime else url
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     init_db()
+    thumbnails.configure(load_config())
+    config_manager.subscribe(lambda new, old: thumbnails.configure(new))
+    config_manager.start_watcher()
     sched.start()
     yield
-    sched.stop()
+    await sched.stop()
+    config_manager.stop_watcher()
+    optimizer.shutdown()
+    ingest.shutdown()
+    heic.shutdown()
+    await clients.aclose()
 
 
 app = FastAPI(title="InstaPoetBot", lifespan=lifespan)
@@ -43,28 +62,42 @@ async def index():
 
 # ── Dashboard ───────────────────────────────────────────────────────────────
 
+@app.get("/api/accounts")
+async def list_accounts():
+    return [accounts.summary(acc) | {"next_run": sched.get_next_run(acc["ACCOUNT_ID"])}
+            for acc in accounts.list_accounts(load_config())]
+
+
 @app.get("/api/dashboard")
 async def get_dashboard():
     db = SessionLocal()
     try:
-        total   = db.query(PostHistory).count()
-        success = db.query(PostHistory).filter(PostHistory.status == "success").count()
-        failed  = db.query(PostHistory).filter(PostHistory.status == "failed").count()
-        recent  = (
+        counts = post_counts(db)
+        job_counts = jobs.counts(db)
+        published = recent_publishes(db)
+        recent = (
             db.query(PostHistory)
-            .order_by(PostHistory.created_at.desc())
+            .order_by(PostHistory.created_at.desc(), PostHistory.id.desc())
             .limit(5).all()
         )
         return {
-            "total_posts":       total,
-            "success_posts":     success,
-            "failed_posts":      failed,
+            "total_posts":       sum(counts.values()),
+            "success_posts":     counts.get("success", 0),
+            "failed_posts":      counts.get("failed", 0),
+            "pending_posts":     counts.get("pending", 0),
             "scheduler_running": sched.scheduler.running,
             "next_run":          sched.get_next_run(),
-            "logs":              list(sched.log_buffer)[-80:],
+            "logs":              logstream.recent(80),
+            "jobs":              {status: job_counts.get(status, 0) for status in ("queued", "running", "dead")},
+            "graph_budget": [
+                {"account_id": acc["ACCOUNT_ID"], "name": acc["ACCOUNT_NAME"],
+                 **graph.budget(acc, published.get(acc["ACCOUNT_ID"], (0, None))[0])}
+                for acc in accounts.list_accounts(load_config())
+            ],
             "recent_posts": [
                 {
                     "id":             p.id,
+                    "account_id":     p.account_id,
                     "created_at":     p.created_at.strftime("%Y-%m-%d %H:%M"),
                     "category":       p.category,
                     "image_filename": p.image_filename,
@@ -78,32 +111,94 @@ async def get_dashboard():
 
 
 @app.get("/api/logs/stream")
-async def stream_logs():
-    async def generator():
-        last = 0
-        while True:
-            logs = list(sched.log_buffer)
-            if len(logs) > last:
-                for entry in logs[last:]:
-                    yield f"data: {json.dumps({'log': entry})}\n\n"
-                last = len(logs)
-            await asyncio.sleep(1)
-
-    return StreamingResponse(generator(), media_type="text/event-stream",
+async def stream_logs(request: Request, last_id: int | None = None):
+    # 瀏覽器自動重連時會帶 Last-Event-ID；手動重建連線時改用 ?last_id=
+    header = request.headers.get("last-event-id", "")
+    after = int(header) if header.isdigit() else (last_id or 0)
+    return StreamingResponse(logstream.stream(after), media_type="text/event-stream",
                              headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 
 @app.post("/api/post-now")
-async def post_now(background_tasks: BackgroundTasks, data: dict = {}):
+async def post_now(data: dict = {}):
     post_type = data.get("post_type", "feed")
+    force_caption = bool(data.get("force_caption", False))
+    acc = account_cfg(data.get("account_id"))
+    job, created = sched.enqueue_post(acc["ACCOUNT_ID"], "manual", post_type, force_caption)
+    if not created:
+        return {"message": f"相同的發文任務 #{job['id']} 已在佇列中", "job": job}
+    return {"message": f"發文任務 #{job['id']} 已排入佇列", "job": job}
+
 
-    async def run():
-        label = "動態（Story）" if post_type == "story" else "貼文（Feed）"
-        sched.add_log(f"📢 手動觸發：{label}")
-        await do_post(log=sched.add_log, post_type=post_type)
+# ── Jobs ────────────────────────────────────────────────────────────────────
 
-    background_tasks.add_task(run)
-    return {"message": "發文任務已啟動"}
+@app.get("/api/jobs")
+async def list_jobs(status: str | None = None, account: str | None = None, limit: int = 50):
+    return jobs.list_jobs(status, account, limit)
+
+
+@app.post("/api/jobs/{job_id}/retry")
+async def retry_job(job_id: int):
+    job = jobs.retry(job_id)
+    if job is None:
+        raise HTTPException(404, "找不到可重試的任務")
+    return job
+
+
+# ── Prepared posts ──────────────────────────────────────────────────────────
+
+@app.get("/api/prepared")
+async def list_prepared(account: str | None = None):
+    items = prepared.list_items(account_id=account)
+    for item in items:
+        item["thumb_url"] = thumb_url(item["image_path"])
+    return items
+
+
+@app.put("/api/prepared/{item_id}")
+async def update_prepared(item_id: int, data: dict):
+    caption = data.get("caption")
+    if caption is None:
+        raise HTTPException(400, "無效的請求")
+    item = prepared.update(item_id, caption)
+    if item is None:
+        raise HTTPException(404, "找不到可編輯的待發佈貼文")
+    return item
+
+
+@app.post("/api/prepared/{item_id}/regenerate")
+async def regenerate_prepared_caption(item_id: int):
+    try:
+        item = await regenerate_prepared(item_id)
+    except Exception as e:
+        raise HTTPException(502, f"文案生成失敗：{e}")
+    if item is None:
+        raise HTTPException(404, "找不到可編輯的待發佈貼文")
+    return item
+
+
+@app.delete("/api/prepared/{item_id}")
+async def discard_prepared(item_id: int):
+    account_id = prepared.discard(item_id)
+    if account_id is None:
+        raise HTTPException(404, "找不到可移除的待發佈貼文")
+    refill_in_background(sched.add_log, account_id)
+    return {"message": "已移除"}
+
+
+@app.post("/api/prepared/refill")
+async def refill_prepared(account: str | None = None):
+    refill_in_background(sched.add_log, account_cfg(account)["ACCOUNT_ID"])
+    return {"message": "已開始準備貼文"}
+
+
+@app.post("/api/uploads/sweep")
+async def sweep_uploads():
+    try:
+        deleted = await uploads.sweep(load_config(), log=sched.add_log)
+    except Exception as e:
+        raise HTTPException(502, f"Cloudinary 清理失敗：{e}")
+    return {"message": f"已清除 {deleted} 張圖片", "deleted": deleted}
 
 
 # ── Config ──────────────────────────────────────────────────────────────────
@@ -115,43 +210,125 @@ async def get_config():
 
 @app.post("/api/config")
 async def update_config(config: dict):
-    save_config(config)
-    sched.update_schedule()
+    # 排程、縮圖快取等設定由 config_manager 的訂閱者套用
+    await run_in_threadpool(save_config, config)
     return {"message": "設定已儲存"}
 
 
 # ── Images ──────────────────────────────────────────────────────────────────
 
 @app.get("/api/images")
-async def list_images():
-    cfg = load_config()
-    images = get_all_images(cfg)
+async def list_images(account: str | None = None):
+    cfg = account_cfg(account)
+    images = await run_in_threadpool(get_all_images, cfg)
     for img in images:
-        img["thumb_url"] = f"/api/images/file?path={img['path']}"
+        img["thumb_url"] = thumb_url(img["path"], img.pop("mtime"))
     return images
 
 
+@app.get("/api/images/duplicates")
+async def list_duplicates(account: str | None = None, limit: int = Query(100, ge=1, le=1000)):
+    """近似重複的圖片群組（含已發佈資料夾），大的群組在前"""
+    cfg = account_cfg(account)
+    by_folder = {folder: category for category, folder in catalog.category_folders(cfg).items()}
+    pub = cfg.get("PUBLISHED_FOLDER", "")
+    if pub:
+        by_folder.setdefault(os.path.normpath(pub), catalog.PUBLISHED)
+
+    def find():
+        catalog.scan(cfg)
+        return similarity.clusters(cfg, set(by_folder))
+
+    groups = sorted(await run_in_threadpool(find), key=len, reverse=True)
+    return {
+        "distance": similarity.max_distance(cfg) or similarity.DEFAULT_DISTANCE,
+        "total":    len(groups),
+        "groups": [
+            [
+                {
+                    "path":      path,
+                    "filename":  os.path.basename(path),
+                    "category":  by_folder[os.path.dirname(path)],
+                    "published": by_folder[os.path.dirname(path)] == catalog.PUBLISHED,
+                    "thumb_url": thumb_url(path),
+                }
+                for path in group
+            ]
+            for group in groups[:limit]
+        ],
+    }
+
+
 @app.get("/api/images/file")
 async def serve_image(path: str = Query(...)):
     if not os.path.exists(path):
         raise HTTPException(404, "圖片不存在")
     if Path(path).suffix.lower() not in ALLOWED_EXTS:
         raise HTTPException(400, "不支援的檔案類型")
+    if heic.is_heic(path):  # 瀏覽器無法顯示 HEIC，改送轉好的 JPEG
+        try:
+            return FileResponse(await run_in_threadpool(heic.readable, path), media_type="image/jpeg")
+        except Exception:
+            raise HTTPException(415, "無法讀取 HEIC 圖片")
     return FileResponse(path)
 
 
+@app.get("/api/images/thumb")
+async def serve_thumbnail(path: str = Query(...), size: int = thumbnails.DEFAULT_SIZE,
+                          fmt: str = thumbnails.DEFAULT_FORMAT, v: str | None = None,
+                          if_none_match: str | None = Header(None)):
+    if not os.path.exists(path):
+        raise HTTPException(404, "圖片不存在")
+    if Path(path).suffix.lower() not in ALLOWED_EXTS:
+        raise HTTPException(400, "不支援的檔案類型")
+    # 網址帶有版本（原圖 mtime）時可以長期快取，否則每次以 ETag 重新驗證
+    cache_control = "public, max-age=31536000, immutable" if v else "no-cache"
+    etag = thumbnails.etag_for(path, size, fmt)
+    if if_none_match == etag:
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control})
+    try:
+        thumb, media_type, etag = await run_in_threadpool(thumbnails.get_thumbnail, path, size, fmt)
+    except OSError:
+        raise HTTPException(415, "無法產生縮圖")
+    return FileResponse(thumb, media_type=media_type,
+                        headers={"ETag": etag, "Cache-Control": cache_control})
+
+
 @app.post("/api/images/upload")
-async def upload_image(file: UploadFile = File(...), category: str = Form("poetic")):
-    cfg = load_config()
-    folder = cfg.get("IMAGE_FOLDERS", {}).get(category)
-    if not folder:
+async def upload_image(file: UploadFile = File(...), category: str = Form("poetic"),
+                       account: str | None = Form(None)):
+    cfg = account_cfg(account)
+    if not cfg.get("IMAGE_FOLDERS", {}).get(category):
+        raise HTTPException(400, "無效的分類")
+    result = await ingest.ingest_file(cfg, category, file.filename or "", file.file)
+    if result["status"] == "duplicate":
+        raise HTTPException(409, f"{result['message']}：{os.path.basename(result['duplicate_of'])}")
+    if result["status"] != "saved":
+        raise HTTPException(413 if result["status"] == "too_large" else 400, result["message"])
+    return {"message": "上傳成功", "path": result["path"], "filename": result["stored_as"]}
+
+
+class _UploadResponse(StreamingResponse):
+    """StreamingResponse 會另外呼叫 receive() 等待斷線，與邊讀請求內容邊回應的產生器搶訊息；
+    這裡只送出回應，斷線時 request.stream() 會丟出 ClientDisconnect 結束產生器"""
+
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+
+
+@app.post("/api/images/bulk-upload")
+async def bulk_upload(request: Request, category: str = "poetic", account: str | None = None):
+    """multipart 上傳多個檔案，邊接收邊處理；回應為 NDJSON，每個檔案一行，最後一行為統計"""
+    cfg = account_cfg(account)
+    if not cfg.get("IMAGE_FOLDERS", {}).get(category):
         raise HTTPException(400, "無效的分類")
-    os.makedirs(folder, exist_ok=True)
-    safe_name = secure_filename(file.filename)
-    dest = os.path.join(folder, safe_name)
-    with open(dest, "wb") as f:
-        shutil.copyfileobj(file.file, f)
-    return {"message": "上傳成功", "path": dest, "filename": safe_name}
+    try:
+        body = ingest.stream(ingest.Ingest(cfg, category), request.headers.get("content-type", ""),
+                             request.stream())
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    return _UploadResponse(body, media_type="application/x-ndjson",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 
 @app.post("/api/images/metadata")
@@ -160,84 +337,106 @@ async def save_image_metadata(data: dict):
     metadata = data.get("metadata")
     if not path or metadata is None or not os.path.exists(path):
         raise HTTPException(400, "無效的請求")
-    write_metadata(path, metadata)
+    try:
+        digest = await run_in_threadpool(write_metadata, path, metadata)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    if digest:
+        # 只改寫了 EXIF：沿用寫入時算好的雜湊更新索引，不必重新讀檔
+        await run_in_threadpool(catalog.record_rewrites, [(path, metadata, digest)])
     return {"message": "Metadata 已儲存"}
 
 
+@app.post("/api/images/metadata/batch")
+async def save_metadata_batch(data: dict):
+    """一次修改多張圖片：paths 與 category（該分類全部圖片）擇一或併用，mode 為 merge / replace"""
+    paths = list(data.get("paths") or [])
+    if data.get("category"):
+        cfg = account_cfg(data.get("account"))
+        images = await run_in_threadpool(catalog.list_images, cfg)
+        paths += [img["path"] for img in images if img["category"] == data["category"]]
+    try:
+        return await run_in_threadpool(bulk_metadata.apply, load_config(), paths,
+                                       data.get("patch"), data.get("mode", "merge"))
+    except bulk_metadata.Invalid as e:
+        raise HTTPException(400, {"message": str(e), "results": e.results})
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+
 @app.delete("/api/images")
 async def delete_image(data: dict):
     path = data.get("path")
     if not path or not os.path.exists(path):
         raise HTTPException(400, "檔案不存在")
     os.remove(path)
+    catalog.remove_path(path)
     return {"message": "已刪除"}
 
 
 # ── History ─────────────────────────────────────────────────────────────────
 
 @app.get("/api/history")
-async def get_history(page: int = 1, limit: int = 20):
+async def get_history(cursor: str | None = None, limit: int = 20, status: str | None = None,
+                      category: str | None = None, date_from: str | None = None,
+                      date_to: str | None = None, q: str | None = None, fields: str | None = None,
+                      account: str | None = None):
     db = SessionLocal()
     try:
-        total = db.query(PostHistory).count()
-        posts = (
-            db.query(PostHistory)
-            .order_by(PostHistory.created_at.desc())
-            .offset((page - 1) * limit)
-            .limit(limit)
-            .all()
-        )
-        return {
-            "total": total,
-            "page":  page,
-            "posts": [
-                {
-                    "id":                 p.id,
-                    "created_at":         p.created_at.strftime("%Y-%m-%d %H:%M"),
-                    "category":           p.category,
-                    "image_filename":     p.image_filename,
-                    "image_url":          p.image_url,
-                    "caption":            p.caption,
-                    "instagram_post_id":  p.instagram_post_id,
-                    "status":             p.status,
-                    "error_message":      p.error_message,
-                }
-                for p in posts
-            ],
-        }
+        return history.query(db, cursor, limit, status, category, date_from, date_to, q, fields, account)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
     finally:
         db.close()
 
 
+@app.get("/api/history/{post_id}")
+async def get_history_post(post_id: int):
+    db = SessionLocal()
+    try:
+        post = history.get(db, post_id)
+    finally:
+        db.close()
+    if post is None:
+        raise HTTPException(404, "找不到此筆記錄")
+    return post
+
+
 # ── Published ────────────────────────────────────────────────────────────────
 
 @app.get("/api/images/published")
-async def list_published_images():
-    cfg = load_config()
+async def list_published_images(cursor: str | None = None, limit: int = Query(30, ge=1, le=100),
+                                account: str | None = None):
+    cfg = account_cfg(account)
     pub_folder = cfg.get("PUBLISHED_FOLDER", "")
     if not pub_folder or not os.path.isdir(pub_folder):
-        return []
+        return {"images": [], "next_cursor": None}
 
+    rows, next_cursor = await run_in_threadpool(catalog.list_published, cfg, cursor, limit)
     db = SessionLocal()
     try:
-        posts = db.query(PostHistory).filter(PostHistory.status == "success").all()
+        # 只查這一頁的檔名；同一檔名有多筆成功紀錄時取最新一筆
+        posts = (
+            db.query(PostHistory)
+            .filter(PostHistory.image_filename.in_([r.filename for r in rows]),
+                    PostHistory.status == "success")
+            .order_by(PostHistory.created_at)
+            .all()
+        ) if rows else []
         post_map = {p.image_filename: p for p in posts}
-
-        results = []
-        for fname in sorted(os.listdir(pub_folder), reverse=True):
-            if Path(fname).suffix.lower() not in ALLOWED_EXTS:
-                continue
-            fp = os.path.join(pub_folder, fname)
-            post = post_map.get(fname)
-            results.append({
-                "path":               fp,
-                "filename":           fname,
-                "thumb_url":          f"/api/images/file?path={fp}",
-                "caption":            post.caption if post else None,
-                "posted_at":          post.created_at.strftime("%Y-%m-%d %H:%M") if post else None,
-                "category":           post.category if post else None,
-                "instagram_post_id":  post.instagram_post_id if post else None,
-            })
-        return results
     finally:
         db.close()
+
+    results = []
+    for row in rows:
+        post = post_map.get(row.filename)
+        results.append({
+            "path":               row.path,
+            "filename":           row.filename,
+            "thumb_url":          thumb_url(row.path, row.mtime),
+            "caption":            post.caption if post else None,
+            "posted_at":          post.created_at.strftime("%Y-%m-%d %H:%M") if post else None,
+            "category":           post.category if post else None,
+            "instagram_post_id":  post.instagram_post_id if post else None,
+        })
+    return {"images": results, "next_cursor": next_cursor}
@@ -1,10 +1,11 @@
 import json
-import io
 import piexif
 from PIL import Image
 
+from . import exif_reader, exif_writer, heic
 
-def read_metadata(filepath: str) -> dict | None:
+
+def _read_metadata_pil(filepath: str) -> dict | None:
     try:
         img = Image.open(filepath)
         exif = img.info.get("exif", b"")
@@ -19,13 +20,73 @@ def read_metadata(filepath: str) -> dict | None:
         return None
 
 
-def write_metadata(filepath: str, metadata: dict):
-    img = Image.open(filepath)
-    json_str = json.dumps(metadata, ensure_ascii=False)
-    exif_dict = {"0th": {piexif.ImageIFD.ImageDescription: json_str.encode("utf-8")}}
-    exif_bytes = piexif.dump(exif_dict)
-    buf = io.BytesIO()
-    img.save(buf, format='JPEG', exif=exif_bytes)
-    buf.seek(0)
-    with open(filepath, 'wb') as f:
-        f.write(buf.read())
+def read_metadata(filepath: str) -> dict | None:
+    if heic.is_heic(filepath):
+        try:
+            filepath = heic.readable(filepath)
+        except Exception:
+            return None
+    return exif_reader.read_json(filepath, fallback=_read_metadata_pil)
+
+
+def _build_exif(old_exif: bytes | None, description: bytes) -> bytes:
+    # 保留原有的 EXIF 欄位（拍攝方向、相機資訊等），只替換 ImageDescription
+    exif_dict = None
+    if old_exif:
+        try:
+            exif_dict = piexif.load(old_exif)
+        except Exception:
+            exif_dict = None
+    if exif_dict:
+        exif_dict["0th"][piexif.ImageIFD.ImageDescription] = description
+        for candidate in (exif_dict, {**exif_dict, "thumbnail": None, "1st": {}}):
+            try:
+                exif_bytes = piexif.dump(candidate)
+            except Exception:
+                continue
+            if len(exif_bytes) <= exif_writer.MAX_SEGMENT:
+                return exif_bytes
+    return piexif.dump({"0th": {piexif.ImageIFD.ImageDescription: description}})
+
+
+class _Unchanged(Exception):
+    pass
+
+
+def _parse_description(old_exif: bytes | None) -> dict | None:
+    if not old_exif:
+        return None
+    try:
+        raw = piexif.load(old_exif).get("0th", {}).get(piexif.ImageIFD.ImageDescription)
+        meta = json.loads(raw.decode("utf-8")) if raw else None
+    except Exception:
+        return None
+    return meta if isinstance(meta, dict) else None
+
+
+def update_metadata(filepath: str, update) -> tuple[dict | None, str | None]:
+    """以 update(舊 metadata 或 None) 的結果改寫 metadata，讀取與寫入在同一次改寫中完成
+
+    回傳 (新 metadata, 新檔案雜湊)；內容沒有變動時不寫檔，雜湊為 None。
+    """
+    if heic.is_heic(filepath):
+        raise ValueError("HEIC 檔案無法寫入 metadata，請先轉成 JPEG")
+    result = {}
+
+    def build(old_exif):
+        old = _parse_description(old_exif)
+        meta = result["meta"] = update(old)
+        if meta == old:
+            raise _Unchanged()
+        return _build_exif(old_exif, json.dumps(meta, ensure_ascii=False).encode("utf-8"))
+
+    try:
+        digest = exif_writer.replace_exif(filepath, build)
+    except _Unchanged:
+        return result["meta"], None
+    return result["meta"], digest
+
+
+def write_metadata(filepath: str, metadata: dict) -> str | None:
+    """整份取代 metadata，回傳新檔案雜湊（內容沒有變動時為 None）"""
+    return update_metadata(filepath, lambda old: metadata)[1]
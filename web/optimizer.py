@@ -0,0 +1,197 @@
+"""上傳前的圖片最佳化：縮到 Instagram 的尺寸上限、依 EXIF 轉正、轉成 sRGB 後重新壓縮
+
+手機原圖動輒 12–50 MP，Instagram 最多只會用到 1440 px 寬，GPT-4o 也不需要原尺寸。
+ImageDescription 裡的 JSON metadata 會原封不動寫回輸出檔。結果以內容雜湊快取在
+upload_cache/，解碼與壓縮在獨立的 process pool 執行，不會卡住事件迴圈。
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import piexif
+from PIL import Image, ImageCms, ImageOps
+
+from . import exif_reader, heic, logstream
+
+CACHE_DIR = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', 'upload_cache'))
+MAX_EDGE = 1440
+QUALITY = 88
+# Instagram 動態貼文接受的長寬比範圍（4:5 ~ 1.91:1）；開啟 UPLOAD_CROP_ASPECT 時超出範圍會置中裁切，限時動態不裁切
+MIN_ASPECT = 4 / 5
+MAX_ASPECT = 1.91
+MAX_CACHE_BYTES = 512 * 1024 * 1024
+POOL_WORKERS = 2
+
+_pool: ProcessPoolExecutor | None = None
+_srgb = None
+
+
+def _settings(cfg: dict, post_type: str = "feed") -> tuple[int, int, bool]:
+    return (
+        int(cfg.get("UPLOAD_MAX_EDGE", MAX_EDGE)),
+        int(cfg.get("UPLOAD_QUALITY", QUALITY)),
+        bool(cfg.get("UPLOAD_CROP_ASPECT", False)) and post_type != "story",
+    )
+
+
+def enabled(cfg: dict) -> bool:
+    return bool(cfg.get("OPTIMIZE_UPLOADS", True))
+
+
+def _sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _variant(max_edge: int, quality: int, crop: bool) -> str:
+    return f"{max_edge}-q{quality}{'-c' if crop else ''}"
+
+
+def cache_path(digest: str, max_edge: int, quality: int, crop: bool) -> str:
+    return os.path.join(CACHE_DIR, digest[:2], f"{digest}-{_variant(max_edge, quality, crop)}.jpg")
+
+
+def upload_key(cfg: dict, digest: str, post_type: str = "feed") -> str:
+    """上傳去重用的鍵：同一張圖在不同設定或貼文類型下產生不同檔案時，各自上傳一次"""
+    if not enabled(cfg):
+        return digest
+    variant = _variant(*_settings(cfg, post_type))
+    return hashlib.sha256(f"{digest}-{variant}".encode()).hexdigest()
+
+
+def _to_srgb(img: Image.Image) -> Image.Image:
+    global _srgb
+    icc = img.info.get("icc_profile")
+    if icc:
+        try:
+            if _srgb is None:
+                _srgb = ImageCms.createProfile("sRGB")
+            src = ImageCms.ImageCmsProfile(io.BytesIO(icc))
+            img = ImageCms.profileToProfile(img, src, _srgb, outputMode="RGB")
+        except (ImageCms.PyCMSError, OSError):
+            pass
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    return img
+
+
+def _crop_aspect(img: Image.Image) -> Image.Image:
+    w, h = img.size
+    if w / h > MAX_ASPECT:
+        new_w = int(h * MAX_ASPECT)
+        left = (w - new_w) // 2
+        return img.crop((left, 0, left + new_w, h))
+    if w / h < MIN_ASPECT:
+        new_h = int(w / MIN_ASPECT)
+        top = (h - new_h) // 2
+        return img.crop((0, top, w, top + new_h))
+    return img
+
+
+def _render(src: str, dest: str, max_edge: int, quality: int, crop: bool):
+    description = None
+    try:
+        description = exif_reader.read_description(src)
+    except exif_reader.UnsupportedFormat:
+        pass
+
+    with Image.open(src) as img:
+        img.draft("RGB", (max_edge, max_edge))
+        img = ImageOps.exif_transpose(img)
+        img = _to_srgb(img)
+        if crop:
+            img = _crop_aspect(img)
+        if max(img.size) > max_edge:
+            img.thumbnail((max_edge, max_edge), Image.LANCZOS, reducing_gap=3.0)
+
+        save_kwargs = {"quality": quality, "optimize": True, "progressive": True, "subsampling": "4:2:0"}
+        if description:
+            # 只保留 metadata JSON；方向已套用，GPS 等其他標籤不需要上傳
+            exif = {"0th": {piexif.ImageIFD.ImageDescription: description}}
+            save_kwargs["exif"] = piexif.dump(exif)
+
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        tmp = f"{dest}.{os.getpid()}.tmp"
+        try:
+            img.save(tmp, "JPEG", **save_kwargs)
+            os.replace(tmp, dest)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+
+
+def _evict():
+    entries, total = [], 0
+    for root, _, files in os.walk(CACHE_DIR):
+        for name in files:
+            fp = os.path.join(root, name)
+            try:
+                st = os.stat(fp)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, fp))
+            total += st.st_size
+    if total <= MAX_CACHE_BYTES:
+        return
+    entries.sort()
+    for _, size, fp in entries:
+        if total <= int(MAX_CACHE_BYTES * 0.9):
+            break
+        try:
+            os.remove(fp)
+            total -= size
+        except OSError:
+            pass
+
+
+def optimize_file(path: str, digest: str | None = None, max_edge: int = MAX_EDGE,
+                  quality: int = QUALITY, crop: bool = False) -> str:
+    """回傳最佳化後的快取檔路徑；已處理過的內容直接重用"""
+    digest = digest or _sha256(path)
+    dest = cache_path(digest, max_edge, quality, crop)
+    if os.path.exists(dest):
+        os.utime(dest)
+        return dest
+    _render(heic.readable(path, digest), dest, max_edge, quality, crop)
+    _evict()
+    return dest
+
+
+def _executor() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=POOL_WORKERS)
+    return _pool
+
+
+async def optimize(cfg: dict, path: str, digest: str, post_type: str = "feed", log=None) -> str:
+    """在 process pool 中最佳化；失敗時退回原檔，不影響發文"""
+    if not enabled(cfg):
+        return await heic.convert(path, digest) if heic.is_heic(path) else path
+    max_edge, quality, crop = _settings(cfg, post_type)
+    dest = cache_path(digest, max_edge, quality, crop)
+    if os.path.exists(dest):
+        os.utime(dest)
+        return dest
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(_executor(), optimize_file, path, digest, max_edge, quality, crop)
+    except Exception as e:
+        (log or logstream.log)(f"⚠️ 圖片最佳化失敗，改上傳原檔：{e}")
+    # HEIC 原檔 Instagram 無法使用，仍要上傳轉好的 JPEG；連轉檔都失敗時直接讓上傳失敗
+    return await heic.convert(path, digest) if heic.is_heic(path) else path
+
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
@@ -0,0 +1,23 @@
+"""感知雜湊（dHash）：內容相近的圖片（連拍、重新輸出、縮放）雜湊的 Hamming 距離也很小"""
+from PIL import Image
+
+
+def dhash_file(path: str) -> str | None:
+    """9x8 灰階縮圖相鄰像素比較亮暗，得到 64 位元雜湊（16 位十六進位）"""
+    try:
+        with Image.open(path) as img:
+            img.draft("L", (144, 128))  # JPEG 直接以低解析度解碼
+            small = img.convert("L").resize((9, 8), Image.Resampling.BOX)
+            px = small.tobytes()
+    except Exception:
+        return None
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            i = row * 9 + col
+            bits = (bits << 1) | (px[i] > px[i + 1])
+    return f"{bits:016x}"
+
+
+def distance(a: str, b: str) -> int:
+    return (int(a, 16) ^ int(b, 16)).bit_count()
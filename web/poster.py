@@ -1,15 +1,13 @@
+import asyncio
 import os
-import random
 import shutil
-from datetime import datetime
+from datetime import datetime, timedelta
 
-import cloudinary
-import cloudinary.uploader
-import openai
-import requests
+from sqlalchemy import func
 
+from . import accounts, caption_cache, catalog, clients, graph, prepared, selection, uploads
 from .config_manager import load_config
-from .database import SessionLocal, PostHistory
+from .database import SessionLocal, PostHistory, PreparedPost
 from .metadata_handler import read_metadata
 
 CATEGORY_PROMPTS = {
@@ -18,154 +16,485 @@ CATEGORY_PROMPTS = {
     "inspirational":"請為這張圖片生成一段勵志的 Instagram 貼文，中英文對照（繁體中文在前，英文在後），並附上適當的標籤。PS:請不要回應辨識到人臉",
     "marketing":    "請為這張圖片生成一段行銷文案的 Instagram 貼文，中英文對照（繁體中文在前，英文在後），並附上適當的標籤。PS:請不要回應辨識到人臉",
 }
+DEFAULT_PROMPT = "請為這張圖片生成 Instagram 貼文。"
+SYSTEM_PROMPT = "你是 Instagram 貼文寫手，中英文對照（繁體中文在前，英文在後）。請不要回應辨識到人臉。"
+CAPTION_MODEL = "gpt-4o"
 
 
 def get_all_images(cfg: dict) -> list[dict]:
-    result = []
-    for category, folder in cfg.get("IMAGE_FOLDERS", {}).items():
-        if not os.path.isdir(folder):
-            continue
-        for fname in sorted(os.listdir(folder)):
-            if not fname.lower().endswith(('.jpg', '.jpeg', '.png')):
-                continue
-            fp = os.path.join(folder, fname)
-            meta = read_metadata(fp)
-            result.append({
-                "path": fp,
-                "filename": fname,
-                "category": category,
-                "has_metadata": meta is not None,
-                "metadata": meta or {},
-            })
-    return result
-
-
-def get_random_image(cfg: dict) -> tuple[str | None, str | None]:
-    available = {}
-    for category, folder in cfg.get("IMAGE_FOLDERS", {}).items():
-        if not os.path.isdir(folder):
-            continue
-        imgs = [f for f in os.listdir(folder) if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
-        if imgs:
-            available[category] = (folder, imgs)
-
-    if not available:
-        return None, None
-
-    category = random.choice(list(available.keys()))
-    folder, imgs = available[category]
-    return os.path.join(folder, random.choice(imgs)), category
-
-
-async def do_post(log=None, post_type: str = "feed"):
+    return catalog.list_images(cfg)
+
+
+def get_random_image(cfg: dict, exclude: set[str] | None = None) -> tuple[str | None, str | None]:
+    return selection.pick(cfg, exclude)
+
+
+def archive_image(image_path: str, pub_folder: str):
+    dest = os.path.join(pub_folder, os.path.basename(image_path))
+    shutil.move(image_path, dest)
+    catalog.relocate(image_path, dest, catalog.PUBLISHED)
+
+
+async def upload_image(cfg: dict, image_path: str, post_type: str = "feed", log=None) -> str:
+    return await uploads.upload(cfg, image_path, post_type, log)
+
+
+async def generate_caption(cfg: dict, image_url: str, category: str, metadata: dict | None,
+                           content_hash: str | None = None, force: bool = False) -> str:
+    template = cfg.get("CATEGORY_PROMPTS", {}).get(category) or CATEGORY_PROMPTS.get(category, DEFAULT_PROMPT)
+    key = None
+    if content_hash:
+        # metadata 寫在圖片 EXIF 中，已包含在內容雜湊裡
+        p_hash = caption_cache.prompt_hash(template, SYSTEM_PROMPT, CAPTION_MODEL)
+        key = caption_cache.make_key(content_hash, category, p_hash)
+        if not force:
+            cached = await asyncio.to_thread(caption_cache.get, cfg, key)
+            if cached:
+                return cached
+
+    prompt = template
+    if metadata:
+        prompt += f"\n\n圖片描述：{metadata.get('description', '')}\n圖片標籤：{metadata.get('tags', [])}"
+
+    client = clients.openai_client(cfg["OPENAI_API_KEY"])
+    ai_resp = await client.chat.completions.create(
+        model=CAPTION_MODEL,
+        messages=[
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": [
+                {"type": "text", "text": prompt},
+                {"type": "image_url", "image_url": {"url": image_url}},
+            ]},
+        ],
+        max_tokens=300,
+    )
+    caption = ai_resp.choices[0].message.content.strip()
+    if key:
+        await asyncio.to_thread(caption_cache.put, cfg, key, content_hash, category, p_hash, CAPTION_MODEL, caption)
+    return caption
+
+
+async def create_container(cfg: dict, image_url: str, caption: str, is_story: bool) -> str:
+    media_data = {"image_url": image_url, "access_token": cfg["ACCESS_TOKEN"]}
+    if is_story:
+        media_data["media_type"] = "STORIES"
+    else:
+        media_data["caption"] = caption
+
+    media_r = await graph.post(cfg, f"{cfg['INSTAGRAM_BUSINESS_ID']}/media", media_data)
+
+    if "id" not in media_r:
+        raise RuntimeError(f"媒體建立失敗：{media_r}")
+    return media_r["id"]
+
+
+async def container_status(cfg: dict, container_id: str) -> str:
+    r = await graph.get(cfg, container_id, {"fields": "status_code", "access_token": cfg["ACCESS_TOKEN"]})
+    return r.get("status_code", "")
+
+
+async def publish_container(cfg: dict, container_id: str) -> str:
+    pub_r = await graph.post(
+        cfg, f"{cfg['INSTAGRAM_BUSINESS_ID']}/media_publish",
+        {"creation_id": container_id, "access_token": cfg["ACCESS_TOKEN"]},
+    )
+
+    if "id" not in pub_r:
+        raise RuntimeError(f"發佈失敗：{pub_r}")
+    return pub_r["id"]
+
+
+POST_CONCURRENCY = 4
+
+_prepare_locks: dict[str, asyncio.Lock] = {}
+_run_locks: dict[str, asyncio.Lock] = {}
+_slots: tuple[int, asyncio.Semaphore] | None = None
+_background: set[asyncio.Task] = set()
+
+
+def _lock(locks: dict[str, asyncio.Lock], account_id: str) -> asyncio.Lock:
+    lock = locks.get(account_id)
+    if lock is None:
+        lock = locks[account_id] = asyncio.Lock()
+    return lock
+
+
+def _worker_slots(cfg: dict) -> asyncio.Semaphore:
+    """所有帳號共用的發文名額，限制同時進行的外部呼叫數量"""
+    global _slots
+    size = max(1, int(cfg.get("POST_CONCURRENCY", POST_CONCURRENCY)))
+    if _slots is None or _slots[0] != size:
+        # 設定變更後改用新的名額；已取得舊名額的工作照常在舊的 semaphore 上釋放
+        _slots = (size, asyncio.Semaphore(size))
+    return _slots[1]
+
+
+def account_config(account_id: str | None = None) -> dict:
+    return accounts.account_config(load_config(), account_id)
+
+
+def _tagged(log, cfg: dict):
+    # 多帳號時在日誌前標示帳號名稱
+    if log is None or cfg["ACCOUNT_ID"] == accounts.DEFAULT_ID:
+        return log
+    return lambda msg: log(f"[{cfg['ACCOUNT_NAME']}] {msg}")
+
+
+async def regenerate_prepared(item_id: int) -> dict | None:
+    """忽略文案快取，重新為待發佈貼文生成文案"""
+    db = SessionLocal()
+    try:
+        item = db.get(PreparedPost, item_id)
+        if item is None or item.status != "ready" or not os.path.isfile(item.image_path):
+            return None
+        cfg = account_config(item.account_id)
+        metadata = await asyncio.to_thread(read_metadata, item.image_path)
+        digest = await asyncio.to_thread(catalog.content_hash, item.image_path)
+        item.caption = await generate_caption(cfg, item.image_url, item.category, metadata, digest, force=True)
+        db.commit()
+        return prepared.to_dict(item)
+    finally:
+        db.close()
+
+
+async def prepare_posts(log=None, account_id: str | None = None) -> int:
+    """預先選圖、上傳、生成文案，補滿 PREPARE_AHEAD 則待發佈貼文"""
+    cfg = account_config(account_id)
+    account_id = cfg["ACCOUNT_ID"]
+    log = _tagged(log, cfg)
+
+    def emit(msg: str):
+        if log:
+            log(msg)
+
+    lock = _lock(_prepare_locks, account_id)
+    if lock.locked():
+        return 0
+    async with lock:
+        ahead = int(cfg.get("PREPARE_AHEAD", 3))
+        db = SessionLocal()
+        created = 0
+        try:
+            while prepared.count_ready(db, account_id) < ahead:
+                exclude = prepared.ready_paths(db) | _active_paths(db)
+                image_path, category = await asyncio.to_thread(get_random_image, cfg, exclude)
+                if not image_path:
+                    break
+                item = PreparedPost(account_id=account_id, image_path=image_path,
+                                    image_filename=os.path.basename(image_path),
+                                    category=category, status="preparing")
+                db.add(item)
+                db.commit()
+                try:
+                    metadata = await asyncio.to_thread(read_metadata, image_path)
+                    digest = await asyncio.to_thread(catalog.content_hash, image_path)
+                    async with _worker_slots(cfg):
+                        item.image_url = await upload_image(cfg, image_path, log=emit)
+                        item.caption = await generate_caption(cfg, item.image_url, category, metadata, digest)
+                except Exception as e:
+                    db.delete(item)
+                    db.commit()
+                    emit(f"⚠️ 預先準備貼文失敗：{e}")
+                    break
+                item.status = "ready"
+                db.commit()
+                created += 1
+                emit(f"📦 已預先準備貼文：{item.image_filename}（{category}）")
+        finally:
+            db.close()
+        return created
+
+
+def refill_in_background(log=None, account_id: str | None = None):
+    task = asyncio.create_task(prepare_posts(log, account_id))
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+
+
+class StageError(Exception):
+    """不可重試的錯誤（例如原始圖片已不存在）"""
+
+
+STAGE_RETRIES = 3
+STAGE_BACKOFF_SECONDS = 2
+MAX_ATTEMPTS = 5
+RETRY_MINUTES = 5
+STAGE_LABELS = {
+    "selected":          "上傳圖片",
+    "uploaded":          "生成文案",
+    "captioned":         "建立媒體容器",
+    "container_created": "發佈",
+    "published":         "封存圖片",
+}
+
+def _emitter(log):
     def emit(msg: str):
         ts = datetime.now().strftime("%H:%M:%S")
         print(f"[{ts}] {msg}")
         if log:
             log(msg)
+    return emit
+
+
+async def _stage_upload(cfg: dict, run: PostHistory, emit, force_caption: bool) -> str:
+    if not os.path.isfile(run.image_path):
+        raise StageError("原始圖片已不存在")
+    emit("☁️ 上傳圖片至 Cloudinary...")
+    run.image_url = await upload_image(cfg, run.image_path, run.post_type, emit)
+    emit("✅ Cloudinary 上傳完成")
+    return "uploaded"
+
+
+async def _stage_caption(cfg: dict, run: PostHistory, emit, force_caption: bool) -> str:
+    if run.post_type == "story":
+        run.caption = ""
+        emit("📖 動態模式，跳過文案生成")
+        return "captioned"
+    metadata = None
+    if os.path.isfile(run.image_path):
+        metadata = await asyncio.to_thread(read_metadata, run.image_path)
+    emit(f"📜 Metadata：{metadata}" if metadata else "⚠️ 沒有 Metadata，繼續...")
+    emit("🤖 GPT-4o 生成文案中...")
+    run.caption = await generate_caption(cfg, run.image_url, run.category, metadata,
+                                         run.content_hash or None, force_caption)
+    emit("📝 文案生成完成")
+    return "captioned"
+
 
-    cfg = load_config()
+def recent_publishes(db, account_id: str | None = None) -> dict[str, tuple[int, datetime]]:
+    """過去 24 小時各帳號成功發文的 (數量, 最早一則時間)"""
+    q = (
+        db.query(PostHistory.account_id, func.count(), func.min(PostHistory.created_at))
+        .filter(PostHistory.status == "success", PostHistory.created_at >= datetime.now() - timedelta(hours=24))
+    )
+    if account_id:
+        q = q.filter(PostHistory.account_id == account_id)
+    return {acc: (count, oldest) for acc, count, oldest in q.group_by(PostHistory.account_id).all()}
+
+
+def _check_publish_quota(cfg: dict):
+    # Instagram 對 API 發文有 24 小時滾動上限，超過時直接排定稍後重試，不浪費呼叫
+    limit = int(cfg.get("PUBLISH_LIMIT_PER_DAY", graph.PUBLISH_LIMIT))
     db = SessionLocal()
-    record = PostHistory(status="failed", image_filename="", category="",
-                         image_url="", caption="", instagram_post_id="")
     try:
-        emit("📸 選取圖片中...")
-        image_path, category = get_random_image(cfg)
-        if not image_path:
-            emit("❌ 所有資料夾都沒有圖片，無法發文！")
-            db.add(record)
-            db.commit()
-            return False
-
-        record.image_filename = os.path.basename(image_path)
-        record.category = category
-        emit(f"📸 選取：{os.path.basename(image_path)}（{category}）")
-
-        metadata = read_metadata(image_path)
-        emit(f"📜 Metadata：{metadata}" if metadata else "⚠️ 沒有 Metadata，繼續...")
-
-        emit("☁️ 上傳圖片至 Cloudinary...")
-        cloudinary.config(
-            cloud_name=cfg["CLOUDINARY_CLOUD_NAME"],
-            api_key=cfg["CLOUDINARY_API_KEY"],
-            api_secret=cfg["CLOUDINARY_API_SECRET"],
-        )
-        resp = cloudinary.uploader.upload(image_path)
-        image_url = resp["secure_url"]
-        record.image_url = image_url
-        emit("✅ Cloudinary 上傳完成")
-
-        is_story = (post_type == "story")
-
-        if not is_story:
-            emit("🤖 GPT-4o 生成文案中...")
-            prompt = CATEGORY_PROMPTS.get(category, "請為這張圖片生成 Instagram 貼文。")
-            if metadata:
-                prompt += f"\n\n圖片描述：{metadata.get('description', '')}\n圖片標籤：{metadata.get('tags', [])}"
-
-            client = openai.OpenAI(api_key=cfg["OPENAI_API_KEY"])
-            ai_resp = client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": "你是 Instagram 貼文寫手，中英文對照（繁體中文在前，英文在後）。請不要回應辨識到人臉。"},
-                    {"role": "user", "content": [
-                        {"type": "text", "text": prompt},
-                        {"type": "image_url", "image_url": {"url": image_url}},
-                    ]},
-                ],
-                max_tokens=300,
-            )
-            caption = ai_resp.choices[0].message.content.strip()
-            record.caption = caption
-            emit("📝 文案生成完成")
-        else:
-            caption = ""
-            emit("📖 動態模式，跳過文案生成")
+        used, oldest = recent_publishes(db, cfg["ACCOUNT_ID"]).get(cfg["ACCOUNT_ID"], (0, None))
+    finally:
+        db.close()
+    if used >= limit:
+        retry = (oldest + timedelta(hours=24) - datetime.now()).total_seconds()
+        raise graph.RateLimited(f"已達 24 小時發文上限（{limit} 則）", retry)
 
-        type_label = "動態（Story）" if is_story else "貼文（Feed）"
-        emit(f"📱 發佈至 Instagram {type_label}...")
 
-        media_data = {"image_url": image_url, "access_token": cfg["ACCESS_TOKEN"]}
-        if is_story:
-            media_data["media_type"] = "STORIES"
-        else:
-            media_data["caption"] = caption
+async def _stage_container(cfg: dict, run: PostHistory, emit, force_caption: bool) -> str:
+    await asyncio.to_thread(_check_publish_quota, cfg)
+    is_story = run.post_type == "story"
+    type_label = "動態（Story）" if is_story else "貼文（Feed）"
+    emit(f"📱 發佈至 Instagram {type_label}...")
+    run.container_id = await create_container(cfg, run.image_url, run.caption, is_story)
+    return "container_created"
 
-        media_r = requests.post(
-            f"https://graph.facebook.com/v18.0/{cfg['INSTAGRAM_BUSINESS_ID']}/media",
-            data=media_data,
-        ).json()
 
-        if "id" not in media_r:
-            raise RuntimeError(f"媒體建立失敗：{media_r}")
+async def _stage_publish(cfg: dict, run: PostHistory, emit, force_caption: bool) -> str:
+    # 先查詢容器狀態：前一次發佈請求可能已成功但沒收到回應，避免重複發文
+    status = await container_status(cfg, run.container_id)
+    if status == "PUBLISHED":
+        emit("⚠️ 此媒體容器已發佈過，略過重複發佈")
+    elif status in ("EXPIRED", "ERROR"):
+        emit(f"⚠️ 媒體容器狀態為 {status}，重新建立")
+        run.container_id = ""
+        return "captioned"
+    else:
+        run.instagram_post_id = await publish_container(cfg, run.container_id)
+    run.status = "success"
+    await asyncio.to_thread(uploads.mark_published, run.image_url)
+    return "published"
 
-        pub_r = requests.post(
-            f"https://graph.facebook.com/v18.0/{cfg['INSTAGRAM_BUSINESS_ID']}/media_publish",
-            data={"creation_id": media_r["id"], "access_token": cfg["ACCESS_TOKEN"]},
-        ).json()
 
-        if "id" not in pub_r:
-            raise RuntimeError(f"發佈失敗：{pub_r}")
+async def _stage_archive(cfg: dict, run: PostHistory, emit, force_caption: bool) -> str:
+    pub_folder = cfg.get("PUBLISHED_FOLDER", "")
+    if pub_folder and os.path.isdir(pub_folder) and os.path.isfile(run.image_path):
+        await asyncio.to_thread(archive_image, run.image_path, pub_folder)
+        emit("📁 圖片已移至已發佈資料夾")
+    return "archived"
 
-        record.instagram_post_id = pub_r["id"]
-        record.status = "success"
 
-        pub_folder = cfg.get("PUBLISHED_FOLDER", "")
-        if pub_folder and os.path.isdir(pub_folder):
-            shutil.move(image_path, os.path.join(pub_folder, os.path.basename(image_path)))
-            emit("📁 圖片已移至已發佈資料夾")
+STAGE_HANDLERS = {
+    "selected":          _stage_upload,
+    "uploaded":          _stage_caption,
+    "captioned":         _stage_container,
+    "container_created": _stage_publish,
+    "published":         _stage_archive,
+}
 
-        db.add(record)
-        db.commit()
-        emit(f"✅ 發文成功！Post ID：{pub_r['id']}")
-        return True
 
-    except Exception as e:
-        record.error_message = str(e)
-        record.status = "failed"
-        db.add(record)
+async def _run_stage(cfg: dict, run: PostHistory, emit, force_caption: bool) -> str:
+    handler = STAGE_HANDLERS[run.stage]
+    delay = STAGE_BACKOFF_SECONDS
+    for attempt in range(1, STAGE_RETRIES + 1):
+        try:
+            return await handler(cfg, run, emit, force_caption)
+        except (StageError, graph.RateLimited):
+            raise
+        except Exception as e:
+            if attempt == STAGE_RETRIES:
+                raise
+            emit(f"⚠️ {STAGE_LABELS[run.stage]}失敗（第 {attempt} 次）：{e}，{delay} 秒後重試")
+            await asyncio.sleep(delay)
+            delay *= 2
+
+
+async def _advance(cfg: dict, db, run: PostHistory, emit, force_caption: bool = False) -> bool:
+    """從最後完成的階段繼續執行，每個階段完成就寫入資料庫"""
+    try:
+        while run.stage != "archived":
+            run.stage = await _run_stage(cfg, run, emit, force_caption)
+            db.commit()
+    except graph.RateLimited as e:
+        # 被限流不算失敗次數，等額度恢復後從同一階段繼續
+        run.error_message = str(e)
+        run.next_attempt_at = datetime.now() + timedelta(seconds=max(e.retry_after, 60))
+        emit(f"⏳ {e}，{run.next_attempt_at:%H:%M} 後從「{STAGE_LABELS[run.stage]}」繼續")
         db.commit()
-        emit(f"❌ 發文失敗：{e}")
         return False
+    except Exception as e:
+        run.error_message = str(e)
+        run.attempts = (run.attempts or 0) + 1
+        max_attempts = int(cfg.get("POST_MAX_ATTEMPTS", MAX_ATTEMPTS))
+        if run.status == "success":
+            emit(f"⚠️ 已發文，但{STAGE_LABELS[run.stage]}失敗：{e}")
+            run.stage = "archived"
+        elif isinstance(e, StageError) or run.attempts >= max_attempts:
+            run.status = "failed"
+            run.next_attempt_at = None
+            if run.prepared_id:
+                prepared.discard_claimed(db, run.prepared_id, str(e))
+            emit(f"❌ 發文失敗：{e}")
+        else:
+            wait = RETRY_MINUTES * 2 ** (run.attempts - 1)
+            run.next_attempt_at = datetime.now() + timedelta(minutes=wait)
+            emit(f"❌ 發文失敗：{e}（第 {run.attempts} 次，{wait} 分鐘後從「{STAGE_LABELS[run.stage]}」繼續）")
+        db.commit()
+        return run.status == "success"
+
+    run.error_message = None
+    run.next_attempt_at = None
+    if run.prepared_id:
+        prepared.finish_claimed(db, run.prepared_id)
+    db.commit()
+    emit(f"✅ 發文成功！Post ID：{run.instagram_post_id or '（未知）'}")
+    return True
+
+
+async def _new_run(cfg: dict, db, post_type: str, force_caption: bool, emit) -> PostHistory | None:
+    run = PostHistory(account_id=cfg["ACCOUNT_ID"], status="pending", post_type=post_type,
+                      image_filename="", category="", image_url="", caption="",
+                      instagram_post_id="", attempts=0)
+    item = None
+    if post_type != "story" and not force_caption:
+        item = prepared.claim_next(db, cfg["ACCOUNT_ID"])
+
+    if item:
+        run.image_path = item.image_path
+        run.image_filename = item.image_filename
+        run.category = item.category
+        run.image_url = item.image_url
+        run.caption = item.caption
+        run.prepared_id = item.id
+        run.content_hash = await asyncio.to_thread(catalog.content_hash, item.image_path)
+        run.stage = "captioned"
+        emit(f"📦 使用預先準備的貼文：{item.image_filename}（{item.category}）")
+    else:
+        emit("📸 選取圖片中...")
+        image_path, category = await asyncio.to_thread(get_random_image, cfg, prepared.ready_paths(db) | _active_paths(db))
+        if not image_path:
+            run.status = "failed"
+            run.error_message = "所有資料夾都沒有圖片"
+            db.add(run)
+            db.commit()
+            emit("❌ 所有資料夾都沒有圖片，無法發文！")
+            return None
+        run.image_path = image_path
+        run.image_filename = os.path.basename(image_path)
+        run.category = category
+        run.content_hash = await asyncio.to_thread(catalog.content_hash, image_path)
+        run.stage = "selected"
+        emit(f"📸 選取：{run.image_filename}（{category}）")
+
+    db.add(run)
+    db.commit()
+    return run
+
+
+def _active_paths(db) -> set[str]:
+    rows = db.query(PostHistory.image_path).filter(PostHistory.status == "pending").all()
+    return {r[0] for r in rows if r[0]}
+
+
+def _pending_runs(db, account_id: str | None = None, due_only: bool = False,
+                  post_type: str | None = None) -> list[PostHistory]:
+    q = db.query(PostHistory).filter(PostHistory.status == "pending")
+    if account_id:
+        q = q.filter(PostHistory.account_id == account_id)
+    if post_type:
+        q = q.filter(PostHistory.post_type == post_type)
+    if due_only:
+        q = q.filter((PostHistory.next_attempt_at.is_(None)) | (PostHistory.next_attempt_at <= datetime.now()))
+    return q.order_by(PostHistory.id).all()
+
+
+async def resume_account(account_id: str, log=None) -> int:
+    try:
+        cfg = account_config(account_id)
+    except KeyError:
+        return 0
+    emit = _emitter(_tagged(log, cfg))
+    lock = _lock(_run_locks, account_id)
+    if lock.locked():
+        return 0
+    resumed = 0
+    async with lock, _worker_slots(cfg):
+        db = SessionLocal()
+        try:
+            for run in _pending_runs(db, account_id, due_only=True):
+                emit(f"🔁 繼續未完成的發文：{run.image_filename}（階段：{run.stage}）")
+                await _advance(cfg, db, run, emit)
+                resumed += 1
+        finally:
+            db.close()
+    return resumed
+
+
+def pending_accounts() -> set[str]:
+    """有到期未完成發文的帳號"""
+    db = SessionLocal()
+    try:
+        return {r.account_id for r in _pending_runs(db, due_only=True)}
     finally:
         db.close()
+
+
+async def do_post(log=None, post_type: str = "feed", force_caption: bool = False,
+                  account_id: str | None = None) -> str:
+    """回傳發文紀錄的狀態：success / pending（稍後由續傳排程從中斷的階段繼續）/ failed"""
+    cfg = account_config(account_id)
+    account_id = cfg["ACCOUNT_ID"]
+    emit = _emitter(_tagged(log, cfg))
+    # 同一帳號一次只跑一則發文；不同帳號共用 worker 名額並行
+    async with _lock(_run_locks, account_id), _worker_slots(cfg):
+        db = SessionLocal()
+        try:
+            pending = _pending_runs(db, account_id, post_type=post_type)
+            if pending:
+                run = pending[0]
+                emit(f"🔁 繼續未完成的發文：{run.image_filename}（階段：{run.stage}）")
+            else:
+                run = await _new_run(cfg, db, post_type, force_caption, emit)
+                if run is None:
+                    return "failed"
+            await _advance(cfg, db, run, emit, force_caption)
+            status = run.status
+        finally:
+            db.close()
+    if status == "success" and post_type != "story":
+        refill_in_background(log, account_id)
+    return status
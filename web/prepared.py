@@ -0,0 +1,134 @@
+import os
+
+from .database import SessionLocal, PostHistory, PreparedPost
+
+
+def recover():
+    """程序重啟時清掉準備到一半的項目，並依發文紀錄處理發佈到一半的項目
+
+    發文紀錄仍在進行中（pending）的項目保留，由續傳流程完成後再更新狀態；
+    沒有對應紀錄（取出後、建立紀錄前就中斷）的項目放回 ready。
+    """
+    db = SessionLocal()
+    try:
+        db.query(PreparedPost).filter(PreparedPost.status == "preparing").delete()
+        for item in db.query(PreparedPost).filter(PreparedPost.status == "publishing").all():
+            run = (
+                db.query(PostHistory)
+                .filter(PostHistory.prepared_id == item.id)
+                .order_by(PostHistory.id.desc())
+                .first()
+            )
+            if run is None:
+                item.status = "ready"
+            elif run.status == "success":
+                item.status = "published"
+                item.error_message = None
+            elif run.status == "failed":
+                item.status = "discarded"
+                item.error_message = run.error_message
+        db.commit()
+    finally:
+        db.close()
+
+
+def to_dict(item: PreparedPost) -> dict:
+    return {
+        "id":             item.id,
+        "account_id":     item.account_id,
+        "created_at":     item.created_at.strftime("%Y-%m-%d %H:%M"),
+        "image_path":     item.image_path,
+        "image_filename": item.image_filename,
+        "category":       item.category,
+        "image_url":      item.image_url,
+        "caption":        item.caption,
+        "status":         item.status,
+        "error_message":  item.error_message,
+    }
+
+
+def ready_paths(db) -> set[str]:
+    rows = db.query(PreparedPost.image_path).filter(
+        PreparedPost.status.in_(("preparing", "ready", "publishing"))).all()
+    return {r[0] for r in rows}
+
+
+def count_ready(db, account_id: str) -> int:
+    return db.query(PreparedPost).filter(PreparedPost.status == "ready",
+                                         PreparedPost.account_id == account_id).count()
+
+
+def claim_next(db, account_id: str) -> PreparedPost | None:
+    """取出最早準備好的貼文；原圖已被移走的項目直接作廢"""
+    while True:
+        item = (
+            db.query(PreparedPost)
+            .filter(PreparedPost.status == "ready", PreparedPost.account_id == account_id)
+            .order_by(PreparedPost.id)
+            .first()
+        )
+        if item is None:
+            return None
+        if not os.path.isfile(item.image_path):
+            item.status = "discarded"
+            item.error_message = "原始圖片已不存在"
+            db.commit()
+            continue
+        item.status = "publishing"
+        item.attempts = (item.attempts or 0) + 1
+        db.commit()
+        return item
+
+
+def finish_claimed(db, item_id: int):
+    item = db.get(PreparedPost, item_id)
+    if item is not None:
+        item.status = "published"
+        item.error_message = None
+
+
+def discard_claimed(db, item_id: int, error: str):
+    item = db.get(PreparedPost, item_id)
+    if item is not None:
+        item.status = "discarded"
+        item.error_message = error
+
+
+def list_items(include_done: bool = False, account_id: str | None = None) -> list[dict]:
+    db = SessionLocal()
+    try:
+        q = db.query(PreparedPost)
+        if account_id:
+            q = q.filter(PreparedPost.account_id == account_id)
+        if not include_done:
+            q = q.filter(PreparedPost.status.in_(("preparing", "ready", "publishing")))
+        return [to_dict(item) for item in q.order_by(PreparedPost.id).all()]
+    finally:
+        db.close()
+
+
+def update(item_id: int, caption: str) -> dict | None:
+    db = SessionLocal()
+    try:
+        item = db.get(PreparedPost, item_id)
+        if item is None or item.status != "ready":
+            return None
+        item.caption = caption
+        db.commit()
+        return to_dict(item)
+    finally:
+        db.close()
+
+
+def discard(item_id: int) -> str | None:
+    """作廢待發佈貼文，回傳其所屬帳號（找不到時回傳 None）"""
+    db = SessionLocal()
+    try:
+        item = db.get(PreparedPost, item_id)
+        if item is None or item.status != "ready":
+            return None
+        item.status = "discarded"
+        db.commit()
+        return item.account_id
+    finally:
+        db.close()
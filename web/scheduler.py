@@ -1,85 +1,223 @@
-from collections import deque
+import asyncio
 from datetime import datetime, timedelta
 
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
 
-from .config_manager import load_config
+from . import config_manager
+from .config_manager import load_config, save_config
 from .database import SessionLocal, PostHistory
-from .poster import do_post
+from . import accounts, jobs, logstream, prepared, uploads
+from .poster import POST_CONCURRENCY, do_post, pending_accounts, prepare_posts, resume_account
 
 scheduler = AsyncIOScheduler(timezone="Asia/Taipei")
-log_buffer: deque[str] = deque(maxlen=300)
-_posting = False
+_loop: asyncio.AbstractEventLoop | None = None
+RESUME_INTERVAL_MINUTES = 5
+SCHEDULE_KEYS = ("POST_TIME", "PREPARE_INTERVAL_MINUTES", "WAIT_DAYS", "ACCOUNTS")
 
 
 def add_log(msg: str):
-    ts = datetime.now().strftime("%H:%M:%S")
-    log_buffer.append(f"[{ts}] {msg}")
+    logstream.log(msg)
 
 
-async def scheduled_job():
-    global _posting
-    if _posting:
-        add_log("⚠️ 上一次發文仍在進行中，跳過本次排程")
-        return
+def account_log(acc: dict):
+    if acc["ACCOUNT_ID"] == accounts.DEFAULT_ID:
+        return add_log
+    return lambda msg: add_log(f"[{acc['ACCOUNT_NAME']}] {msg}")
 
-    cfg = load_config()
-    wait_days = max(int(cfg.get("WAIT_DAYS", 1)), 1)
+
+def enqueue_post(account_id: str, source: str, post_type: str = "feed",
+                 force_caption: bool = False) -> tuple[dict, bool]:
+    """所有發文（排程、手動、POST_NOW）都經由任務佇列執行"""
+    return jobs.enqueue("post", account_id, {"post_type": post_type, "force_caption": force_caption},
+                        source=source)
+
+
+async def scheduled_job(account_id: str = accounts.DEFAULT_ID):
+    try:
+        acc = accounts.account_config(load_config(), account_id)
+    except KeyError:
+        return
+    log = account_log(acc)
+    wait_days = max(int(acc.get("WAIT_DAYS", 1)), 1)
 
     db = SessionLocal()
     try:
         last = (
             db.query(PostHistory)
-            .filter(PostHistory.status == "success")
+            .filter(PostHistory.account_id == account_id, PostHistory.status == "success")
             .order_by(PostHistory.created_at.desc())
             .first()
         )
         if last and (datetime.now() - last.created_at) < timedelta(days=wait_days):
-            add_log(f"⏭️ 距離上次發文不足 {wait_days} 天，跳過")
+            log(f"⏭️ 距離上次發文不足 {wait_days} 天，跳過")
             return
     finally:
         db.close()
 
-    _posting = True
-    add_log("⏰ 排程觸發，開始發文流程...")
+    job, created = enqueue_post(account_id, "schedule")
+    if created:
+        log(f"⏰ 排程觸發，發文任務 #{job['id']} 已排入佇列")
+    else:
+        log(f"⚠️ 發文任務 #{job['id']} 仍在佇列中或執行中，跳過本次排程")
+
+
+async def run_post(job: dict):
     try:
-        await do_post(log=add_log)
-    finally:
-        _posting = False
+        acc = accounts.account_config(load_config(), job["account_id"])
+    except KeyError as e:
+        raise jobs.PermanentError(str(e.args[0]))
+    payload = job["payload"]
+    if job["source"] != "schedule":
+        label = "動態（Story）" if payload.get("post_type") == "story" else "貼文（Feed）"
+        account_log(acc)(f"📢 手動觸發：{label}")
+    # 暫時性的失敗或限流時發文紀錄仍是 pending，由續傳排程從中斷的階段繼續，任務本身算完成；
+    # 發文確定失敗才讓任務進入 dead，只有非預期的例外才讓任務重試
+    status = await do_post(log=add_log, post_type=payload.get("post_type", "feed"),
+                           force_caption=bool(payload.get("force_caption")), account_id=acc["ACCOUNT_ID"])
+    if status == "failed":
+        raise jobs.PermanentError("發文失敗，詳見日誌")
+
+
+async def run_resume(job: dict):
+    await resume_account(job["account_id"], add_log)
+
+
+async def prepare_job(account_id: str = accounts.DEFAULT_ID):
+    try:
+        await prepare_posts(log=add_log, account_id=account_id)
+    except KeyError:
+        pass
 
 
-def get_next_run() -> str | None:
-    job = scheduler.get_job("main_post")
-    if job and job.next_run_time:
-        return job.next_run_time.strftime("%Y-%m-%d %H:%M")
-    return None
+async def resume_job():
+    """到期的未完成發文以任務形式排入，與其他發文任務一樣由 worker 依帳號序列化執行"""
+    try:
+        for account_id in pending_accounts():
+            jobs.enqueue("resume", account_id, source="resume", max_attempts=1)
+    except Exception as e:
+        add_log(f"⚠️ 繼續未完成發文失敗：{e}")
+
+
+async def sweep_job():
+    try:
+        await uploads.sweep(load_config(), log=add_log)
+        jobs.purge()
+    except Exception as e:
+        add_log(f"⚠️ Cloudinary 清理失敗：{e}")
+
+
+def _apply_config(new: dict, old: dict):
+    if any(new.get(k) != old.get(k) for k in SCHEDULE_KEYS):
+        update_schedule()
+    targets = _post_now_targets(new)
+    if targets:
+        save_config(new)
+        for account_id in targets:
+            add_log(f"📢 POST_NOW 設為 YES，立即發文（{account_id}）")
+            enqueue_post(account_id, "post_now")
+
+
+def _post_now_targets(cfg: dict) -> list[str]:
+    """取出 POST_NOW 為 YES 的帳號並重設為 NO；最外層的 POST_NOW 只觸發第一個帳號，
+    各帳號可在 ACCOUNTS 內各自設定 POST_NOW"""
+    targets = []
+    if cfg.get("POST_NOW") == "YES":
+        cfg["POST_NOW"] = "NO"
+        enabled = accounts.list_accounts(cfg)
+        if enabled:
+            targets.append(enabled[0]["ACCOUNT_ID"])
+    for entry in cfg.get("ACCOUNTS") or []:
+        if entry.get("POST_NOW") == "YES":
+            entry["POST_NOW"] = "NO"
+            if entry.get("ENABLED", True) is not False:
+                targets.append(str(entry["id"]))
+    return list(dict.fromkeys(targets))
+
+
+def _on_config_change(new: dict, old: dict):
+    # 監看執行緒與 API 都可能觸發，一律交回事件迴圈處理
+    if _loop is not None and not _loop.is_closed():
+        _loop.call_soon_threadsafe(_apply_config, new, old)
+
+
+def _job_id(kind: str, account_id: str) -> str:
+    return kind if account_id == accounts.DEFAULT_ID else f"{kind}:{account_id}"
+
+
+def get_next_run(account_id: str | None = None) -> str | None:
+    """指定帳號的下一次排程；未指定時回傳所有帳號中最早的一個"""
+    if account_id is not None:
+        jobs = [scheduler.get_job(_job_id("main_post", account_id))]
+    else:
+        jobs = [j for j in scheduler.get_jobs() if j.id.split(":")[0] == "main_post"]
+    times = [j.next_run_time for j in jobs if j and j.next_run_time]
+    return min(times).strftime("%Y-%m-%d %H:%M") if times else None
 
 
 def update_schedule():
     cfg = load_config()
-    post_time = cfg.get("POST_TIME", "17:00")
-    hour, minute = post_time.split(":")
-
-    if scheduler.get_job("main_post"):
-        scheduler.remove_job("main_post")
+    wanted = set()
+    for acc in accounts.list_accounts(cfg):
+        account_id = acc["ACCOUNT_ID"]
+        post_time = acc.get("POST_TIME", "17:00")
+        hour, minute = post_time.split(":")
+        main_id, prepare_id = _job_id("main_post", account_id), _job_id("prepare_posts", account_id)
+        wanted.update((main_id, prepare_id))
+
+        scheduler.add_job(
+            scheduled_job,
+            CronTrigger(hour=int(hour), minute=int(minute), timezone="Asia/Taipei"),
+            args=[account_id],
+            id=main_id,
+            replace_existing=True,
+        )
+        account_log(acc)(f"📅 排程已更新：每天 {post_time} 自動檢查並發文")
+
+        scheduler.add_job(
+            prepare_job,
+            IntervalTrigger(minutes=int(acc.get("PREPARE_INTERVAL_MINUTES", 30)), timezone="Asia/Taipei"),
+            args=[account_id],
+            id=prepare_id,
+            next_run_time=datetime.now(scheduler.timezone),
+            replace_existing=True,
+        )
 
-    scheduler.add_job(
-        scheduled_job,
-        CronTrigger(hour=int(hour), minute=int(minute), timezone="Asia/Taipei"),
-        id="main_post",
-        replace_existing=True,
-    )
-    add_log(f"📅 排程已更新：每天 {post_time} 自動檢查並發文")
+    # 已移除或停用的帳號不再排程
+    for job in scheduler.get_jobs():
+        if job.id.split(":")[0] in ("main_post", "prepare_posts") and job.id not in wanted:
+            job.remove()
 
 
 def start():
+    global _loop
+    if _loop is None:
+        config_manager.subscribe(_on_config_change)
+    _loop = asyncio.get_running_loop()
+    prepared.recover()
     update_schedule()
+    scheduler.add_job(
+        sweep_job,
+        CronTrigger(hour=3, minute=30, timezone="Asia/Taipei"),
+        id="sweep_uploads",
+        replace_existing=True,
+    )
+    scheduler.add_job(
+        resume_job,
+        IntervalTrigger(minutes=RESUME_INTERVAL_MINUTES, timezone="Asia/Taipei"),
+        id="resume_posts",
+        next_run_time=datetime.now(scheduler.timezone),
+        replace_existing=True,
+    )
+    jobs.start({"post": run_post, "resume": run_resume},
+               concurrency=int(load_config().get("POST_CONCURRENCY", POST_CONCURRENCY)), log=add_log)
     if not scheduler.running:
         scheduler.start()
     add_log("🚀 InstaPoetBot 已啟動，排程器運行中")
 
 
-def stop():
+async def stop():
     if scheduler.running:
         scheduler.shutdown(wait=False)
+    await jobs.stop()
@@ -0,0 +1,195 @@
+"""發文圖片選取：先依策略排出分類順序，再從記憶體中的圖片池抽一張
+
+策略（SELECTION_STRATEGY）：
+- random：各分類等機率（預設，與舊版相同）
+- weighted：依 CATEGORY_WEIGHTS 加權，未設定的分類權重為 1，權重 0 的分類不會被選到
+- round_robin：依 IMAGE_FOLDERS 的順序輪流
+- least_recent：最久沒有發文的分類優先
+
+REPEAT_AVOID_DAYS 天內發過（或正在發）的圖片以內容雜湊判斷，不會再被選到；
+與這些圖片或待發佈圖片近似（感知雜湊距離在 NEAR_DUP_DISTANCE 內）的圖片也會跳過。
+圖片池由 catalog 的異動通知增量維護，抽選不需掃描資料夾；SELECTION_SEED 可固定亂數以便測試。
+"""
+import os
+import random
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+
+from . import catalog, similarity
+from .database import SessionLocal, ImageCatalog, PostHistory, PreparedPost
+from .strategies import order_categories
+
+SAMPLE_TRIES = 8
+
+
+class _Bucket:
+    """單一資料夾的圖片；以 list + 索引表支援 O(1) 新增、移除與隨機抽樣"""
+
+    def __init__(self):
+        self.paths: list[str] = []
+        self.pos: dict[str, int] = {}
+        self.hashes: dict[str, str] = {}
+
+    def add(self, path: str, digest: str):
+        if path not in self.pos:
+            self.pos[path] = len(self.paths)
+            self.paths.append(path)
+        self.hashes[path] = digest or ""
+
+    def discard(self, path: str):
+        i = self.pos.pop(path, None)
+        if i is None:
+            return
+        last = self.paths.pop()
+        if last != path:
+            self.paths[i] = last
+            self.pos[last] = i
+        self.hashes.pop(path, None)
+
+    def sample(self, rng: random.Random, reject) -> str | None:
+        if not self.paths:
+            return None
+        for _ in range(SAMPLE_TRIES):
+            path = self.paths[rng.randrange(len(self.paths))]
+            if not reject(path, self.hashes[path]):
+                return path
+        # 大部分圖片都被排除時才退回逐一篩選
+        eligible = [p for p in self.paths if not reject(p, self.hashes[p])]
+        return rng.choice(eligible) if eligible else None
+
+
+class Pool:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets: dict[str, _Bucket] = {}
+
+    def _bucket(self, folder: str) -> _Bucket:
+        bucket = self._buckets.get(folder)
+        if bucket is None:
+            bucket = self._buckets[folder] = _Bucket()
+            db = SessionLocal()
+            try:
+                rows = (
+                    db.query(ImageCatalog.path, ImageCatalog.content_hash)
+                    .filter(ImageCatalog.folder == folder)
+                    .order_by(ImageCatalog.path)
+                    .all()
+                )
+            finally:
+                db.close()
+            for path, digest in rows:
+                bucket.add(path, digest)
+        return bucket
+
+    def apply(self, path: str, digest: str | None, dhash: str | None = None):
+        """catalog 異動通知；尚未載入的資料夾等第一次抽選時再從索引讀取"""
+        with self._lock:
+            bucket = self._buckets.get(os.path.dirname(path))
+            if bucket is None:
+                return
+            if digest is None:
+                bucket.discard(path)
+            else:
+                bucket.add(path, digest)
+
+    def draw(self, folder: str, rng: random.Random, reject) -> str | None:
+        with self._lock:
+            return self._bucket(folder).sample(rng, reject)
+
+    def size(self, folder: str) -> int:
+        with self._lock:
+            return len(self._bucket(folder).paths)
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+_pool = Pool()
+catalog.subscribe(_pool.apply)
+_rng = random.Random()
+_seeded = None
+
+
+def seed(value):
+    """固定亂數種子，讓選圖結果可重現"""
+    global _seeded
+    _rng.seed(value)
+    _seeded = value
+
+
+def _history(cfg: dict, avoid_days: int) -> tuple[dict[str, datetime], set[str], set[str]]:
+    """回傳 (各分類最後發文時間, 近期發過的雜湊, 近期發過的檔名)"""
+    account_id = cfg.get("ACCOUNT_ID", "default")
+    db = SessionLocal()
+    try:
+        last_posted = dict(
+            db.query(PostHistory.category, func.max(PostHistory.created_at))
+            .filter(PostHistory.account_id == account_id, PostHistory.status.in_(("success", "pending")))
+            .group_by(PostHistory.category)
+            .all()
+        )
+        # 已準備好、即將發出的貼文也算在內，避免預先準備時連續選到同一分類
+        queued = (
+            db.query(PreparedPost.category, func.max(PreparedPost.created_at))
+            .filter(PreparedPost.account_id == account_id,
+                    PreparedPost.status.in_(("preparing", "ready", "publishing")))
+            .group_by(PreparedPost.category)
+            .all()
+        )
+        for category, created in queued:
+            last_posted[category] = max(created, last_posted.get(category) or created)
+
+        hashes, names = set(), set()
+        if avoid_days > 0:
+            rows = (
+                db.query(PostHistory.content_hash, PostHistory.image_filename)
+                .filter(PostHistory.account_id == account_id,
+                        PostHistory.status.in_(("success", "pending")),
+                        PostHistory.created_at >= datetime.now() - timedelta(days=avoid_days))
+                .all()
+            )
+            for digest, name in rows:
+                if digest:
+                    hashes.add(digest)
+                elif name:  # 分階段流程之前的紀錄沒有雜湊，以檔名判斷
+                    names.add(name)
+    finally:
+        db.close()
+    return last_posted, hashes, names
+
+
+def pick(cfg: dict, exclude: set[str] | None = None) -> tuple[str | None, str | None]:
+    if cfg.get("SELECTION_SEED") is not None and cfg["SELECTION_SEED"] != _seeded:
+        seed(cfg["SELECTION_SEED"])
+    folders = catalog.category_folders(cfg)
+    exclude = exclude or set()
+    strategy = cfg.get("SELECTION_STRATEGY", "random")
+    avoid_days = int(cfg.get("REPEAT_AVOID_DAYS", 0))
+
+    # 平常直接從圖片池抽選；抽到已不存在的檔案（索引落後於檔案系統）或索引還是空的，才重新掃描一次
+    for attempt in range(2):
+        if attempt:
+            catalog.scan(cfg, force=True)
+        last_posted, hashes, names = _history(cfg, avoid_days)
+        near = similarity.near_paths(cfg, paths=exclude, content_hashes=hashes)
+        missing = False
+
+        def reject(path: str, digest: str) -> bool:
+            return (path in exclude or path in near or digest in hashes
+                    or os.path.basename(path) in names)
+
+        for category in order_categories(strategy, list(folders), cfg.get("CATEGORY_WEIGHTS"), last_posted, _rng):
+            while True:
+                path = _pool.draw(folders[category], _rng, reject)
+                if path is None:
+                    break
+                if os.path.isfile(path):
+                    return path, category
+                _pool.apply(path, None)
+                missing = True
+        if not missing and any(_pool.size(folder) for folder in folders.values()):
+            break
+    return None, None
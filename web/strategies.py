@@ -0,0 +1,40 @@
+"""選圖策略：決定各分類的嘗試順序
+
+只依賴標準函式庫，舊版腳本（InstaPoetBot.py）可以直接匯入，不需要安裝資料庫相關套件。
+"""
+from __future__ import annotations
+
+import random
+from datetime import datetime
+
+STRATEGIES = ("random", "weighted", "round_robin", "least_recent")
+
+
+def order_categories(strategy: str, categories: list[str], weights: dict | None = None,
+                     last_posted: dict | None = None, rng: random.Random | None = None) -> list[str]:
+    """依策略排出要嘗試的分類順序；前面的分類沒有可用圖片時依序往後找"""
+    rng = rng or random.Random()
+    weights = weights or {}
+    last_posted = last_posted or {}
+    if strategy not in STRATEGIES:
+        raise ValueError(f"未知的選圖策略：{strategy}")
+
+    if strategy == "weighted":
+        # Efraimidis–Spirakis：依 u^(1/w) 排序等同於依權重不放回抽樣
+        keyed = [(rng.random() ** (1 / float(weights.get(c, 1))), c)
+                 for c in categories if float(weights.get(c, 1)) > 0]
+        return [c for _, c in sorted(keyed, reverse=True)]
+
+    if strategy == "round_robin":
+        posted = [c for c in categories if c in last_posted]
+        if not posted:
+            return list(categories)
+        latest = max(posted, key=lambda c: last_posted[c])
+        i = categories.index(latest) + 1
+        return categories[i:] + categories[:i]
+
+    order = list(categories)
+    rng.shuffle(order)
+    if strategy == "least_recent":
+        order.sort(key=lambda c: last_posted.get(c, datetime.min))
+    return order
@@ -0,0 +1,159 @@
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageOps
+
+from . import heic
+
+CACHE_DIR = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', 'thumb_cache'))
+SIZES = (240, 480, 960)
+DEFAULT_SIZE = 480
+FORMATS = {
+    "webp": ("WEBP", "image/webp", ".webp"),
+    "jpeg": ("JPEG", "image/jpeg", ".jpg"),
+}
+DEFAULT_FORMAT = "webp"
+MAX_CACHE_BYTES = 256 * 1024 * 1024
+
+_lock = threading.Lock()
+_cache_bytes: int | None = None
+_max_bytes = MAX_CACHE_BYTES
+_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="thumb")
+
+
+def configure(cfg: dict):
+    global _max_bytes
+    _max_bytes = int(cfg.get("THUMB_CACHE_MB", MAX_CACHE_BYTES // (1024 * 1024))) * 1024 * 1024
+
+
+def _source_dir(path: str) -> str:
+    digest = hashlib.sha1(os.path.abspath(path).encode("utf-8")).hexdigest()
+    return os.path.join(CACHE_DIR, digest[:2], digest[2:18])
+
+
+def normalize(size: int, fmt: str) -> tuple[int, str]:
+    if size not in SIZES:
+        size = min(SIZES, key=lambda s: abs(s - size))
+    if fmt not in FORMATS:
+        fmt = DEFAULT_FORMAT
+    return size, fmt
+
+
+def _stamp(st: os.stat_result) -> str:
+    return f"{st.st_mtime_ns:x}-{st.st_size:x}"
+
+
+def etag_for(path: str, size: int, fmt: str) -> str:
+    size, fmt = normalize(size, fmt)
+    return f'"{_stamp(os.stat(path))}-{size}-{fmt}"'
+
+
+def _render(src: str, dest: str, size: int, fmt: str):
+    pil_format = FORMATS[fmt][0]
+    with Image.open(heic.readable(src)) as img:
+        # JPEG 以 DCT 縮放直接解碼成 1/2、1/4、1/8 尺寸，不必解碼整張原圖
+        img.draft("RGB", (size, size))
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        img.thumbnail((size, size), Image.LANCZOS, reducing_gap=2.0)
+        tmp = f"{dest}.{threading.get_ident()}.tmp"
+        try:
+            if pil_format == "WEBP":
+                img.save(tmp, pil_format, quality=80, method=4)
+            else:
+                img.save(tmp, pil_format, quality=80, optimize=True, progressive=True)
+            os.replace(tmp, dest)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+
+
+def _scan_cache_bytes() -> int:
+    total = 0
+    for root, _, files in os.walk(CACHE_DIR):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def _account(delta: int):
+    global _cache_bytes
+    with _lock:
+        if _cache_bytes is None:
+            _cache_bytes = _scan_cache_bytes()
+        else:
+            _cache_bytes += delta
+        if _cache_bytes > _max_bytes:
+            _evict()
+
+
+def _evict():
+    # LRU：命中時會更新檔案 mtime，淘汰最久未使用的直到低於上限的 90%
+    global _cache_bytes
+    entries = []
+    for root, _, files in os.walk(CACHE_DIR):
+        for name in files:
+            fp = os.path.join(root, name)
+            try:
+                st = os.stat(fp)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, fp))
+    entries.sort()
+    total = sum(e[1] for e in entries)
+    target = int(_max_bytes * 0.9)
+    for _, size, fp in entries:
+        if total <= target:
+            break
+        try:
+            os.remove(fp)
+            total -= size
+        except OSError:
+            pass
+    _cache_bytes = total
+
+
+def get_thumbnail(path: str, size: int = DEFAULT_SIZE, fmt: str = DEFAULT_FORMAT) -> tuple[str, str, str]:
+    """回傳 (快取檔路徑, media type, ETag)；原圖 mtime 變動時舊縮圖會被清除"""
+    size, fmt = normalize(size, fmt)
+    folder = _source_dir(path)
+    stamp = _stamp(os.stat(path))
+    dest = os.path.join(folder, f"{stamp}-{size}{FORMATS[fmt][2]}")
+    etag = f'"{stamp}-{size}-{fmt}"'
+
+    if os.path.exists(dest):
+        os.utime(dest)
+        return dest, FORMATS[fmt][1], etag
+
+    os.makedirs(folder, exist_ok=True)
+    freed = 0
+    for name in os.listdir(folder):
+        if not name.startswith(stamp):
+            try:
+                freed += os.path.getsize(os.path.join(folder, name))
+                os.remove(os.path.join(folder, name))
+            except OSError:
+                pass
+    _render(path, dest, size, fmt)
+    _account(os.path.getsize(dest) - freed)
+    return dest, FORMATS[fmt][1], etag
+
+
+def _pregenerate_one(path: str):
+    try:
+        get_thumbnail(path)
+    except Exception:
+        pass
+
+
+def pregenerate(paths: list[str]):
+    """新圖片進來時在背景執行緒先產生預設尺寸縮圖"""
+    for path in paths:
+        _pool.submit(_pregenerate_one, path)
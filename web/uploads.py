@@ -0,0 +1,132 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from . import catalog, clients, optimizer
+from .database import SessionLocal, PostHistory, PreparedPost, UploadedAsset
+
+VERIFY_HOURS = 6
+ORPHAN_DAYS = 7
+DELETE_BATCH = 100
+
+
+def _lookup(key: str) -> UploadedAsset | None:
+    db = SessionLocal()
+    try:
+        asset = db.get(UploadedAsset, key)
+        if asset is not None:
+            db.expunge(asset)
+        return asset
+    finally:
+        db.close()
+
+
+def _save(key: str, resp: dict):
+    db = SessionLocal()
+    try:
+        asset = db.get(UploadedAsset, key) or UploadedAsset(content_hash=key)
+        asset.secure_url = resp["secure_url"]
+        asset.public_id = resp.get("public_id", "")
+        asset.bytes = resp.get("bytes", 0)
+        asset.status = "active"
+        asset.created_at = asset.verified_at = datetime.now()
+        asset.published_at = None
+        db.add(asset)
+        db.commit()
+    finally:
+        db.close()
+
+
+def _set_status(key: str, status: str, verified: bool = False):
+    db = SessionLocal()
+    try:
+        asset = db.get(UploadedAsset, key)
+        if asset is None:
+            return
+        asset.status = status
+        if verified:
+            asset.verified_at = datetime.now()
+        db.commit()
+    finally:
+        db.close()
+
+
+async def upload(cfg: dict, image_path: str, post_type: str = "feed", log=None) -> str:
+    """同樣內容、同樣最佳化設定的檔案只上傳一次；重用前確認遠端資源仍存在"""
+    digest = await asyncio.to_thread(catalog.content_hash, image_path)
+    key = optimizer.upload_key(cfg, digest, post_type)
+    asset = await asyncio.to_thread(_lookup, key)
+    if asset and asset.status == "active":
+        if datetime.now() - asset.verified_at < timedelta(hours=VERIFY_HOURS):
+            return asset.secure_url
+        if await clients.url_exists(asset.secure_url):
+            await asyncio.to_thread(_set_status, key, "active", True)
+            return asset.secure_url
+        await asyncio.to_thread(_set_status, key, "deleted")
+
+    upload_path = await optimizer.optimize(cfg, image_path, digest, post_type, log)
+    resp = await clients.cloudinary_upload(cfg, upload_path)
+    await asyncio.to_thread(_save, key, resp)
+    return resp["secure_url"]
+
+
+def mark_published(image_url: str):
+    db = SessionLocal()
+    try:
+        for asset in db.query(UploadedAsset).filter(UploadedAsset.secure_url == image_url).all():
+            asset.status = "published"
+            asset.published_at = datetime.now()
+        db.commit()
+    finally:
+        db.close()
+
+
+def _sweep_candidates(cfg: dict) -> list[UploadedAsset]:
+    cutoff = datetime.now() - timedelta(days=int(cfg.get("UPLOAD_ORPHAN_DAYS", ORPHAN_DAYS)))
+    db = SessionLocal()
+    try:
+        in_use = {
+            r[0] for r in db.query(PreparedPost.image_url)
+            .filter(PreparedPost.status.in_(("preparing", "ready", "publishing"))).all()
+        }
+        # 尚未完成的發文可能還會用到已上傳的圖片
+        in_use |= {
+            r[0] for r in db.query(PostHistory.image_url)
+            .filter(PostHistory.status == "pending").all()
+        }
+        published = db.query(UploadedAsset).filter(UploadedAsset.status == "published").all()
+        abandoned = (
+            db.query(UploadedAsset)
+            .filter(UploadedAsset.status == "active", UploadedAsset.created_at < cutoff)
+            .all()
+        )
+        assets = [a for a in published + abandoned if a.secure_url not in in_use and a.public_id]
+        for a in assets:
+            db.expunge(a)
+        return assets
+    finally:
+        db.close()
+
+
+def _mark_deleted(digests: list[str]):
+    db = SessionLocal()
+    try:
+        db.query(UploadedAsset).filter(UploadedAsset.content_hash.in_(digests)) \
+            .update({UploadedAsset.status: "deleted"}, synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+
+async def sweep(cfg: dict, log=None) -> int:
+    """批次刪除已發佈或閒置過久的 Cloudinary 圖片"""
+    assets = await asyncio.to_thread(_sweep_candidates, cfg)
+    deleted = 0
+    for i in range(0, len(assets), DELETE_BATCH):
+        batch = assets[i:i + DELETE_BATCH]
+        result = await clients.cloudinary_delete(cfg, [a.public_id for a in batch])
+        done = [a.content_hash for a in batch if result.get(a.public_id) in ("deleted", "not_found")]
+        await asyncio.to_thread(_mark_deleted, done)
+        deleted += len(done)
+    if log and deleted:
+        log(f"🧹 已清除 {deleted} 張 Cloudinary 圖片")
+    return deleted